@@ -0,0 +1,125 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Load test of web interface
+
+Concurrent clients send requests to JSON batch API for a given time;
+throughput (requests per second) and latency percentiles are reported.
+Sequences are unique per request by default, so result cache does not
+hide processing.  Run from the project root against running server, e. g.
+development one (python web.py) and then production one (gunicorn -c
+gunicorn.conf.py wsgi), to compare them:
+
+    python -m bench.load_test --clients 16 --duration 30
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib import request, error
+from bench import suite
+
+
+def payload(rnd, sequences, size, mode, unique):
+    """Make body of request to /api/batch"""
+    seed = rnd.getrandbits(32) if unique else 0
+    make = suite.make_rna if mode == 'translation' else suite.make_dna
+    return json.dumps({
+        'mode': mode,
+        'sequences': [make(size, seed + i) for i in range(sequences)]
+    }).encode('utf-8')
+
+
+def client(url, args, deadline, latencies, failures, seed):
+    """Send requests one by one until deadline"""
+    rnd = random.Random(seed)
+    while time.monotonic() < deadline:
+        body = payload(rnd, args.sequences, args.size, args.mode, args.unique)
+        req = request.Request(url, body,
+                              {'Content-Type': 'application/json'})
+        begin = time.perf_counter()
+        try:
+            with request.urlopen(req, timeout=args.timeout) as response:
+                response.read()
+        except (error.URLError, OSError) as err:
+            failures.append(getattr(err, 'code', None) or str(err))
+            continue
+        latencies.append(time.perf_counter() - begin)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.load_test',
+        description='Load test of JSON batch API of running web server')
+    parser.add_argument('--url', default='http://127.0.0.1:5555/api/batch',
+                        help='URL of batch API, default is %(default)s')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='number of concurrent clients, default is '
+                             '%(default)s')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='duration of test in seconds, default is '
+                             '%(default)s')
+    parser.add_argument('--sequences', type=int, default=4,
+                        help='number of sequences in request, default is '
+                             '%(default)s')
+    parser.add_argument('--size', type=int, default=100000,
+                        help='length of sequences, default is %(default)s')
+    parser.add_argument('--mode', default='translation',
+                        choices=('replication', 'transcription',
+                                 'translation'),
+                        help='processing mode, default is %(default)s')
+    parser.add_argument('--repeat', dest='unique', action='store_false',
+                        help='send the same sequences in every request '
+                             '(measures result cache)')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='timeout of single request in seconds')
+    parser.add_argument('--output', help='save results to JSON file')
+    args = parser.parse_args(argv)
+    latencies, failures = list(), list()
+    deadline = time.monotonic() + args.duration
+    begin = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(
+        args.url, args, deadline, latencies, failures, i))
+        for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - begin
+    results = {
+        'url': args.url,
+        'clients': args.clients,
+        'sequences': args.sequences,
+        'size': args.size,
+        'mode': args.mode,
+        'requests': len(latencies),
+        'failures': len(failures),
+        'errors': sorted(set(str(f) for f in failures)),
+        'rps': len(latencies) / elapsed,
+        'latency': {
+            'p50': suite.percentile(latencies, 50) if latencies else None,
+            'p90': suite.percentile(latencies, 90) if latencies else None,
+            'p99': suite.percentile(latencies, 99) if latencies else None,
+            'max': max(latencies) if latencies else None
+        }
+    }
+    print('Requests: {} ok, {} failed in {:.1f} s'.format(
+        results['requests'], results['failures'], elapsed))
+    print('Throughput: {:.2f} requests/s'.format(results['rps']))
+    if latencies:
+        print('Latency: p50 {p50:.3f} s, p90 {p90:.3f} s, p99 {p99:.3f} s, '
+              'max {max:.3f} s'.format(**results['latency']))
+    for err in results['errors']:
+        print('Error: {}'.format(err))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if failures and not latencies else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Benchmark suite of core hot paths
+
+Inputs are synthetic and deterministic (the same seed gives the same
+chains), so results of different runs and machines are comparable.  Every
+case is run several times on fresh objects; throughput, latency
+percentiles and peak memory (by tracemalloc, in a separate run) are
+reported and may be saved in JSON file.  Saved file serves as baseline:
+cases which became slower than threshold are reported as regressions.
+
+Run from the project root:
+
+    python -m bench.suite --sizes 1K,1M,16M --output results.json
+    python -m bench.suite --baseline results.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import tracemalloc
+from core import patterns, processing, tools, transform, kmers, search
+
+
+# Default sizes of inputs (in nucleotides) and number of runs of every case
+SIZES = '1K,1M,16M'
+REPEAT = 5
+# Default relative slowdown of median latency treated as regression
+THRESHOLD = 0.2
+# Length of records in generated FASTA files
+RECORD_SIZE = 1 << 20
+# Maximal size of input of suffix array case, larger ones are skipped
+SEARCH_MAX_SIZE = 1 << 22
+# Size of blocks (in bytes) which inputs are generated by
+_BLOCK = 1 << 20
+_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(text):
+    """Parse size with optional suffix K, M or G (binary), e. g. '16M'"""
+    text = text.strip().upper()
+    if text and text[-1] in _UNITS:
+        return int(text[:-1]) * _UNITS[text[-1]]
+    return int(text)
+
+
+def random_bytes(rnd, size):
+    """Generate size random bytes by blocks"""
+    blocks = list()
+    for i in range(0, size, _BLOCK):
+        n = min(_BLOCK, size - i)
+        blocks.append(rnd.getrandbits(n * 8).to_bytes(n, 'little'))
+    return b''.join(blocks)
+
+
+def make_dna(size, seed=0):
+    """Generate random DNA chain
+
+    :param size: length of chain
+    :param seed: seed of random generator
+
+    :return: str
+    """
+    table = (patterns.dna * 64).encode('ascii')
+    return random_bytes(random.Random(seed), size).translate(
+        table).decode('ascii')
+
+
+def make_rna(size, seed=0):
+    """Generate random RNA chain which is valid for translation: start-codon,
+    codons without stop-codons and stop-codon at the end
+
+    :param size: length of chain, rounded down to whole codons (at least two)
+
+    :return: str
+    """
+    stops = transform.rna_codons.stops
+    codons = sorted(c for c in patterns.rna_to_abc if c not in stops)
+    count = max(size // 3 - 2, 0)
+    # Every random byte selects a codon, its nucleotides are spread by
+    # three translation tables
+    data = random_bytes(random.Random(seed), count)
+    chain = bytearray(count * 3)
+    for i in range(3):
+        table = ''.join(codons[b % len(codons)][i]
+                        for b in range(256)).encode('ascii')
+        chain[i::3] = data.translate(table)
+    return '{}{}{}'.format(transform.rna_codons.start, chain.decode('ascii'),
+                           sorted(stops)[0])
+
+
+def make_fasta(file_name, size, seed=0, record_size=RECORD_SIZE):
+    """Generate FASTA file with random DNA records
+
+    :param file_name: path to file
+    :param size: total length of chains
+    :param record_size: length of records (the last one may be shorter)
+
+    :return: path to file
+    """
+    with tools.FastaWriter(file_name, atomic=False) as writer:
+        for i, start in enumerate(range(0, size, record_size)):
+            writer.write('record-{}'.format(i),
+                         make_dna(min(record_size, size - start), seed + i))
+    return file_name
+
+
+def percentile(values, p):
+    """Get p-th percentile of values (nearest rank)"""
+    values = sorted(values)
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Case(object):
+    """Benchmark case
+
+    setup() makes fresh arguments for every call, so lazy or memoized
+    results of previous calls are not reused; only call() is timed.  Inputs
+    are made by setup() too, so making cases costs nothing.
+    """
+
+    def __init__(self, name, size, setup, call, teardown=None):
+        """
+        :param name: name of case
+        :param size: size of input in nucleotides (for throughput) or
+                     function without arguments which returns it
+        :param setup: function without arguments which returns arguments
+                      of call
+        :param call: function to time
+        :param teardown: function called with result of call, not timed
+        """
+        self.name = name
+        self.size = size
+        self.setup = setup
+        self.call = call
+        self.teardown = teardown
+
+    def _run(self):
+        args = self.setup()
+        begin = time.perf_counter()
+        result = self.call(*args)
+        elapsed = time.perf_counter() - begin
+        if self.teardown is not None:
+            self.teardown(result)
+        return elapsed
+
+    def run(self, repeat=REPEAT, memory=True):
+        """Run case
+
+        :param repeat: number of timed calls
+        :param memory: measure peak memory in additional call
+
+        :return: dict with results
+        """
+        if callable(self.size):
+            self.size = self.size()
+        latencies = [self._run() for _ in range(repeat)]
+        peak = None
+        if memory:
+            args = self.setup()
+            tracemalloc.start()
+            try:
+                result = self.call(*args)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            if self.teardown is not None:
+                self.teardown(result)
+        median = percentile(latencies, 50)
+        return {
+            'name': self.name,
+            'size': self.size,
+            'repeat': repeat,
+            'throughput': self.size / median / (1 << 20) if median else None,
+            'latency': {
+                'min': min(latencies),
+                'mean': sum(latencies) / len(latencies),
+                'p50': median,
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies)
+            },
+            'peak_memory': peak
+        }
+
+
+def cases(size, directory, packed=False):
+    """Make benchmark cases for input size
+
+    Inputs are generated by setup of the first case which needs them and
+    are shared by the following cases, so cases which are not run generate
+    nothing.  Suffix array case is made for sizes up to SEARCH_MAX_SIZE
+    only.
+
+    :param size: size of inputs in nucleotides
+    :param directory: directory for generated files
+    :param packed: store chains by 2 bits per nucleotide
+
+    :return: list of Case objects
+    """
+    inputs = dict()
+
+    def shared(name, make):
+        def get():
+            if name not in inputs:
+                inputs[name] = make()
+            return inputs[name]
+        return get
+
+    dna = shared('dna', lambda: make_dna(size))
+    rna = shared('rna', lambda: make_rna(size))
+    source_file = shared('source_file', lambda: make_fasta(os.path.join(
+        directory, 'source-{}.fa'.format(size)), size))
+    records = shared('records', lambda: tools.from_file(source_file()))
+
+    def chain(raw):
+        return lambda: (processing.Chain('bench', raw(), packed),)
+
+    def replicated():
+        c = processing.Chain('bench', dna(), packed)
+        c.replicate()
+        return c,
+
+    def export_name():
+        return (os.path.join(directory, 'export-{}.fa'.format(size)),
+                records())
+
+    result = [
+        Case('Chain.replicate', size, chain(dna),
+             lambda c: c.replicate()),
+        Case('Chain.transcribe', size, chain(dna),
+             lambda c: c.transcribe()),
+        Case('Chain.translate', lambda: len(rna()), chain(rna),
+             lambda c: c.translate()),
+        Case('Chain.collect_stats', size, replicated,
+             lambda c: c.collect_stats()),
+        Case('kmers.Counter', size,
+             lambda: (kmers.Counter(21, True), dna()),
+             lambda c, raw: c.update(raw)),
+        Case('search.SuffixIndex', size, lambda: ([('bench', dna())],),
+             search.SuffixIndex.build),
+        Case('tools.from_file', size, lambda: (source_file(),),
+             tools.from_file),
+        Case('tools.to_file', size, export_name,
+             lambda name, records: tools.to_file(
+                 directory, records, file_name=os.path.basename(name)),
+             os.remove)
+    ]
+    if size > SEARCH_MAX_SIZE:
+        result = [c for c in result if c.name != 'search.SuffixIndex']
+    return result
+
+
+def run(sizes, repeat=REPEAT, memory=True, only=None, packed=False,
+        log=sys.stderr):
+    """Run benchmark suite
+
+    :param sizes: list of input sizes in nucleotides
+    :param repeat: number of timed calls of every case
+    :param memory: measure peak memory
+    :param only: list of names of cases to run, default is all
+    :param packed: store chains by 2 bits per nucleotide
+    :param log: file object to report progress to, None means silence
+
+    :return: dict with environment info and list of results
+    """
+    results = list()
+    directory = tempfile.mkdtemp(prefix='chainsyn-bench-')
+    try:
+        for size in sizes:
+            for case in cases(size, directory, packed):
+                if only and case.name not in only:
+                    continue
+                result = case.run(repeat, memory)
+                results.append(result)
+                if log is not None:
+                    log.write('{:<22} {:>12}  {:>10.1f} MB/s  p50 {:.6f} s\n'
+                              ''.format(case.name, size, result['throughput']
+                                        or 0.0, result['latency']['p50']))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': transform.numpy is not None,
+        'packed': packed,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """Compare results with baseline
+
+    Cases are matched by name and size, median latencies are compared.
+
+    :param current: results of run()
+    :param baseline: results of run() taken as baseline
+    :param threshold: relative slowdown treated as regression
+
+    :return: list of (name, size, baseline p50, current p50, ratio,
+             regression flag) tuples
+    """
+    base = {(r['name'], r['size']): r for r in baseline['results']}
+    report = list()
+    for result in current['results']:
+        old = base.get((result['name'], result['size']))
+        if old is None:
+            continue
+        before, after = old['latency']['p50'], result['latency']['p50']
+        ratio = after / before if before else float('inf')
+        report.append((result['name'], result['size'], before, after, ratio,
+                       ratio > 1 + threshold))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.suite',
+        description='Benchmark of core hot paths on synthetic data')
+    parser.add_argument('--sizes', default=SIZES,
+                        help='comma-separated sizes of inputs, suffixes K, '
+                             'M, G are allowed, default is %(default)s')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='number of runs of every case, default is '
+                             '%(default)s')
+    parser.add_argument('--only', action='append',
+                        help='run only this case, e. g. Chain.translate '
+                             '(may be repeated)')
+    parser.add_argument('--packed', action='store_true',
+                        help='store chains by 2 bits per nucleotide')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='do not measure peak memory')
+    parser.add_argument('--output', help='save results to JSON file')
+    parser.add_argument('--baseline',
+                        help='JSON file with results to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='relative slowdown treated as regression, '
+                             'default is %(default)s')
+    args = parser.parse_args(argv)
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+    results = run(sizes, args.repeat, not args.no_memory, args.only,
+                  args.packed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = 0
+    print('{:<22} {:>12} {:>12} {:>12} {:>8}'.format(
+        'Case', 'Size', 'Baseline, s', 'Current, s', 'Ratio'))
+    for name, size, before, after, ratio, regression in compare(
+            results, baseline, args.threshold):
+        regressions += regression
+        print('{:<22} {:>12} {:>12.6f} {:>12.6f} {:>8.2f}{}'.format(
+            name, size, before, after, ratio,
+            '  REGRESSION' if regression else ''))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
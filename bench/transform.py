@@ -0,0 +1,51 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Benchmark of table-driven transforms against per-nucleotide loop
+
+Run from the project root:
+
+    python -m bench.transform [size in MB]
+"""
+
+import sys
+import random
+import timeit
+from core import patterns, transform
+
+
+def loop_replicate(chain):
+    """Per-nucleotide loop which Chain.replicate used before tables"""
+    dna = list()
+    for n in chain:
+        dna.append(patterns.dna_to_dna[n])
+    return ''.join(dna)
+
+
+def throughput(func, chain, repeat=3):
+    """Measure throughput of func over chain
+
+    :return: best throughput in MB/s
+    """
+    best = min(timeit.repeat(lambda: func(chain), number=1, repeat=repeat))
+    return len(chain) / best / 2 ** 20
+
+
+def main(size):
+    rnd = random.Random(0)
+    chain = ''.join(rnd.choice(patterns.dna) for _ in range(size * 2 ** 20))
+    assert transform.dna_to_dna.apply(chain)[0] == loop_replicate(chain)
+    print('Chain size: {} MB'.format(size))
+    print('loop (str):         {:10.1f} MB/s'.format(
+        throughput(loop_replicate, chain)))
+    print('table (str):        {:10.1f} MB/s'.format(
+        throughput(transform.dna_to_dna.apply, chain)))
+    print('table (bytes):      {:10.1f} MB/s'.format(
+        throughput(transform.dna_to_dna.apply, chain.encode())))
+    print('table (bytearray):  {:10.1f} MB/s'.format(
+        throughput(transform.dna_to_dna.apply, bytearray(chain.encode()))))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
@@ -1,8 +1,82 @@
 # Terminal interface settings
 EXPORT_ENABLED = False
 EXPORT_DIR = ''
+# Width of sequence lines in exported files, 0 means no wrapping
+EXPORT_WIDTH = 60
+# Compression of exported files: None, 'gzip', 'bgzip' or 'xz'
+EXPORT_COMPRESSION = None
+# Batch processing settings: number of worker processes (None means number
+# of CPUs) and number of records sent to worker at once
+BATCH_WORKERS = None
+BATCH_CHUNK_SIZE = 16
+# Single chain longer than this is split into chunks of this size (in
+# nucleotides) which are processed in parallel
+SPLIT_CHUNK_SIZE = 1 << 22
+# Store nucleotide chains by 2 bits per nucleotide to save memory
+PACKED_CHAINS = False
+# Invalid nucleotides: None - fail, 'skip' - remove them, 'mask' - replace
+# them by N
+TOLERANT = None
+# Collect metrics of processing stages (shown after results in terminal,
+# exposed at /metrics by web interface)
+METRICS_ENABLED = False
+# Persistent cache of processing results shared by front ends and sessions:
+# path to SQLite database (None disables cache) and limit of its size in
+# bytes
+DISK_CACHE_FILE = None
+DISK_CACHE_SIZE = 1 << 30
+# Default window size and step (in nucleotides) of GC profiles
+GC_WINDOW = 100
+GC_STEP = 50
+# Default k-mer size, counting of reverse complements together and number
+# of the most frequent k-mers shown by k-mer spectrum
+KMER_SIZE = 21
+KMER_CANONICAL = True
+KMER_TOP = 20
+# Maximal number of occurrences shown by motif search, search of reverse
+# complements of patterns as well
+SEARCH_LIMIT = 100
+SEARCH_REVERSE = False
 # Web interface settings
 CSRF_ENABLED = False
 SECRET_KEY = ''
 WTF_CSRF_ENABLED = False
 WTF_CSRF_SECRET_KEY = ''
+# Address of web server
+WEB_HOST = '127.0.0.1'
+WEB_PORT = 5555
+# Production serving (see gunicorn.conf.py): number of WSGI worker
+# processes and threads per process.  Caches and background jobs are kept
+# per process, so CPU-bound work is scaled by offload pool instead
+WSGI_WORKERS = 1
+WSGI_THREADS = 8
+# Shared pool of processes which requests hand processing to: number of
+# processes (None means number of CPUs), maximal number of tasks queued or
+# running (None means 4 per process) and time (in seconds) to wait for a
+# free slot before answering 503
+OFFLOAD_WORKERS = None
+OFFLOAD_MAX_PENDING = None
+OFFLOAD_QUEUE_TIMEOUT = 5
+# Limits of synchronous requests (form and JSON API): processing time in
+# seconds, total length of sequences and number of sequences in request
+REQUEST_TIMEOUT = 60
+MAX_REQUEST_SEQUENCE = 1 << 26
+MAX_REQUEST_ITEMS = 10000
+# Maximal size of request body (uploads and streams) in bytes
+MAX_CONTENT_LENGTH = 1 << 30
+# Size of chunks (in bytes) which streamed request body is read by
+STREAM_CHUNK_SIZE = 1 << 16
+# Limit of size (in bytes) of cache of results of JSON API
+RESULT_CACHE_SIZE = 64 << 20
+# Background jobs: number of jobs running at once, time to live (in
+# seconds) of their results, directory of results (None means system
+# temporary directory) and total length of chains (in nucleotides)
+# submitted by web form which are processed as a job
+JOB_WORKERS = 1
+JOB_TTL = 3600
+JOB_DIR = None
+JOB_THRESHOLD = 1 << 24
+# Allow profiling of single requests by 'profile' query parameter (cprofile
+# or tracemalloc), number of kept reports
+PROFILING_ENABLED = False
+PROFILE_KEEP = 16
@@ -0,0 +1,406 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains batch processing of many chains by pool of processes"""
+
+import os
+import time
+import array
+import itertools
+import collections
+from concurrent import futures
+from core import processing, validation, tools, cache, metrics, kmers
+
+
+# Processing modes: mode -> (Chain's method, Chain's attribute with output)
+MODES = {
+    'replication': ('replicate', 'dna2'),
+    'transcription': ('transcribe', 'rna'),
+    'translation': ('translate', 'protein')
+}
+# Number of records sent to worker process at once
+CHUNK_SIZE = 16
+
+
+def output(chain, mode):
+    """Get result of processing
+
+    :param chain: processed Chain object
+    :param mode: processing mode
+
+    :return: chain produced by processing
+    """
+    return getattr(chain, MODES[mode][1])
+
+
+def cache_key(raw, mode, tolerant=None):
+    """Get key of result of processing in cache
+
+    :return: str, see cache.make_key()
+    """
+    return cache.make_key('chain', mode, tolerant, raw)
+
+
+def dump(chain, error):
+    """Get processed chain as JSON-compatible dict for cache
+
+    Derived chain which is the source chain itself is not kept.
+
+    :param chain: processed Chain object
+    :param error: error message or None
+
+    :return: dict
+    """
+    source = 'dna1' if chain.source == 'DNA' else 'rna'
+    return {
+        'error': error,
+        'source': chain.source,
+        'raw': str(chain.raw) if chain.tolerant and chain.report and
+        chain.report.invalid else None,
+        'available': chain.available(),
+        'chains': {name: str(getattr(chain, name))
+                   for name in chain.available() if name != source},
+        'stats': chain.stats,
+        'report': chain.report.as_dict() if chain.report else None
+    }
+
+
+def load(info, raw, entry, packed=False, tolerant=None):
+    """Restore processed chain from cache, see dump()
+
+    Derived chains are restored as str even if packed is set.
+
+    :return: tuple (Chain object, error message or None)
+    """
+    chain = processing.Chain(info, raw, packed, entry['source'], tolerant)
+    if entry['raw'] is not None:
+        chain.raw = entry['raw']
+    if entry['report'] is not None:
+        chain.report = validation.Report.from_dict(entry['report'])
+    for name in entry['available']:
+        setattr(chain, name, entry['chains'].get(name, chain.raw))
+    chain.stats = entry['stats']
+    return chain, entry['error']
+
+
+def lookup(disk_cache, info, raw, mode, packed=False, tolerant=None):
+    """Get result of processing from disk cache
+
+    Errors of cache are ignored, so processing goes on without it.
+
+    :param disk_cache: cache.DiskCache object or None
+
+    :return: tuple (Chain object, error message or None), None if result
+             is not cached
+    """
+    if disk_cache is None:
+        return None
+    try:
+        entry = disk_cache.get(cache_key(raw, mode, tolerant))
+    except tools.RoutineErr:
+        return None
+    if entry is None:
+        return None
+    return load(info, raw, entry, packed, tolerant)
+
+
+def store(disk_cache, raw, mode, chain, error, tolerant=None):
+    """Put result of processing into disk cache, errors of cache are
+    ignored
+
+    :param disk_cache: cache.DiskCache object or None
+    :param raw: source chain as it was given (before cleaning)
+    """
+    if disk_cache is None:
+        return
+    try:
+        disk_cache.put(cache_key(raw, mode, tolerant), dump(chain, error))
+    except tools.RoutineErr:
+        pass
+
+
+def process(info, raw, mode, packed=False, tolerant=None, disk_cache=None):
+    """Process single chain and collect its stats
+
+    :param info: chain's description
+    :param raw: source chain
+    :param mode: processing mode: replication, transcription, translation
+    :param packed: store nucleotide chains by 2 bits per nucleotide
+    :param tolerant: validation.SKIP or validation.MASK to skip or mask
+                     invalid nucleotides instead of failing
+    :param disk_cache: cache.DiskCache object to take result from or put
+                       it into
+
+    :return: tuple (Chain object, error message or None)
+    """
+    cached = lookup(disk_cache, info, raw, mode, packed, tolerant)
+    if cached is not None:
+        return cached
+    chain = processing.Chain(info, raw, packed, tolerant=tolerant)
+    error = None
+    try:
+        getattr(chain, MODES[mode][0])(collect=True)
+    except processing.ProcessingErr as err:
+        error = str(err)
+    finally:
+        chain.collect_stats()
+    store(disk_cache, raw, mode, chain, error, tolerant)
+    return chain, error
+
+
+def _process_chunk(records, mode, packed, tolerant, measure=False,
+                   disk_cache=None):
+    """Process chunk of records in worker process
+
+    :return: tuple (list of results, metrics.snapshot() of chunk or None)
+    """
+    metrics.enable(measure)
+    metrics.reset()
+    results = [process(info, raw, mode, packed, tolerant, disk_cache)
+               for info, raw in records]
+    return results, metrics.snapshot() if measure else None
+
+
+def _chunks(records, chunk_size):
+    """Split stream of records into lists of chunk_size records"""
+    records = iter(records)
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap(pool, func, items, window, timeout=None):
+    """Map function over items in pool of workers
+
+    :param pool: concurrent.futures executor
+    :param func: function to call
+    :param items: iterable of tuples with func's arguments
+    :param window: maximum number of tasks in flight
+    :param timeout: time limit (in seconds) of the whole map
+
+    :return: generator of func's results in order of items
+    :raise concurrent.futures.TimeoutError: if time is over; tasks which
+                                            have not started are cancelled
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    items = iter(items)
+    pending = collections.deque()
+    try:
+        for args in itertools.islice(items, window):
+            pending.append(pool.submit(func, *args))
+        while pending:
+            left = None if deadline is None else \
+                max(deadline - time.monotonic(), 0)
+            result = pending.popleft().result(left)
+            for args in itertools.islice(items, 1):
+                pending.append(pool.submit(func, *args))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _gather(pool, records, mode, chunk_size, packed, tolerant, window,
+            timeout, disk_cache):
+    """Process records by chunks in pool of workers"""
+    tasks = ((chunk, mode, packed, tolerant, metrics.enabled, disk_cache)
+             for chunk in _chunks(records, max(chunk_size, 1)))
+    for results, measured in imap(pool, _process_chunk, tasks, window,
+                                  timeout):
+        if measured is not None:
+            metrics.merge(measured)
+        for result in results:
+            yield result
+
+
+def run(records, mode, workers=None, chunk_size=CHUNK_SIZE, packed=False,
+        tolerant=None, pool=None, timeout=None, disk_cache=None):
+    """Process stream of records
+
+    Records are sent to pool of worker processes by chunks.  Number of
+    chunks in flight is limited, so records are consumed from the stream
+    no faster than results are taken.  Error in one record does not stop
+    the batch but is returned along with the record.  Metrics collected
+    in worker processes are merged into metrics of current process.
+
+    :param records: iterable of (description, chain) tuples, e. g.
+                    tools.read_fasta()
+    :param mode: processing mode: replication, transcription, translation
+    :param workers: number of worker processes, default is number of CPUs;
+                    1 means processing in current process unless pool is
+                    given
+    :param chunk_size: number of records sent to worker at once
+    :param packed: store nucleotide chains by 2 bits per nucleotide
+    :param tolerant: validation.SKIP or validation.MASK to skip or mask
+                     invalid nucleotides instead of failing
+    :param pool: executor (e. g., shared offload.Pool) to use instead of
+                 own pool of workers; workers is its size then
+    :param timeout: time limit (in seconds) of processing in pool
+    :param disk_cache: cache.DiskCache object to take results from or put
+                       them into
+
+    :return: generator of (Chain object, error message or None) tuples in
+             input order
+    :raise ProcessingErr: if mode is unknown
+    :raise concurrent.futures.TimeoutError: if time is over
+    """
+    if mode not in MODES:
+        raise processing.ProcessingErr(
+            'Error in batch processing: unknown mode - {}'.format(mode))
+    workers = workers or os.cpu_count() or 1
+    if pool is not None:
+        for result in _gather(pool, records, mode, chunk_size, packed,
+                              tolerant, workers * 2, timeout, disk_cache):
+            yield result
+        return
+    if workers == 1:
+        for info, raw in records:
+            yield process(info, raw, mode, packed, tolerant, disk_cache)
+        return
+    with futures.ProcessPoolExecutor(max_workers=workers) as own:
+        for result in _gather(own, records, mode, chunk_size, packed,
+                              tolerant, workers * 2, timeout, disk_cache):
+            yield result
+
+
+def _count_chunk(records, k, canonical, measure=False):
+    """Count k-mers of chunk of records in worker process
+
+    :return: tuple (kmers.Counter object, metrics.snapshot() of chunk or
+             None)
+    """
+    metrics.enable(measure)
+    metrics.reset()
+    counter = kmers.Counter(k, canonical)
+    for info, raw in records:
+        processing.Chain(info, raw).count_kmers(k, canonical, counter)
+    return counter, metrics.snapshot() if measure else None
+
+
+def count_kmers(records, k, canonical=False, workers=None,
+                chunk_size=CHUNK_SIZE, pool=None, timeout=None):
+    """Count k-mers of stream of records
+
+    Records are sharded by chunks between worker processes as in run(),
+    counters of chunks are merged as they arrive.
+
+    :param records: iterable of (description, chain) tuples
+    :param k: k-mer size, 1..kmers.MAX_K
+    :param canonical: count k-mer and its reverse complement together
+    :param workers: number of worker processes, default is number of CPUs;
+                    1 means counting in current process unless pool is
+                    given
+    :param chunk_size: number of records sent to worker at once
+    :param pool: executor (e. g., shared offload.Pool) to use instead of
+                 own pool of workers; workers is its size then
+    :param timeout: time limit (in seconds) of counting in pool
+
+    :return: kmers.Counter object with counts of all records
+    :raise ProcessingErr: if k is out of range
+    :raise concurrent.futures.TimeoutError: if time is over
+    """
+    try:
+        counter = kmers.Counter(k, canonical)
+    except ValueError as err:
+        raise processing.ProcessingErr(
+            'Error in k-mer counting: {}'.format(err))
+    workers = workers or os.cpu_count() or 1
+    if pool is None and workers == 1:
+        for info, raw in records:
+            processing.Chain(info, raw).count_kmers(k, canonical, counter)
+        return counter
+    tasks = ((chunk, k, canonical, metrics.enabled)
+             for chunk in _chunks(records, max(chunk_size, 1)))
+    own = None
+    if pool is None:
+        pool = own = futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        for counted, measured in imap(pool, _count_chunk, tasks,
+                                      workers * 2, timeout):
+            if measured is not None:
+                metrics.merge(measured)
+            counter.merge(counted)
+    finally:
+        if own is not None:
+            own.shutdown()
+    return counter
+
+
+def profile(info, raw, window, step=None):
+    """Compute GC profile of record
+
+    Windows are kept in arrays of numbers, not in tuples, so profile takes
+    24 bytes per window in memory and in pickles of worker processes.
+
+    :return: tuple (description, tuple of arrays (start positions, GC
+             content in %, GC skew), error message or None); windows
+             computed before error are kept; rows of profile are
+             zip(*arrays)
+    """
+    columns = (array.array('q'), array.array('d'), array.array('d'))
+    starts, gcs, skews = columns
+    try:
+        for start, gc, skew in processing.Chain(info, raw).gc_profile(
+                window, step):
+            starts.append(start)
+            gcs.append(gc)
+            skews.append(skew)
+    except processing.ProcessingErr as err:
+        return info, columns, str(err)
+    return info, columns, None
+
+
+def _profile_chunk(records, window, step, measure=False):
+    """Compute GC profiles of chunk of records in worker process
+
+    :return: tuple (list of results, metrics.snapshot() of chunk or None)
+    """
+    metrics.enable(measure)
+    metrics.reset()
+    results = [profile(info, raw, window, step) for info, raw in records]
+    return results, metrics.snapshot() if measure else None
+
+
+def gc_profiles(records, window, step=None, workers=None,
+                chunk_size=CHUNK_SIZE, pool=None, timeout=None):
+    """Compute GC profiles of stream of records
+
+    Records are sent to pool of worker processes by chunks as in run().
+
+    :param records: iterable of (description, chain) tuples
+    :param window: window size in nucleotides
+    :param step: window step in nucleotides, default is window size
+    :param workers: number of worker processes, default is number of CPUs;
+                    1 means computing in current process unless pool is
+                    given
+    :param chunk_size: number of records sent to worker at once
+    :param pool: executor (e. g., shared offload.Pool) to use instead of
+                 own pool of workers; workers is its size then
+    :param timeout: time limit (in seconds) of computing in pool
+
+    :return: generator of results in order of records, see profile()
+    :raise concurrent.futures.TimeoutError: if time is over
+    """
+    workers = workers or os.cpu_count() or 1
+    if pool is None and workers == 1:
+        for info, raw in records:
+            yield profile(info, raw, window, step)
+        return
+    tasks = ((chunk, window, step, metrics.enabled)
+             for chunk in _chunks(records, max(chunk_size, 1)))
+    own = None
+    if pool is None:
+        pool = own = futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        for results, measured in imap(pool, _profile_chunk, tasks,
+                                      workers * 2, timeout):
+            if measured is not None:
+                metrics.merge(measured)
+            for result in results:
+                yield result
+    finally:
+        if own is not None:
+            own.shutdown()
@@ -0,0 +1,267 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains BGZF (blocked gzip) format support
+
+BGZF file is a series of gzip members of at most 64 KiB each, so it is
+readable by any gzip tool, while position in uncompressed data can be
+reached by decompressing a single block.  Offsets of blocks are kept in
+sidecar file (file name + '.gzi') in the same format as 'bgzip -i' uses:
+number of entries and pairs of compressed and uncompressed offsets of
+blocks (except the first one), all unsigned 64-bit little-endian.
+"""
+
+import os
+import bisect
+import struct
+import zlib
+from core import tools
+
+
+# Suffix of block index files
+SUFFIX = '.gzi'
+# Maximal size of uncompressed data in block
+BLOCK_SIZE = 0xff00
+# Empty block which marks end of file
+EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# ID1, ID2, CM, FLG, MTIME, XFL, OS, XLEN, SI1, SI2, SLEN, BSIZE
+_header = struct.Struct('<BBBBIBBHBBHH')
+_tail = struct.Struct('<II')
+_entry = struct.Struct('<QQ')
+_count = struct.Struct('<Q')
+
+
+def is_bgzf(header):
+    """Check if data is beginning of BGZF file
+
+    :param header: bytes with at least 18 first bytes of file
+
+    :return: True if header is BGZF block header
+    """
+    if len(header) < _header.size:
+        return False
+    fields = _header.unpack_from(header)
+    return (fields[:4] == (31, 139, 8, 4) and fields[7] == 6 and
+            fields[8:11] == (66, 67, 2))
+
+
+class Writer(object):
+    """Writer of data into BGZF blocks
+
+    Data is collected into blocks of BLOCK_SIZE bytes which are compressed
+    one by one.  Underlying file is not closed by close().
+    """
+
+    def __init__(self, fileobj, level=6):
+        """
+        :param fileobj: binary file object to write into
+        :param level: compression level
+        """
+        self.fileobj = fileobj
+        self.level = level
+        self.buffer = bytearray()
+        # Offsets of blocks: (compressed, uncompressed)
+        self.offsets = list()
+        self.compressed = 0
+        self.uncompressed = 0
+
+    def _block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        if self.compressed or self.uncompressed:
+            self.offsets.append((self.compressed, self.uncompressed))
+        size = _header.size + len(cdata) + _tail.size
+        self.fileobj.write(_header.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67,
+                                        2, size - 1))
+        self.fileobj.write(cdata)
+        self.fileobj.write(_tail.pack(zlib.crc32(data), len(data)))
+        self.compressed += size
+        self.uncompressed += len(data)
+
+    def write(self, data):
+        """Write data
+
+        :param data: bytes
+        """
+        self.buffer += data
+        if len(self.buffer) < BLOCK_SIZE:
+            return
+        view = memoryview(self.buffer)
+        end = len(self.buffer) - len(self.buffer) % BLOCK_SIZE
+        for i in range(0, end, BLOCK_SIZE):
+            self._block(view[i:i+BLOCK_SIZE])
+        view.release()
+        del self.buffer[:end]
+
+    def close(self):
+        """Write the rest of data and end-of-file marker"""
+        if self.buffer:
+            self._block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.fileobj.write(EOF)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def index_path(source_file):
+    """Get path to block index file of source file"""
+    return os.path.normpath(source_file) + SUFFIX
+
+
+def scan_blocks(source_file):
+    """Get offsets of blocks by reading their headers only
+
+    :param source_file: path to BGZF file
+
+    :return: list of (compressed offset, uncompressed offset) of all blocks
+    :raise RoutineErr: on file I/O error or if file is not BGZF
+    """
+    offsets = list()
+    compressed = uncompressed = 0
+    try:
+        with open(os.path.normpath(source_file), 'rb') as f:
+            while True:
+                header = f.read(_header.size)
+                if not header:
+                    break
+                if not is_bgzf(header):
+                    raise tools.RoutineErr('Not a BGZF file: {}'
+                                           ''.format(source_file))
+                size = _header.unpack(header)[-1] + 1
+                f.seek(compressed + size - 4)
+                isize = struct.unpack('<I', f.read(4))[0]
+                if isize:
+                    offsets.append((compressed, uncompressed))
+                compressed += size
+                uncompressed += isize
+    except (OSError, struct.error):
+        raise tools.RoutineErr('Could not read file: {}'.format(source_file))
+    return offsets
+
+
+def write_index(offsets, index_file):
+    """Write block index file
+
+    :param offsets: list of (compressed offset, uncompressed offset)
+    :param index_file: path to index file
+
+    :raise RoutineErr: on file I/O error
+    """
+    entries = [o for o in offsets if o != (0, 0)]
+    try:
+        with open(index_file, 'wb') as out:
+            out.write(_count.pack(len(entries)))
+            for entry in entries:
+                out.write(_entry.pack(*entry))
+    except OSError:
+        raise tools.RoutineErr('Could not write file: {}'.format(index_file))
+
+
+def read_index(index_file):
+    """Read block index file
+
+    :param index_file: path to index file
+
+    :return: list of (compressed offset, uncompressed offset) of all blocks
+    :raise RoutineErr: on file I/O error or malformed index
+    """
+    try:
+        with open(index_file, 'rb') as f:
+            data = f.read()
+        count = _count.unpack_from(data)[0]
+        entries = [_entry.unpack_from(data, _count.size + i * _entry.size)
+                   for i in range(count)]
+    except OSError:
+        raise tools.RoutineErr('Could not open file: {}'.format(index_file))
+    except struct.error:
+        raise tools.RoutineErr('Malformed index file: {}'.format(index_file))
+    return [(0, 0)] + entries
+
+
+class Reader(object):
+    """Random access to uncompressed data of BGZF file
+
+    Block index is built if it is missing or older than source file.  Only
+    blocks which overlap requested range are read and decompressed.
+    """
+
+    def __init__(self, source_file, index_file=None):
+        """
+        :param source_file: path to BGZF file
+        :param index_file: path to block index file, default is source
+                           file + '.gzi'
+
+        :raise RoutineErr: on file I/O error
+        """
+        self.source_file = os.path.normpath(source_file)
+        index_file = index_file or index_path(source_file)
+        try:
+            stale = (not os.path.isfile(index_file) or
+                     os.path.getmtime(index_file) <
+                     os.path.getmtime(self.source_file))
+            self.file = open(self.source_file, 'rb')
+        except OSError:
+            raise tools.RoutineErr('Could not open file: {}'
+                                   ''.format(source_file))
+        if stale:
+            offsets = scan_blocks(source_file)
+            write_index(offsets, index_file)
+        else:
+            offsets = read_index(index_file)
+        self.compressed = [o[0] for o in offsets]
+        self.uncompressed = [o[1] for o in offsets]
+        # The last decompressed block: (uncompressed offset, data)
+        self.cache = (None, b'')
+
+    def _block(self, i):
+        """Decompress i-th block"""
+        if self.cache[0] == self.uncompressed[i]:
+            return self.cache[1]
+        try:
+            self.file.seek(self.compressed[i])
+            header = self.file.read(_header.size)
+            size = _header.unpack(header)[-1] + 1
+            cdata = self.file.read(size - _header.size - _tail.size)
+            data = zlib.decompress(cdata, -15)
+        except (OSError, struct.error, zlib.error):
+            raise tools.RoutineErr('Could not read file: {}'
+                                   ''.format(self.source_file))
+        self.cache = (self.uncompressed[i], data)
+        return data
+
+    def read(self, offset, size):
+        """Read uncompressed data
+
+        :param offset: offset in uncompressed data
+        :param size: number of bytes to read
+
+        :return: bytes, shorter than size at the end of data
+        :raise RoutineErr: on file I/O error
+        """
+        i = bisect.bisect_right(self.uncompressed, offset) - 1
+        parts = list()
+        position = offset
+        end = offset + size
+        while i >= 0 and i < len(self.uncompressed) and position < end:
+            start = self.uncompressed[i]
+            data = self._block(i)
+            parts.append(data[position - start:end - start])
+            position = start + len(data)
+            i += 1
+        return b''.join(parts)
+
+    def close(self):
+        """Close source file"""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,304 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains caches of processing results
+
+Results are addressed by hash of their input (e. g., processing mode and
+source chain), so equal inputs share one entry regardless of where they
+come from.  LRUCache is kept in memory of a process, DiskCache persists in
+SQLite database shared by processes and sessions.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import collections
+from core import tools, metrics
+
+
+# Default limit of cache size in bytes
+MAX_SIZE = 64 << 20
+# Default limit of size of disk cache in bytes (compressed)
+DISK_MAX_SIZE = 1 << 30
+
+
+def make_key(*parts):
+    """Make content-addressed key
+
+    :param parts: str or None parts of input, e. g. mode and chain
+
+    :return: str with hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        part = '' if part is None else str(part)
+        digest.update('{}:'.format(len(part)).encode('ascii'))
+        digest.update(part.encode('utf-8', 'replace'))
+    return digest.hexdigest()
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by total size of entries
+
+    Size of every entry is given on put(); least recently used entries are
+    evicted while total size exceeds the limit.  Entry larger than the
+    limit is not cached.  Cache is safe to share between threads.
+    """
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+        :param max_size: limit of total size of entries in bytes
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """Get entry and mark it as recently used
+
+        :param key: entry's key
+
+        :return: cached value or default
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Put entry, evicting least recently used ones if needed
+
+        :param key: entry's key
+        :param value: value to cache
+        :param size: size of entry in bytes
+        """
+        if size > self.max_size:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries, counters are kept"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def info(self):
+        """Get counters of cache
+
+        :return: dict with hits, misses, evictions, number of entries,
+                 size and limit of size in bytes
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size
+            }
+
+
+class DiskCache(object):
+    """Persistent least recently used cache in SQLite database
+
+    Values are JSON-compatible objects, they are stored compressed by zlib;
+    size of entry is size of its compressed value.  Least recently used
+    entries are evicted while total size exceeds the limit.  Database may
+    be shared by threads and processes: every thread of a process opens own
+    connection, writes are serialized by database locks and readers are
+    not blocked by them (write-ahead log).  Cache object is picklable, so
+    it may be sent to worker processes.
+    """
+
+    def __init__(self, file_name, max_size=DISK_MAX_SIZE, level=1,
+                 timeout=30):
+        """
+        :param file_name: path to database file, it is created if missing
+        :param max_size: limit of total size of entries in bytes
+        :param level: compression level
+        :param timeout: time (in seconds) to wait for lock of database
+
+        :raise RoutineErr: if database could not be opened
+        """
+        self.file_name = os.path.normpath(file_name)
+        self.max_size = max_size
+        self.level = level
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.local = threading.local()
+        self._db()
+
+    def __getstate__(self):
+        return {'file_name': self.file_name, 'max_size': self.max_size,
+                'level': self.level, 'timeout': self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _db(self):
+        """Get connection of current thread, open it if needed"""
+        db = getattr(self.local, 'db', None)
+        # Connection must not be used by process forked after opening
+        if db is not None and self.local.pid == os.getpid():
+            return db
+        try:
+            db = sqlite3.connect(self.file_name, timeout=self.timeout,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                       'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                       'size INTEGER NOT NULL, used REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_used '
+                       'ON entries (used)')
+        except sqlite3.Error as err:
+            raise tools.RoutineErr('Could not open cache: {} ({})'.format(
+                self.file_name, err))
+        self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def get(self, key, default=None):
+        """Get entry and mark it as recently used
+
+        :param key: entry's key
+
+        :raise RoutineErr: on database error
+
+        :return: cached value or default
+        """
+        try:
+            db = self._db()
+            row = db.execute('SELECT value FROM entries WHERE key = ?',
+                             (key,)).fetchone()
+            if row is not None:
+                db.execute('UPDATE entries SET used = ? WHERE key = ?',
+                           (time.time(), key))
+        except sqlite3.Error as err:
+            raise tools.RoutineErr('Could not read cache: {} ({})'.format(
+                self.file_name, err))
+        value = default
+        if row is not None:
+            try:
+                value = json.loads(zlib.decompress(row[0]).decode('utf-8'))
+            except (zlib.error, ValueError):
+                # Damaged entry is a miss
+                row = None
+        if row is None:
+            self.misses += 1
+            metrics.count('cache.disk_misses')
+        else:
+            self.hits += 1
+            metrics.count('cache.disk_hits')
+        return value
+
+    def put(self, key, value):
+        """Put entry, evicting least recently used ones if needed
+
+        :param key: entry's key
+        :param value: JSON-compatible value
+
+        :raise RoutineErr: on database error
+        """
+        data = zlib.compress(json.dumps(value).encode('utf-8'), self.level)
+        if len(data) > self.max_size:
+            return
+        try:
+            db = self._db()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute('INSERT OR REPLACE INTO entries VALUES '
+                           '(?, ?, ?, ?)', (key, data, len(data), time.time()))
+                excess = db.execute('SELECT TOTAL(size) FROM entries'
+                                    '').fetchone()[0] - self.max_size
+                evicted = list()
+                if excess > 0:
+                    for old, size in db.execute(
+                            'SELECT key, size FROM entries ORDER BY used'):
+                        if excess <= 0:
+                            break
+                        evicted.append((old,))
+                        excess -= size
+                    db.executemany('DELETE FROM entries WHERE key = ?',
+                                   evicted)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as err:
+            raise tools.RoutineErr('Could not write cache: {} ({})'.format(
+                self.file_name, err))
+        self.evictions += len(evicted)
+
+    def clear(self):
+        """Remove all entries, counters are kept
+
+        :raise RoutineErr: on database error
+        """
+        try:
+            self._db().execute('DELETE FROM entries')
+        except sqlite3.Error as err:
+            raise tools.RoutineErr('Could not write cache: {} ({})'.format(
+                self.file_name, err))
+
+    def info(self):
+        """Get counters of cache
+
+        Hits, misses and evictions are counted by this object only, number
+        of entries and size are of the whole database.
+
+        :return: dict with hits, misses, evictions, number of entries,
+                 size and limit of size in bytes
+        :raise RoutineErr: on database error
+        """
+        try:
+            entries, size = self._db().execute(
+                'SELECT COUNT(*), TOTAL(size) FROM entries').fetchone()
+        except sqlite3.Error as err:
+            raise tools.RoutineErr('Could not read cache: {} ({})'.format(
+                self.file_name, err))
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'size': int(size),
+            'max_size': self.max_size
+        }
+
+    def close(self):
+        """Close connection of current thread"""
+        db = getattr(self.local, 'db', None)
+        if db is not None and self.local.pid == os.getpid():
+            db.close()
+        self.local.db = None
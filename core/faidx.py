@@ -0,0 +1,344 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Indexed random access into files in FASTA format
+
+Index is kept in sidecar file (source file name + '.fai') in the same
+format as 'samtools faidx' uses: one line per record with tab-separated
+name, length, offset of the first nucleotide, nucleotides per line and
+bytes per line.  Files compressed by bgzip are supported as well: offsets
+refer to uncompressed data, which is reached through block index (see
+bgzf).
+"""
+
+import os
+import re
+import mmap
+from core import tools, bgzf
+
+
+# Suffix of index files
+SUFFIX = '.fai'
+# Size of chunks (in bytes) which FASTA files are read by on indexing
+CHUNK_SIZE = 1 << 20
+
+
+class _Builder(object):
+    """Incremental builder of FASTA index
+
+    Data is fed by chunks of arbitrary size; only offsets and line lengths
+    are tracked, so long lines never have to be kept in memory.
+    """
+
+    def __init__(self):
+        self.entries = list()
+        self.pos = 0
+        self.line = 0
+        self.header = None
+        self.cr = False
+        self.record = None
+        self.short = False
+
+    def _error(self):
+        raise tools.RoutineErr('Different line length in record {}'
+                               ''.format(self.record[0]))
+
+    def _finish(self):
+        if self.record is not None:
+            self.entries.append(tuple(self.record))
+            self.record = None
+
+    def _part(self, piece):
+        """Add piece of current line"""
+        if not piece:
+            return
+        if not self.line and piece.startswith(b'>'):
+            self.header = bytearray()
+        if self.header is not None:
+            self.header += piece
+        self.line += len(piece)
+        self.cr = piece.endswith(b'\r')
+
+    def _sequence(self, bases, width):
+        """Account sequence line
+
+        :param bases: number of nucleotides in line
+        :param width: number of bytes in line or None for the last line
+                      without line break
+        """
+        if self.record is None:
+            return
+        record = self.record
+        if not bases:
+            self.short = True
+        elif self.short:
+            self._error()
+        elif not record[3]:
+            record[3], record[4] = bases, width or bases + 1
+        elif bases > record[3] or (bases == record[3] and width and
+                                   width != record[4]):
+            self._error()
+        elif bases < record[3]:
+            self.short = True
+        record[1] += bases
+
+    def _end(self, last=False):
+        """Finish current line
+
+        :param last: True if line is not followed by line break
+        """
+        width = self.line + (0 if last else 1)
+        if self.header is not None:
+            self._finish()
+            name = self.header[1:].decode('latin-1').split()
+            self.record = [name[0] if name else '', 0, self.pos + width, 0, 0]
+            self.short = False
+        else:
+            bases = self.line - (1 if self.cr else 0)
+            self._sequence(bases, None if last else width)
+        self.pos += width
+        self.line, self.header, self.cr = 0, None, False
+
+    def feed(self, chunk):
+        """Index next chunk of data
+
+        :param chunk: bytes with next part of FASTA data
+        """
+        pieces = chunk.split(b'\n')
+        last = len(pieces) - 1
+        if not last:
+            self._part(pieces[0])
+            return
+        self._part(pieces[0])
+        self._end()
+        middle = pieces[1:last]
+        record = self.record
+        raw = record[4] - 1 if record is not None else 0
+        if (middle and record is not None and record[3] and not self.short and
+                max(map(len, middle)) == raw and
+                sum(map(len, middle)) == raw * len(middle) and
+                b'\n>' not in chunk):
+            # Fast path: run of full lines without headers
+            record[1] += record[3] * len(middle)
+            self.pos += record[4] * len(middle)
+        else:
+            for piece in middle:
+                self._part(piece)
+                self._end()
+        self._part(pieces[last])
+
+    def close(self):
+        """Finish indexing
+
+        :return: list of (name, length, offset, line bases, line width)
+        """
+        if self.line:
+            self._end(last=True)
+        self._finish()
+        return self.entries
+
+
+def index_path(source_file):
+    """Get path to index file of source file"""
+    return os.path.normpath(source_file) + SUFFIX
+
+
+def build_index(source_file, index_file=None):
+    """Build index of source file in FASTA format and write it to sidecar file
+
+    :param source_file: path to source file
+    :param index_file: path to index file, default is source file + '.fai'
+
+    :return: list of (name, length, offset, line bases, line width)
+    :raise RoutineErr: on file I/O error or irregular line lengths
+    """
+    builder = _Builder()
+    with tools.open_source(source_file) as f:
+        while True:
+            try:
+                chunk = f.read(CHUNK_SIZE)
+            except tools.READ_ERRORS:
+                raise tools.RoutineErr('Could not read file: {}'
+                                       ''.format(source_file))
+            if not chunk:
+                break
+            builder.feed(chunk)
+    entries = builder.close()
+    index_file = index_file or index_path(source_file)
+    try:
+        with open(index_file, 'wt') as out:
+            for entry in entries:
+                out.write('\t'.join(str(e) for e in entry) + '\n')
+    except OSError:
+        raise tools.RoutineErr('Could not write file: {}'.format(index_file))
+    return entries
+
+
+def read_index(index_file):
+    """Read index file
+
+    :param index_file: path to index file
+
+    :return: list of (name, length, offset, line bases, line width)
+    :raise RoutineErr: on file I/O error or malformed index
+    """
+    entries = list()
+    try:
+        with open(index_file, 'rt') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 5:
+                    continue
+                entries.append((fields[0],) +
+                               tuple(int(i) for i in fields[1:5]))
+    except OSError:
+        raise tools.RoutineErr('Could not open file: {}'.format(index_file))
+    except ValueError:
+        raise tools.RoutineErr('Malformed index file: {}'.format(index_file))
+    return entries
+
+
+def parse_region(region):
+    """Parse region string
+
+    Region is written as 'name', 'name:begin' or 'name:begin-end' where
+    positions are 1-based and inclusive, like in samtools.
+
+    :param region: region string
+
+    :return: tuple (name, start, end) with 0-based half-open coordinates,
+             end is None if not set
+    """
+    name, _, span = region.rpartition(':')
+    match = re.fullmatch('([0-9,]+)(?:-([0-9,]+))?', span)
+    if not name or not match:
+        return region, 0, None
+    start = max(int(match.group(1).replace(',', '')) - 1, 0)
+    end = match.group(2)
+    return name, start, int(end.replace(',', '')) if end else None
+
+
+class FastaIndex(object):
+    """Random access to records of file in FASTA format
+
+    Source file is memory-mapped and only requested bytes are touched;
+    file compressed by bgzip is read by blocks which overlap requested
+    range.  Index is built if it is missing or older than source file.
+    """
+
+    def __init__(self, source_file, index_file=None):
+        """
+        :param source_file: path to source file
+        :param index_file: path to index file, default is source file + '.fai'
+
+        :raise RoutineErr: on file I/O error or if source file is compressed
+                           by other tool than bgzip
+        """
+        self.source_file = os.path.normpath(source_file)
+        self.map = self.reader = None
+        kind = tools.compression(source_file)
+        if kind not in (None, 'bgzip'):
+            raise tools.RoutineErr('Random access to {} file is not supported,'
+                                   ' use bgzip: {}'.format(kind, source_file))
+        index_file = index_file or index_path(source_file)
+        try:
+            stale = (not os.path.isfile(index_file) or
+                     os.path.getmtime(index_file) <
+                     os.path.getmtime(self.source_file))
+        except OSError:
+            raise tools.RoutineErr('Could not open file: {}'
+                                   ''.format(source_file))
+        if stale:
+            entries = build_index(source_file, index_file)
+        else:
+            entries = read_index(index_file)
+        self.entries = dict()
+        for entry in entries:
+            self.entries.setdefault(entry[0], entry[1:])
+        self.names = [entry[0] for entry in entries]
+        if kind == 'bgzip':
+            self.reader = bgzf.Reader(source_file)
+            return
+        try:
+            with open(self.source_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size:
+                    self.map = mmap.mmap(f.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+                else:
+                    self.map = None
+        except OSError:
+            raise tools.RoutineErr('Could not open file: {}'
+                                   ''.format(source_file))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        """Unmap or close source file"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def length(self, name):
+        """Get length of record
+
+        :param name: record's name
+
+        :return: number of nucleotides in record
+        :raise RoutineErr: if record is not found
+        """
+        if name not in self.entries:
+            raise tools.RoutineErr('Record not found: {}'.format(name))
+        return self.entries[name][0]
+
+    def fetch(self, name, start=0, end=None):
+        """Get record or its subrange
+
+        :param name: record's name
+        :param start: 0-based start position
+        :param end: 0-based end position (exclusive), None for record's end
+
+        :return: str with chain in upper case
+        :raise RoutineErr: if record is not found
+        """
+        length = self.length(name)
+        offset, line_bases, line_width = self.entries[name][1:]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+        if start >= end:
+            return ''
+        first = offset + start // line_bases * line_width + start % line_bases
+        last = (offset + (end - 1) // line_bases * line_width +
+                (end - 1) % line_bases + 1)
+        if self.reader is not None:
+            data = self.reader.read(first, last - first)
+        else:
+            data = self.map[first:last]
+        if line_width != line_bases:
+            data = data.translate(None, b'\r\n')
+        return data.decode('latin-1').upper()
+
+    def fetch_region(self, region):
+        """Get record or its subrange by region string
+
+        :param region: region string, see parse_region()
+
+        :return: str with chain in upper case
+        :raise RoutineErr: if record is not found
+        """
+        if region in self.entries:
+            return self.fetch(region)
+        return self.fetch(*parse_region(region))
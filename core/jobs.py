@@ -0,0 +1,257 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains queue of background processing jobs
+
+Jobs run in local pool of threads (each of them may use pool of processes,
+see batch.run()), no external broker is needed.  Results are written into
+files in FASTA format and expire after time to live since job's end; errors
+of single records are written as comment lines (';') instead of records.
+"""
+
+import os
+import time
+import uuid
+import tempfile
+import threading
+from concurrent import futures
+from core import processing, batch, tools
+
+
+# Default time to live (in seconds) of finished jobs and their results
+TTL = 3600
+# States of jobs
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job(object):
+    """Background processing job
+
+    Progress attributes are updated while job is running: bytes_read is
+    position in input file (compressed if it is), which is comparable with
+    input_bytes; records, nucleotides and errors count processed records.
+    """
+
+    def __init__(self, mode, input_bytes=None):
+        """
+        :param mode: processing mode
+        :param input_bytes: size of input file in bytes if known
+        """
+        self.id = uuid.uuid4().hex
+        self.mode = mode
+        self.state = QUEUED
+        self.input_bytes = input_bytes
+        self.bytes_read = 0
+        self.records = 0
+        self.nucleotides = 0
+        self.errors = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result_file = None
+        self.input_file = None
+        self.cancelled = False
+
+    @property
+    def ended(self):
+        """True if job is not queued or running"""
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def info(self):
+        """Get state and progress of job
+
+        :return: dict (e. g., for JSON)
+        """
+        return {
+            'id': self.id,
+            'mode': self.mode,
+            'state': self.state,
+            'records': self.records,
+            'nucleotides': self.nucleotides,
+            'errors': self.errors,
+            'input_bytes': self.input_bytes,
+            'bytes_read': self.bytes_read,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+
+class JobQueue(object):
+    """Queue of background processing jobs"""
+
+    def __init__(self, threads=1, ttl=TTL, directory=None, **options):
+        """
+        :param threads: number of jobs running at once
+        :param ttl: time to live (in seconds) of finished jobs
+        :param directory: directory of result files, default is system
+                          temporary directory
+        :param options: default keyword arguments of batch.run(), e. g.
+                        workers, chunk_size, packed, tolerant
+        """
+        self.ttl = ttl
+        self.directory = directory
+        self.options = options
+        self.jobs = dict()
+        self.lock = threading.Lock()
+        self.pool = futures.ThreadPoolExecutor(max_workers=threads)
+
+    def submit(self, mode, records=None, input_file=None, input_bytes=None,
+               **options):
+        """Submit processing job
+
+        :param mode: processing mode: replication, transcription, translation
+        :param records: iterable of (description, chain) tuples
+        :param input_file: path to file in FASTA format to read records from
+                           instead; file is owned by job and removed when
+                           job is finished
+        :param input_bytes: size of input in bytes if known, default is
+                            size of input_file
+        :param options: keyword arguments of batch.run() which override
+                        default ones
+
+        :raise ProcessingErr: if mode is unknown
+
+        :return: Job object
+        """
+        if mode not in batch.MODES:
+            raise processing.ProcessingErr(
+                'Error in job: unknown mode - {}'.format(mode))
+        self.sweep()
+        job = Job(mode, input_bytes)
+        if input_file is not None:
+            job.input_file = input_file
+            if input_bytes is None:
+                job.input_bytes = os.path.getsize(input_file)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.pool.submit(self._run, job, records,
+                         dict(self.options, **options))
+        return job
+
+    def _run(self, job, records, options):
+        """Run job in pool's thread"""
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        job.state, job.started = RUNNING, time.time()
+        try:
+            try:
+                fd, job.result_file = tempfile.mkstemp(
+                    suffix='.fa', prefix='job-{}-'.format(job.id),
+                    dir=self.directory)
+                os.close(fd)
+            except OSError:
+                raise tools.RoutineErr('Could not create result file')
+            if job.input_file is not None:
+                records = _read_input(job)
+            with tools.FastaWriter(job.result_file, width=0,
+                                   atomic=False) as writer:
+                for chain, error in batch.run(records, job.mode, **options):
+                    if error:
+                        writer.comment('{}: {}'.format(chain.info, error))
+                        job.errors += 1
+                    else:
+                        writer.write(chain.info, batch.output(chain, job.mode))
+                    job.records += 1
+                    job.nucleotides += len(chain.raw)
+                    if job.cancelled:
+                        break
+        except (tools.RoutineErr, processing.ProcessingErr) as err:
+            job.error = str(err)
+            self._finish(job, FAILED)
+        except Exception as err:
+            job.error = 'Unexpected error: {!r}'.format(err)
+            self._finish(job, FAILED)
+        else:
+            self._finish(job, CANCELLED if job.cancelled else DONE)
+
+    def _finish(self, job, state):
+        job.state, job.finished = state, time.time()
+        _remove(job.input_file)
+        job.input_file = None
+
+    def get(self, job_id):
+        """Get job by its id
+
+        :param job_id: job's id
+
+        :return: Job object or None if job is unknown or expired
+        """
+        self.sweep()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel job or remove finished one with its results
+
+        Running job is stopped after the record being processed.
+
+        :param job_id: job's id
+
+        :return: True if job has been found
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancelled = True
+            if job.ended:
+                del self.jobs[job_id]
+                _remove(job.result_file)
+        return True
+
+    def sweep(self):
+        """Remove expired jobs and their results"""
+        deadline = time.time() - self.ttl
+        with self.lock:
+            expired = [job for job in self.jobs.values()
+                       if job.ended and job.finished < deadline]
+            for job in expired:
+                del self.jobs[job.id]
+                _remove(job.result_file)
+
+    def shutdown(self):
+        """Cancel all jobs, wait for running ones and remove results"""
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancelled = True
+        self.pool.shutdown(wait=True)
+        with self.lock:
+            for job in self.jobs.values():
+                _remove(job.result_file)
+            self.jobs.clear()
+
+
+def _read_input(job):
+    """Read records from job's input file, bytes_read of job follows
+    position in file
+
+    :return: generator of (description, chain) tuples
+    :raise RoutineErr: on file I/O error
+    """
+    try:
+        f = open(job.input_file, 'rb')
+    except OSError:
+        raise tools.RoutineErr('Could not open file: {}'.format(
+            job.input_file))
+    with f:
+        for record in tools.read_stream(f):
+            job.bytes_read = f.tell()
+            yield record
+
+
+def _remove(file_name):
+    """Remove file if it exists"""
+    if file_name is not None:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
@@ -0,0 +1,348 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains k-mer counting engine
+
+K-mers are coded by integers with 2 bits per nucleotide (A - 0, C - 1,
+G - 2, T/U - 3, as in packing), so k up to 31 fits 64-bit integer and no
+substring is made per position.  Without numpy codes are computed by
+rolling update (code = code << 2 | nucleotide); with numpy windows of the
+whole block are combined by doubling: codes of width w and of width w are
+merged into width 2w by one shift and OR, so block of n nucleotides costs
+O(n log k) vectorized operations.  K-mers which cover non-nucleotides
+(e. g. N) are not counted.
+
+Canonical k-mer is the least one of k-mer and its reverse complement, so
+both strands are counted together.
+
+Counts of short k-mers are kept in array indexed by code, counts of long
+ones - in sorted arrays of codes and counts (dict without numpy).
+Counters of different records may be merged, see batch.count_kmers().
+"""
+
+import heapq
+import collections
+from core import patterns, packing, metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Maximal k-mer size (codes fit 64-bit integer)
+MAX_K = 31
+# K-mers not longer than this are counted in array of 4 ** k counters
+DENSE_K = 11
+# Size of blocks (in nucleotides) which chain is counted by
+BLOCK_SIZE = 1 << 22
+# Number of counted codes which are merged into sorted arrays at once
+MERGE_SIZE = 1 << 22
+
+_INVALID = 4
+
+
+def _compile_tables():
+    """Compile tables of 2-bit codes and complements of codes
+
+    :return: tuple (bytes: byte of nucleotide -> code or _INVALID,
+             bytes: code -> code of complement nucleotide)
+    """
+    codes = bytearray([_INVALID]) * 256
+    for code, n in enumerate(packing.DNA):
+        codes[ord(n)] = codes[ord(n.lower())] = code
+    for n in 'Uu':
+        codes[ord(n)] = codes[ord('T')]
+    complements = bytearray(4)
+    for n, c in patterns.dna_to_dna.items():
+        complements[codes[ord(n)]] = codes[ord(c)]
+    return bytes(codes), bytes(complements)
+
+
+_codes, _complements = _compile_tables()
+
+
+def encode(kmer):
+    """Get code of k-mer
+
+    :param kmer: str with nucleotides
+
+    :raise ValueError: if kmer contains non-nucleotide
+
+    :return: int
+    """
+    code = 0
+    for n in kmer.encode('ascii', 'replace').translate(_codes):
+        if n == _INVALID:
+            raise ValueError('Unexpected nucleotide in k-mer: {}'.format(
+                kmer))
+        code = code << 2 | n
+    return code
+
+
+def decode(code, k):
+    """Get k-mer by its code
+
+    :param code: int
+    :param k: k-mer size
+
+    :return: str with DNA nucleotides
+    """
+    return ''.join(packing.DNA[code >> 2 * (k - 1 - i) & 3]
+                   for i in range(k))
+
+
+def reverse_complement(code, k):
+    """Get code of reverse complement of k-mer"""
+    result = 0
+    for _ in range(k):
+        result = result << 2 | _complements[code & 3]
+        code >>= 2
+    return result
+
+
+def _windows(codes, k):
+    """Combine codes of nucleotides into codes of all k-mers by doubling
+
+    :param codes: numpy array (uint64) of codes of nucleotides
+    :param k: k-mer size, not greater than len(codes)
+
+    :return: numpy array (uint64) of len(codes) - k + 1 codes
+    """
+    result, width = None, 0
+    power, power_width = codes, 1
+    while True:
+        if k & 1:
+            if result is None:
+                result, width = power, power_width
+            else:
+                size = len(power) - width
+                result = result[:size] << numpy.uint64(2 * power_width) | \
+                    power[width:width + size]
+                width += power_width
+        k >>= 1
+        if not k:
+            return result
+        power = power[:-power_width] << numpy.uint64(2 * power_width) | \
+            power[power_width:]
+        power_width *= 2
+
+
+def _merge_sorted(parts):
+    """Merge (codes, counts) pairs into sorted arrays of unique codes and
+    total counts"""
+    codes = numpy.concatenate([p[0] for p in parts])
+    counts = numpy.concatenate([p[1] for p in parts])
+    order = numpy.argsort(codes, kind='stable')
+    codes, counts = codes[order], counts[order]
+    if not len(codes):
+        return codes, counts
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True], codes[1:] != codes[:-1])))
+    return codes[starts], numpy.add.reduceat(counts, starts)
+
+
+class Counter(object):
+    """Accumulator of k-mer counts
+
+    Feed chains by update() (every call is a separate chain, k-mers do not
+    cross calls), merge counters of other chains by merge(), then get the
+    most frequent k-mers by top().
+    """
+
+    def __init__(self, k, canonical=False):
+        """
+        :param k: k-mer size, 1..MAX_K
+        :param canonical: count k-mer and its reverse complement together
+
+        :raise ValueError: if k is out of range
+        """
+        if not 1 <= k <= MAX_K:
+            raise ValueError('K-mer size should be in range 1..{}'.format(
+                MAX_K))
+        self.k = k
+        self.canonical = canonical
+        self.total = 0
+        self.table = None
+        self.codes = None
+        self.counts = None
+        self.counter = None
+        self.pending = list()
+        self.pending_size = 0
+        if numpy is None:
+            self.counter = collections.Counter()
+        elif k <= DENSE_K:
+            self.table = numpy.zeros(4 ** k, dtype=numpy.int64)
+        else:
+            self.codes = numpy.zeros(0, dtype=numpy.uint64)
+            self.counts = numpy.zeros(0, dtype=numpy.int64)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.table is not None:
+            # Array of counters is mostly zeros for short chains
+            codes = numpy.flatnonzero(self.table)
+            state['table'] = (codes, self.table[codes])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.table is not None:
+            codes, counts = self.table
+            self.table = numpy.zeros(4 ** self.k, dtype=numpy.int64)
+            self.table[codes] = counts
+
+    @metrics.timed('kmers.count')
+    def update(self, chain):
+        """Count k-mers of chain
+
+        :param chain: str or packing.PackedSequence with nucleotides
+        """
+        k = self.k
+        for i in range(0, len(chain) - k + 1, BLOCK_SIZE):
+            # Blocks overlap by k - 1 nucleotides, so every k-mer is
+            # counted once
+            block = str(chain[i:i + BLOCK_SIZE + k - 1])
+            if numpy is None:
+                self._update_python(block)
+            else:
+                self._update_numpy(block)
+
+    def _update_python(self, block):
+        k = self.k
+        mask = (1 << 2 * k) - 1
+        shift = 2 * (k - 1)
+        code = reverse = run = 0
+        counter = self.counter
+        for n in block.encode('ascii', 'replace').translate(_codes):
+            if n == _INVALID:
+                run = 0
+                continue
+            code = (code << 2 | n) & mask
+            reverse = reverse >> 2 | _complements[n] << shift
+            run += 1
+            if run >= k:
+                counter[min(code, reverse) if self.canonical else code] += 1
+                self.total += 1
+
+    def _update_numpy(self, block):
+        k = self.k
+        raw = numpy.frombuffer(block.encode('ascii', 'replace'),
+                               dtype=numpy.uint8)
+        codes = _codes_array[raw]
+        invalid = numpy.concatenate(([0], numpy.cumsum(codes == _INVALID)))
+        valid = invalid[k:] == invalid[:-k]
+        codes &= 3
+        kmers = _windows(codes.astype(numpy.uint64), k)
+        if self.canonical:
+            reverse = _windows(_complements_array[codes[::-1]].astype(
+                numpy.uint64), k)[::-1]
+            kmers = numpy.minimum(kmers, reverse)
+        kmers = kmers[valid]
+        self.total += len(kmers)
+        if self.table is not None:
+            if len(kmers) * 16 < len(self.table):
+                # Short block: only its distinct codes are added, so cost
+                # does not depend on size of table (4 ** k)
+                codes, counts = numpy.unique(kmers, return_counts=True)
+                self.table[codes.astype(numpy.intp)] += counts
+            else:
+                self.table += numpy.bincount(kmers.astype(numpy.intp),
+                                             minlength=len(self.table))
+        elif len(kmers):
+            self._add(*numpy.unique(kmers, return_counts=True))
+
+    def _add(self, codes, counts):
+        """Add sorted unique codes and their counts, parts are merged when
+        their size reaches size of already merged arrays"""
+        self.pending.append((codes, counts.astype(numpy.int64)))
+        self.pending_size += len(codes)
+        if self.pending_size >= max(len(self.codes), MERGE_SIZE):
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.codes, self.counts = _merge_sorted(
+                [(self.codes, self.counts)] + self.pending)
+            self.pending, self.pending_size = list(), 0
+
+    def merge(self, other):
+        """Add counts of another counter
+
+        :param other: Counter object with the same k and canonical flag
+
+        :raise ValueError: if counters are not compatible
+        """
+        if (other.k, other.canonical) != (self.k, self.canonical):
+            raise ValueError('Counters of different k-mers can not be '
+                             'merged')
+        self.total += other.total
+        if self.table is not None:
+            self.table += other.table
+        elif self.codes is not None:
+            other._flush()
+            if len(other.codes):
+                self._add(other.codes, other.counts)
+        else:
+            self.counter.update(other.counter)
+
+    @property
+    def distinct(self):
+        """Number of distinct k-mers"""
+        if self.table is not None:
+            return int(numpy.count_nonzero(self.table))
+        if self.codes is not None:
+            self._flush()
+            return len(self.codes)
+        return len(self.counter)
+
+    def _ranked(self, n):
+        """Get codes and counts of the most frequent k-mers
+
+        :return: tuple (codes, counts) in order of decreasing count, k-mers
+                 with equal counts are ordered alphabetically
+        """
+        if self.table is not None:
+            codes = numpy.flatnonzero(self.table)
+            counts = self.table[codes]
+        else:
+            self._flush()
+            codes, counts = self.codes, self.counts
+        if n is not None and 0 < n < len(codes):
+            # Select candidates including all k-mers tied with the n-th one;
+            # counts are mostly small and equal, so histogram of counts
+            # finds the n-th one faster than partition
+            largest = int(counts.max())
+            if largest <= len(counts):
+                ranks = numpy.cumsum(numpy.bincount(counts)[::-1])
+                threshold = largest - int(numpy.searchsorted(ranks, n))
+            else:
+                threshold = numpy.partition(counts, len(counts) - n)[-n]
+            selected = counts >= threshold
+            codes, counts = codes[selected], counts[selected]
+        order = numpy.lexsort((codes, -counts))[:n]
+        return codes[order], counts[order]
+
+    def top(self, n=None):
+        """Get the most frequent k-mers
+
+        :param n: number of k-mers, None means all
+
+        :return: generator of (k-mer, count) tuples in order of decreasing
+                 count, k-mers with equal counts are ordered alphabetically
+        """
+        if numpy is None:
+            ranked = heapq.nsmallest(n, self.counter.items(),
+                                     key=lambda item: (-item[1], item[0])) \
+                if n is not None else sorted(
+                    self.counter.items(), key=lambda item: (-item[1], item[0]))
+        else:
+            ranked = zip(*self._ranked(n))
+        for code, count in ranked:
+            yield decode(int(code), self.k), int(count)
+
+
+if numpy is not None:
+    _codes_array = numpy.frombuffer(_codes, dtype=numpy.uint8)
+    _complements_array = numpy.frombuffer(_complements, dtype=numpy.uint8)
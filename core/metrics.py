@@ -0,0 +1,316 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains lightweight metrics of processing stages
+
+Instrumented code reports time of stages, counters (records, bytes) and
+peaks (e. g., the longest chain).  Metrics are collected only if enabled,
+otherwise instrumentation costs a flag check.  Metrics are kept per
+process; batch.run() merges metrics of its worker processes.
+
+Profiler captures cProfile or tracemalloc report of a block of code, e. g.
+of a single request.
+"""
+
+import io
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+import collections
+
+
+# Kinds of profiles
+CPROFILE = 'cprofile'
+TRACEMALLOC = 'tracemalloc'
+PROFILES = (CPROFILE, TRACEMALLOC)
+# Number of lines in profile reports
+PROFILE_LIMIT = 30
+
+enabled = False
+
+_lock = threading.Lock()
+# Stage -> [number of calls, total time, maximal time]
+_timers = dict()
+_counters = collections.Counter()
+_peaks = dict()
+
+
+def enable(flag=True):
+    """Enable or disable collecting of metrics"""
+    global enabled
+    enabled = bool(flag)
+
+
+def reset():
+    """Drop all collected metrics"""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _peaks.clear()
+
+
+def observe(stage, seconds):
+    """Account one call of stage
+
+    :param stage: name of stage, e. g. 'tools.parse'
+    :param seconds: duration of call
+    """
+    if not enabled:
+        return
+    with _lock:
+        timer = _timers.get(stage)
+        if timer is None:
+            _timers[stage] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            if seconds > timer[2]:
+                timer[2] = seconds
+
+
+def count(name, value=1):
+    """Increase counter
+
+    :param name: name of counter, e. g. 'tools.records'
+    :param value: increment
+    """
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] += value
+
+
+def peak(name, value):
+    """Account value of peak gauge, the maximal one is kept
+
+    :param name: name of gauge, e. g. 'processing.chain_length'
+    :param value: current value
+    """
+    if not enabled:
+        return
+    with _lock:
+        if value > _peaks.get(name, value - 1):
+            _peaks[name] = value
+
+
+class _Timer(object):
+    """Context manager which accounts time of stage"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        observe(self.stage, time.perf_counter() - self.begin)
+
+
+class _NullTimer(object):
+    """Context manager which does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(stage):
+    """Get context manager which accounts time of stage
+
+    :param stage: name of stage
+
+    :return: context manager, it does nothing if metrics are disabled
+    """
+    return _Timer(stage) if enabled else _null_timer
+
+
+def timed(stage):
+    """Decorator which accounts time of function's calls
+
+    :param stage: name of stage
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            begin = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - begin)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Get collected metrics
+
+    :return: dict: {'timers': {stage: {'calls': ..., 'seconds': ...,
+             'max': ...}}, 'counters': {name: value}, 'peaks': {name:
+             value}}
+    """
+    with _lock:
+        return {
+            'timers': {stage: {'calls': t[0], 'seconds': t[1], 'max': t[2]}
+                       for stage, t in _timers.items()},
+            'counters': dict(_counters),
+            'peaks': dict(_peaks)
+        }
+
+
+def merge(other):
+    """Add metrics collected elsewhere (e. g., in worker process)
+
+    :param other: result of snapshot()
+    """
+    if not enabled:
+        return
+    with _lock:
+        for stage, t in other['timers'].items():
+            timer = _timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += t['calls']
+            timer[1] += t['seconds']
+            timer[2] = max(timer[2], t['max'])
+        _counters.update(other['counters'])
+        for name, value in other['peaks'].items():
+            if value > _peaks.get(name, value - 1):
+                _peaks[name] = value
+
+
+def _metric_name(prefix, name, suffix=''):
+    return '{}_{}{}'.format(prefix, name.replace('.', '_'), suffix)
+
+
+def exposition(prefix='chainsyn', gauges=None):
+    """Render metrics in Prometheus text exposition format
+
+    :param prefix: prefix of metric names
+    :param gauges: dict: name -> value of additional gauges
+
+    :return: str
+    """
+    data = snapshot()
+    lines = list()
+
+    def family(name, kind, doc, samples):
+        lines.append('# HELP {} {}'.format(name, doc))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for labels, value in samples:
+            lines.append('{}{} {}'.format(name, labels, value))
+
+    timers = sorted(data['timers'].items())
+    if timers:
+        for suffix, key, kind, doc in (
+                ('calls_total', 'calls', 'counter',
+                 'Number of calls of processing stage'),
+                ('seconds_total', 'seconds', 'counter',
+                 'Total time of processing stage'),
+                ('seconds_max', 'max', 'gauge',
+                 'Maximal time of single call of processing stage')):
+            family('{}_stage_{}'.format(prefix, suffix), kind, doc,
+                   [('{{stage="{}"}}'.format(stage), t[key])
+                    for stage, t in timers])
+    for name, value in sorted(data['counters'].items()):
+        family(_metric_name(prefix, name, '_total'), 'counter',
+               'Counter {}'.format(name), [('', value)])
+    for name, value in sorted(data['peaks'].items()):
+        family(_metric_name(prefix, name, '_peak'), 'gauge',
+               'Peak value of {}'.format(name), [('', value)])
+    for name, value in sorted((gauges or dict()).items()):
+        family(_metric_name(prefix, name), 'gauge', 'Gauge {}'.format(name),
+               [('', value)])
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Render metrics as human-readable table
+
+    :return: list of lines
+    """
+    data = snapshot()
+    lines = list()
+    if data['timers']:
+        lines.append('{:<32} {:>8} {:>12} {:>12}'.format(
+            'Stage', 'Calls', 'Total, s', 'Max, s'))
+        for stage, t in sorted(data['timers'].items(),
+                               key=lambda item: -item[1]['seconds']):
+            lines.append('{:<32} {:>8} {:>12.6f} {:>12.6f}'.format(
+                stage, t['calls'], t['seconds'], t['max']))
+    for name, value in sorted(data['counters'].items()):
+        lines.append('{:<32} {:>8}'.format(name, value))
+    for name, value in sorted(data['peaks'].items()):
+        lines.append('{:<32} {:>8} (peak)'.format(name, value))
+    return lines
+
+
+class Profiler(object):
+    """Context manager which captures profile of a block of code
+
+    Only one profile is captured at a time in the process (both cProfile
+    and tracemalloc are process-wide); if another one is running, the block
+    is not profiled and report stays None.
+    """
+
+    _running = threading.Lock()
+
+    def __init__(self, kind=CPROFILE, limit=PROFILE_LIMIT):
+        """
+        :param kind: CPROFILE - time by functions, TRACEMALLOC - memory by
+                     lines of code
+        :param limit: number of entries in report
+
+        :raise ValueError: if kind is unknown
+        """
+        if kind not in PROFILES:
+            raise ValueError('Unknown kind of profile - {}'.format(kind))
+        self.kind = kind
+        self.limit = limit
+        self.report = None
+        self.active = False
+        self.profile = None
+
+    def __enter__(self):
+        self.active = self._running.acquire(blocking=False)
+        if not self.active:
+            return self
+        if self.kind == CPROFILE:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *args):
+        if not self.active:
+            return
+        try:
+            if self.kind == CPROFILE:
+                self.profile.disable()
+                out = io.StringIO()
+                pstats.Stats(self.profile, stream=out).sort_stats(
+                    'cumulative').print_stats(self.limit)
+                self.report = out.getvalue()
+            else:
+                current, peak_size = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')
+                tracemalloc.stop()
+                lines = ['Current: {} bytes, peak: {} bytes'.format(
+                    current, peak_size)]
+                lines.extend(str(stat) for stat in top[:self.limit])
+                self.report = '\n'.join(lines) + '\n'
+        finally:
+            self.profile = None
+            self.active = False
+            self._running.release()
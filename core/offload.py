@@ -0,0 +1,104 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains shared bounded pool of worker processes
+
+Request handlers hand CPU-bound processing to the pool instead of running
+it on their own threads or starting a pool per request.  Number of tasks
+queued or running in the pool is bounded: submitting waits for a free slot
+for a while and fails then, so overload is reported to clients instead of
+growing the queue without limit.
+"""
+
+import os
+import threading
+from concurrent import futures
+
+
+# Default maximal number of tasks queued or running per worker process
+PENDING_PER_WORKER = 4
+# Default time (in seconds) to wait for a free slot
+QUEUE_TIMEOUT = 5
+
+
+class OverloadErr(Exception):
+    """Exception class for pool without free slots"""
+
+
+class Pool(object):
+    """Bounded pool of worker processes
+
+    Pool has interface of concurrent.futures executor (submit() and
+    shutdown()), so it can be given to batch.run().  Worker processes are
+    started on the first submit(), e. g. after WSGI server has forked its
+    workers.
+    """
+
+    def __init__(self, workers=None, max_pending=None,
+                 queue_timeout=QUEUE_TIMEOUT):
+        """
+        :param workers: number of worker processes, default is number of
+                        CPUs
+        :param max_pending: maximal number of tasks queued or running,
+                            default is PENDING_PER_WORKER per worker
+        :param queue_timeout: time (in seconds) to wait for a free slot
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * PENDING_PER_WORKER
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = 0
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = futures.ProcessPoolExecutor(
+                    max_workers=self.workers)
+            return self.executor
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def submit(self, func, *args, **kwargs):
+        """Submit task, wait for a free slot if needed
+
+        :param func: picklable function
+        :param args: its arguments
+
+        :raise OverloadErr: if there is no free slot in time
+
+        :return: concurrent.futures.Future object
+        """
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise OverloadErr('Server is busy, try again later')
+        try:
+            future = self._executor().submit(func, *args, **kwargs)
+        except Exception:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending += 1
+        future.add_done_callback(self._release)
+        return future
+
+    def info(self):
+        """Get counters of pool
+
+        :return: dict with number of workers, pending tasks and limit of
+                 pending tasks
+        """
+        with self.lock:
+            return {'workers': self.workers, 'pending': self.pending,
+                    'max_pending': self.max_pending}
+
+    def shutdown(self, wait=True):
+        """Stop worker processes"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
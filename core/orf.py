@@ -0,0 +1,81 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains six-frame search of open reading frames (ORFs)
+
+Every frame of both strands is translated once as a whole by translation
+tables, then ORFs are found by str.find() of start (M) and stop (*)
+amino acids in the protein, so search stays linear in chain's length.
+For every stop-codon the longest ORF is reported, i. e. the one which
+begins at the first start-codon after the previous in-frame stop-codon.
+Masked nucleotides (N) break frames: ORF never spans codon with them.
+"""
+
+from core import transform
+
+
+# Default minimal length of ORF in codons (without stop-codon)
+MIN_LENGTH = 30
+
+# DNA or RNA (soft-masked as well) -> DNA, masked nucleotides are kept
+_to_dna = transform.Table(dict(
+    [(n, n) for n in 'ACGT' + transform.MASK] +
+    [(n.lower(), n) for n in 'ACGT' + transform.MASK] +
+    [('U', 'T'), ('u', 'T')]))
+# DNA -> same chain in RNA alphabet
+_to_rna = transform.Table({'A': 'A', 'C': 'C', 'G': 'G', 'T': 'U',
+                           transform.MASK: transform.MASK})
+
+
+def _frame_orfs(protein, min_length):
+    """Find ORFs in translated frame, codons with masked nucleotides
+    (transform.UNKNOWN) are not included
+
+    :return: generator of (first codon, codon after stop-codon) tuples
+    """
+    position = 0
+    while True:
+        stop = protein.find('*', position)
+        if stop == -1:
+            return
+        unknown = protein.rfind(transform.UNKNOWN, position, stop)
+        start = protein.find('M', position if unknown == -1 else unknown + 1,
+                             stop)
+        if start != -1 and stop - start >= min_length:
+            yield start, stop + 1
+        position = stop + 1
+
+
+def find_orfs(chain, min_length=MIN_LENGTH):
+    """Find open reading frames in all six frames
+
+    :param chain: str with DNA or RNA chain, may be soft-masked (lower
+                  case) and contain masked nucleotides (N)
+    :param min_length: minimal length of ORF in codons, stop-codon is not
+                       counted
+
+    :return: tuple (generator of (strand '+' or '-', frame 1..3, start,
+             end, protein) tuples,
+             position of first invalid nucleotide or -1); start and end are
+             0-based positions in chain (end is exclusive) which include
+             stop-codon, protein ends with '*'
+    """
+    dna, invalid = _to_dna.apply(chain)
+    if invalid != -1:
+        return iter(()), invalid
+    return _find_orfs(dna, min_length), -1
+
+
+def _find_orfs(dna, min_length):
+    length = len(dna)
+    reverse = transform.dna_to_dna.masked().apply(dna)[0][::-1]
+    for strand, sequence in (('+', dna), ('-', reverse)):
+        rna = _to_rna.apply(sequence)[0]
+        for frame in range(3):
+            protein = transform.translate(rna[frame:], to_stop=False)[0]
+            for first, last in _frame_orfs(protein, min_length):
+                start, end = frame + first * 3, frame + last * 3
+                if strand == '-':
+                    start, end = length - end, length - start
+                yield strand, frame + 1, start, end, protein[first:last]
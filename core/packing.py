@@ -0,0 +1,187 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains compact storage of chains with 2 bits per nucleotide
+
+Nucleotides are coded as A - 0, C - 1, G - 2, T/U - 3, four per byte, so
+complement of a nucleotide is its code XOR 3.  Complements and transcripts
+are views which share buffer with the original sequence.
+"""
+
+# Alphabets in order of codes
+DNA = 'ACGT'
+RNA = 'ACGU'
+# Number of nucleotides decoded at once on iteration and conversion
+BLOCK_SIZE = 1 << 20
+
+_INVALID = 4
+
+
+def _encoding(alphabet):
+    table = bytearray([_INVALID]) * 256
+    for code, n in enumerate(alphabet):
+        table[ord(n)] = code
+    return bytes(table)
+
+
+def _decoding(alphabet, complement):
+    table = bytearray(256)
+    for code, n in enumerate(alphabet):
+        table[code ^ 3 if complement else code] = ord(n)
+    return bytes(table)
+
+
+_encodings = {a: _encoding(a) for a in (DNA, RNA)}
+_decodings = {(a, c): _decoding(a, c) for a in (DNA, RNA) for c in (0, 1)}
+
+
+def pack(chain, alphabet=DNA):
+    """Pack chain into 2-bit storage
+
+    Codes are computed by bytes.translate() and four lanes of every 4th
+    code are merged into bytes by big integer shifts, so no per-nucleotide
+    Python code runs.
+
+    :param chain: str with chain
+    :param alphabet: DNA or RNA
+
+    :return: tuple (PackedSequence or None,
+             position of first invalid nucleotide or -1)
+    """
+    codes = chain.encode('ascii', 'replace').translate(_encodings[alphabet])
+    invalid = codes.find(_INVALID)
+    if invalid != -1:
+        return None, invalid
+    length = len(codes)
+    codes += bytes(-length % 4)
+    value = 0
+    for lane in range(4):
+        value |= int.from_bytes(codes[lane::4], 'little') << 2 * lane
+    data = value.to_bytes(len(codes) // 4, 'little')
+    return PackedSequence(data, 0, length, alphabet, False), -1
+
+
+class PackedSequence(object):
+    """Chain of nucleotides stored by 2 bits per nucleotide
+
+    Supports len(), indexing, slicing (contiguous slices are views),
+    iteration, count() and conversion to str.
+    """
+
+    __slots__ = ('_data', '_start', '_length', '_alphabet', '_complement')
+
+    def __init__(self, data, start, length, alphabet, complement):
+        """Use pack() to create sequence from str
+
+        :param data: bytes with packed codes
+        :param start: position of the first nucleotide in data
+        :param length: number of nucleotides
+        :param alphabet: DNA or RNA
+        :param complement: True if nucleotides are complements of stored ones
+        """
+        self._data = data
+        self._start = start
+        self._length = length
+        self._alphabet = alphabet
+        self._complement = complement
+
+    def _view(self, start, length, alphabet, complement):
+        return PackedSequence(self._data, self._start + start, length,
+                              alphabet, complement)
+
+    def _decode(self, start, stop):
+        """Decode nucleotides in range [start, stop) of the sequence"""
+        start += self._start
+        stop += self._start
+        first, last = start // 4, (stop + 3) // 4
+        block = self._data[first:last]
+        size = len(block)
+        value = int.from_bytes(block, 'little')
+        mask = int.from_bytes(b'\x03' * size, 'little')
+        codes = bytearray(size * 4)
+        for lane in range(4):
+            codes[lane::4] = ((value >> 2 * lane) & mask).to_bytes(size,
+                                                                   'little')
+        codes = codes[start - first * 4:stop - first * 4]
+        table = _decodings[(self._alphabet, self._complement)]
+        return codes.translate(table).decode('ascii')
+
+    def _blocks(self):
+        """Decode sequence by blocks of BLOCK_SIZE nucleotides"""
+        for i in range(0, self._length, BLOCK_SIZE):
+            yield self._decode(i, min(i + BLOCK_SIZE, self._length))
+
+    def complement(self):
+        """Get complementary chain (view, no data is copied)"""
+        return self._view(0, self._length, self._alphabet,
+                          not self._complement)
+
+    def transcript(self):
+        """Get RNA transcribed from DNA chain (view, no data is copied)
+
+        Transcription is complement written in RNA alphabet, same as
+        patterns.dna_to_rna.
+        """
+        return self._view(0, self._length, RNA, not self._complement)
+
+    @property
+    def alphabet(self):
+        """Alphabet of the sequence: DNA or RNA"""
+        return self._alphabet
+
+    @property
+    def nbytes(self):
+        """Size of the buffer which sequence refers to"""
+        return len(self._data)
+
+    def count(self, sub):
+        """Count non-overlapping occurrences of substring"""
+        if len(sub) != 1:
+            return str(self).count(sub)
+        return sum(block.count(sub) for block in self._blocks())
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._length)
+            if step == 1:
+                return self._view(start, max(stop - start, 0),
+                                  self._alphabet, self._complement)
+            return str(self)[key]
+        if key < 0:
+            key += self._length
+        if not 0 <= key < self._length:
+            raise IndexError('sequence index out of range')
+        return self._decode(key, key + 1)
+
+    def __iter__(self):
+        for block in self._blocks():
+            for n in block:
+                yield n
+
+    def __str__(self):
+        return ''.join(self._blocks())
+
+    def __repr__(self):
+        return 'PackedSequence({!r})'.format(
+            str(self) if self._length <= 32 else str(self[:29]) + '...')
+
+    def __eq__(self, other):
+        if isinstance(other, (str, PackedSequence)):
+            return len(self) == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __getstate__(self):
+        return (self._data[self._start // 4:(self._start + self._length + 3)
+                           // 4], self._start % 4, self._length,
+                self._alphabet, self._complement)
+
+    def __setstate__(self, state):
+        (self._data, self._start, self._length, self._alphabet,
+         self._complement) = state
@@ -0,0 +1,175 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains parallel processing of a single long chain
+
+Chain is split into chunks which are processed by pool of worker processes
+and joined back in order, so results are the same as of serial Chain's
+methods, including error messages.
+"""
+
+import os
+from concurrent import futures
+from core import processing, transform, packing, stats, validation, batch, \
+    metrics
+
+
+# Size of chunks (in nucleotides) which chain is split into
+CHUNK_SIZE = 1 << 22
+
+_tables = {
+    'replication': transform.dna_to_dna,
+    'transcription': transform.dna_to_rna,
+    'translation': transform.rna_check
+}
+_errors = {
+    'replication': 'Error in replication: unexpected DNA nucleotide',
+    'transcription': 'Error in transcription: unexpected DNA nucleotide',
+    'translation': 'Error in translation: unexpected RNA nucleotide'
+}
+
+
+def _process_chunk(chunk, mode, masked):
+    """Process chunk of chain in worker process
+
+    :return: tuple (result, position of first invalid nucleotide or -1,
+             True if stop-codon has been met, stats.Stats of chunk)
+    """
+    counter = stats.Stats()
+    table = _tables[mode].masked() if masked else _tables[mode]
+    result, invalid = table.apply(chunk, counter.update)
+    if invalid != -1 or mode != 'translation':
+        return result, invalid, False, counter
+    protein, stop = transform.translate(result)
+    return protein, -1, stop, counter
+
+
+def _count_stats(chunk):
+    """Collect statistics of chunk of chain in worker process"""
+    counter = stats.Stats()
+    counter.update(chunk)
+    return counter
+
+
+def _chunks(raw, chunk_size):
+    """Split chain into chunks"""
+    for i in range(0, len(raw), chunk_size):
+        yield raw[i:i+chunk_size]
+
+
+@metrics.timed('parallel.run')
+def run(chain, mode, workers=None, chunk_size=CHUNK_SIZE):
+    """Process chain by chunks in parallel
+
+    Same as calling Chain's replicate(), transcribe() or translate() with
+    statistics collected in the same pass.  Chunk size is rounded down to
+    whole codons and for translation protein is cut at the stop-codon of
+    the earliest chunk which has one.
+
+    :param chain: Chain object
+    :param mode: processing mode: replication, transcription, translation
+    :param workers: number of worker processes, default is number of CPUs
+    :param chunk_size: size of chunk in nucleotides
+
+    :raise ProcessingErr: same as serial processing
+
+    :return: processed chain
+    """
+    if mode not in batch.MODES:
+        raise processing.ProcessingErr(
+            'Error in parallel processing: unknown mode - {}'.format(mode))
+    chain.source = 'RNA' if mode == 'translation' else 'DNA'
+    chain.clean(chain.source)
+    raw = str(chain.raw)
+    if mode == 'translation' and len(raw) % 3:
+        # Let serial method report the error
+        return chain.translate(collect=True)
+    chunk_size = max(chunk_size - chunk_size % 3, 3)
+    workers = workers or os.cpu_count() or 1
+    results, stop, counter = list(), False, stats.Stats()
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        masked = chain.tolerant == validation.MASK
+        tasks = ((chunk, mode, masked) for chunk in _chunks(raw, chunk_size))
+        for i, (result, invalid, stopped, chunk_stats) in enumerate(
+                batch.imap(pool, _process_chunk, tasks, workers * 2)):
+            if invalid != -1:
+                position = i * chunk_size + invalid
+                raise processing.ProcessingErr(
+                    '{} - {} at position {}'.format(
+                        _errors[mode], raw[position], position))
+            if not stop and (mode == 'translation' or not chain.packed):
+                results.append(result)
+            stop = stop or stopped
+            counter.merge(chunk_stats)
+    if mode == 'translation':
+        if not stop or not raw.startswith(transform.START):
+            # Let serial method report absence of start- or stop-codon
+            return chain.translate(collect=True)
+        if chain.packed:
+            chain.rna = packing.pack(raw, packing.RNA)[0]
+        else:
+            chain.rna = raw
+        chain.protein = ''.join(results)
+        counter.update_protein(chain.protein)
+    elif chain.packed:
+        chain.dna1 = packing.pack(raw)[0]
+        if mode == 'replication':
+            chain.dna2 = chain.dna1.complement()
+        else:
+            chain.rna = chain.dna1.transcript()
+    elif mode == 'replication':
+        chain.dna1, chain.dna2 = raw, ''.join(results)
+    else:
+        chain.dna1, chain.rna = raw, ''.join(results)
+    chain.counter = counter
+    return batch.output(chain, mode)
+
+
+def collect_stats(chain, workers=None, chunk_size=CHUNK_SIZE):
+    """Collect statistics about available data in parallel
+
+    Statistics collected by run() are used if available.
+
+    :param chain: Chain object
+    :param workers: number of worker processes, default is number of CPUs
+    :param chunk_size: size of chunk in nucleotides
+
+    :return: dict with stats, same as Chain.collect_stats()
+    """
+    source = chain.dna1 if 'dna1' in chain.available() else \
+        chain.rna if 'rna' in chain.available() else ''
+    if not source or (chain.counter is not None and
+                      chain.counter.length == len(source)):
+        return chain.collect_stats()
+    chunk_size = max(chunk_size - chunk_size % 3, 3)
+    workers = workers or os.cpu_count() or 1
+    counter = stats.Stats()
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = ((chunk,) for chunk in _chunks(source, chunk_size))
+        for chunk_stats in batch.imap(pool, _count_stats, tasks, workers * 2):
+            counter.merge(chunk_stats)
+    return chain.collect_stats(counter)
+
+
+def process(info, raw, mode, workers=None, chunk_size=CHUNK_SIZE,
+            packed=False, tolerant=None, disk_cache=None):
+    """Process single long chain in parallel and collect its stats
+
+    Parallel counterpart of batch.process().
+
+    :return: tuple (Chain object, error message or None)
+    """
+    cached = batch.lookup(disk_cache, info, raw, mode, packed, tolerant)
+    if cached is not None:
+        return cached
+    chain = processing.Chain(info, raw, packed, tolerant=tolerant)
+    error = None
+    try:
+        run(chain, mode, workers, chunk_size)
+    except processing.ProcessingErr as err:
+        error = str(err)
+    finally:
+        collect_stats(chain, workers, chunk_size)
+    batch.store(disk_cache, raw, mode, chain, error, tolerant)
+    return chain, error
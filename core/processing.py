@@ -4,67 +4,365 @@
 
 """Module contains utilities for chain processing"""
 
-import re
-from core import patterns
+import functools
+import threading
+from core import patterns, transform, packing, stats, orf, kmers, \
+    validation, metrics
 
 
 class ProcessingErr(Exception):
-    """Exception class for processing errors"""
-    pass
+    """Exception class for processing errors
+
+    Errors of validation carry validation.Report of source chain in report
+    attribute.
+    """
+    report = None
+
+
+# Derived chains in order of derivation
+NODES = ('dna1', 'dna2', 'rna', 'protein')
+
+_checks = {'DNA': transform.dna_check, 'RNA': transform.rna_check}
+_alphabets = {'DNA': packing.DNA, 'RNA': packing.RNA}
+
+
+def _locked(method):
+    """Decorator which serializes calls of Chain's methods"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _node(name, doc):
+    """Make property for derived chain which is computed on first access"""
+
+    def getter(self):
+        return self.derive(name)
+
+    @_locked
+    def setter(self, value):
+        self._memo[name] = value
+        self._memo.pop('stats', None)
+
+    return property(getter, setter, doc=doc)
 
 
 class Chain(object):
-    """Main class for chain processing"""
+    """Main class for chain processing
 
-    info, raw, dna1, dna2, rna, protein, stats = '', '', '', '', '', '', {}
+    Chain is a lazy derivation graph over source chain:
 
-    def __init__(self, info, raw):
+        raw (DNA) -> dna1 -> dna2 (replication)
+                          -> rna (transcription) -> protein
+        raw (RNA) -> rna -> protein (translation)
+
+    Derived chains are computed on first access (or by processing
+    methods), memoized and can be freed by free().  Source chain is
+    validated once per alphabet.  Protein of DNA chain is translated from
+    DNA directly, without intermediate RNA chain.
+
+    With packed=True nucleotide chains (dna1, dna2, rna) are stored as
+    packing.PackedSequence, 2 bits per nucleotide; complementary DNA and
+    transcribed RNA are views of the first DNA chain.  Once source chain is
+    validated and packed, raw refers to the packed chain, so source str is
+    not kept; it is decoded back when needed (e. g., for translation).
+
+    In tolerant mode invalid nucleotides of source chain are skipped or
+    masked (see validation) before the first validation instead of
+    failing; masked codons are translated into transform.UNKNOWN.
+
+    Chain may be shared between threads: derivations and statistics are
+    serialized by a lock of the chain, so each of them is computed once.
+    """
+
+    dna1 = _node('dna1', 'First (source) DNA chain')
+    dna2 = _node('dna2', 'Second (complementary) DNA chain')
+    rna = _node('rna', 'RNA chain: source or transcribed from DNA')
+    protein = _node('protein', 'Protein chain translated from source')
+
+    def __init__(self, info, raw, packed=False, source=None, tolerant=None):
+        """
+        :param info: chain's description
+        :param raw: source chain
+        :param packed: store nucleotide chains by 2 bits per nucleotide;
+                       ignored if invalid nucleotides are masked
+        :param source: alphabet of source chain: 'DNA' or 'RNA'; detected
+                       on first need if not set, processing methods set it
+        :param tolerant: validation.SKIP or validation.MASK to skip or mask
+                         invalid nucleotides instead of failing
+        """
         self.info = info
         self.raw = raw
+        self.packed = packed and tolerant != validation.MASK
+        self.source = source
+        self.tolerant = tolerant
+        self.report = None
+        self.counter = None
+        self._memo = dict()
+        self._checked = dict()
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @property
+    @_locked
+    def stats(self):
+        """Statistics about available data, collected on first access"""
+        if 'stats' not in self._memo:
+            self.collect_stats()
+        return self._memo['stats']
+
+    @stats.setter
+    def stats(self, value):
+        self._memo['stats'] = value
+
+    def _source(self):
+        """Get alphabet of source chain, detect it if not set"""
+        if self.source is None:
+            if isinstance(self.raw, packing.PackedSequence):
+                self.source = ('RNA' if self.raw.alphabet == packing.RNA
+                               else 'DNA')
+            else:
+                self.source = ('RNA' if 'U' in self.raw and
+                               'T' not in self.raw else 'DNA')
+        return self.source
+
+    def _use(self, source):
+        """Set alphabet of source chain, chains derived from source in the
+        other alphabet are freed"""
+        if self.source is not None and self.source != source:
+            self.free()
+        self.source = source
+
+    @_locked
+    def clean(self, alphabet):
+        """Skip or mask invalid nucleotides of source chain in tolerant mode
+
+        Source chain is cleaned once, report of cleaning is kept in report
+        attribute (it holds report of failed validation otherwise).
+        Soft-masked (lower case) nucleotides are valid: chain is converted
+        to upper case first.
+
+        :param alphabet: 'DNA' or 'RNA'
+        """
+        if self.tolerant and self.report is None:
+            self.raw, self.report = validation.validators[alphabet].clean(
+                str(self.raw).upper(), self.tolerant)
+
+    def validate(self, max_errors=validation.MAX_ERRORS):
+        """Validate source chain without processing
+
+        All invalid nucleotides are reported (positions up to max_errors);
+        start- and stop-codons are checked for RNA source chain.
+
+        :param max_errors: maximal number of invalid positions to report
+
+        :return: validation.Report object
+        """
+        return validation.validators[self._source()].validate(
+            str(self.raw), max_errors)
+
+    @metrics.timed('processing.validate')
+    def _validate(self, alphabet, operation, table=None, collect=False,
+                  pack=False):
+        """Validate source chain; result of validation is cached
+
+        :param alphabet: 'DNA' or 'RNA'
+        :param operation: name of operation for error message
+        :param table: transform.Table to apply in the same pass
+        :param collect: collect statistics in the same pass
+        :param pack: pack chain in the same pass instead of applying table
+
+        :raise ProcessingErr: if source chain contains invalid nucleotide
+
+        :return: transformed or packed chain, None if neither is requested
+        """
+        self.clean(alphabet)
+        invalid = self._checked.get(alphabet)
+        if invalid is None or invalid == -1:
+            collect = collect and self.counter is None
+            if invalid == -1 and not (table or pack or collect):
+                return None
+            counter = stats.Stats() if collect else None
+            observer = counter.update if collect else None
+            metrics.count('processing.nucleotides', len(self.raw))
+            metrics.peak('processing.chain_length', len(self.raw))
+            raw = self.raw
+            if pack and isinstance(raw, packing.PackedSequence) and \
+                    raw.alphabet == _alphabets[alphabet]:
+                # Source chain has been packed already
+                result, invalid = raw, -1
+                if observer is not None:
+                    observer(str(raw))
+            elif pack:
+                result, invalid = packing.pack(str(raw), _alphabets[alphabet])
+                if observer is not None and invalid == -1:
+                    observer(raw)
+                if invalid == -1:
+                    # Packed chain replaces source str
+                    self.raw = result
+            else:
+                table = table or _checks[alphabet]
+                if self.tolerant == validation.MASK:
+                    table = table.masked()
+                result, invalid = table.apply(str(raw), observer)
+            self._checked[alphabet] = invalid
+        if invalid != -1:
+            self.report = validation.validators[alphabet].validate(
+                str(self.raw))
+            err = ProcessingErr(
+                'Error in {}: unexpected {} nucleotide - {} '
+                'at position {}'.format(operation, alphabet, self.raw[invalid],
+                                        invalid)
+            )
+            err.report = self.report
+            raise err
+        if counter is not None:
+            self.counter = counter
+        return result
+
+    def _derive_dna1(self, operation, collect):
+        if self.packed:
+            return self._validate('DNA', operation, collect=collect,
+                                  pack=True)
+        self._validate('DNA', operation, collect=collect)
+        return self.raw
+
+    def _derive_dna2(self, operation, collect):
+        if self.packed:
+            return self.derive('dna1', operation, collect).complement()
+        return self._validate('DNA', operation, transform.dna_to_dna, collect)
+
+    def _derive_rna(self, operation, collect):
+        if self._source() == 'RNA':
+            if self.packed:
+                return self._validate('RNA', operation, collect=collect,
+                                      pack=True)
+            self._validate('RNA', operation, collect=collect)
+            return self.raw
+        if self.packed:
+            return self.derive('dna1', operation, collect).transcript()
+        return self._validate('DNA', operation, transform.dna_to_rna, collect)
+
+    def _derive_protein(self, operation, collect):
+        source = self._source()
+        self.clean(source)
+        if len(self.raw) % 3:
+            raise ProcessingErr(
+                'Error in {}: RNA\'s length should be divisible by 3, '
+                'current length - {}'.format(operation, len(self.raw))
+            )
+        self._validate(source, operation, collect=collect)
+        # Packed source chain is decoded for translation only
+        raw = str(self.raw)
+        codons = (transform.rna_codons if source == 'RNA'
+                  else transform.dna_codons)
+        if not raw.startswith(codons.start):
+            raise ProcessingErr(
+                'Error in {}: RNA should start with {}'
+                ''.format(operation, patterns.abc_to_rna['M'][0])
+            )
+        with metrics.timer('processing.translate'):
+            protein, stopped = codons.translate(raw)
+        if not stopped:
+            raise ProcessingErr(
+                'Error in {}: RNA should have stop-codon: {}'.format(
+                    operation, ' / '.join(patterns.abc_to_rna['*']))
+            )
+        if self.counter is not None and not self.counter.amino_acids:
+            self.counter.update_protein(protein)
+        return protein
+
+    @_locked
+    def derive(self, name, operation=None, collect=False):
+        """Get derived chain, it is computed on first access and memoized
+
+        :param name: name of derived chain, one of NODES
+        :param operation: name of operation for error messages
+        :param collect: collect statistics in the same pass
+
+        :raise ProcessingErr: if chain could not be derived
+
+        :return: derived chain
+        """
+        if name not in self._memo:
+            if operation is None:
+                operation = {
+                    'dna1': 'replication',
+                    'dna2': 'replication',
+                    'rna': 'transcription' if self._source() == 'DNA'
+                           else 'translation',
+                    'protein': 'translation'
+                }[name]
+            value = getattr(self, '_derive_' + name)(operation, collect)
+            self._memo[name] = value
+            self._memo.pop('stats', None)
+        return self._memo[name]
+
+    def available(self):
+        """Get names of derived chains which have been computed
 
-    def replicate(self):
+        :return: list of names in order of NODES
+        """
+        return [name for name in NODES if name in self._memo]
+
+    @_locked
+    def free(self, *names):
+        """Free memoized derived chains
+
+        :param names: names of derived chains (see NODES) or 'stats'; all
+                      are freed if not set
+        """
+        for name in names or NODES + ('stats',):
+            self._memo.pop(name, None)
+
+    @_locked
+    def replicate(self, collect=False):
         """DNA -> DNA
 
+        :param collect: collect statistics in the same pass
+
         :raise ProcessingErr: if raw string contains nonDNA nucleotide
 
         :return replicated DNA chain
         """
-        invalid = re.search('[^{}]+?'.format(patterns.dna), self.raw)
-        if invalid:
-            raise ProcessingErr(
-                'Error in replication: unexpected DNA nucleotide - {} '
-                'at position {}'.format(invalid.group(0), invalid.start())
-            )
-        self.dna1 = self.raw
-        dna = list()
-        for n in self.dna1:
-            dna.append(patterns.dna_to_dna[n])
-        self.dna2 = ''.join(dna)
+        self._use('DNA')
+        for name in ('dna1', 'dna2') if self.packed else ('dna2', 'dna1'):
+            self.derive(name, 'replication', collect)
         return self.dna2
 
-    def transcribe(self):
+    @_locked
+    def transcribe(self, collect=False):
         """DNA -> RNA
 
+        :param collect: collect statistics in the same pass
+
         :raise ProcessingErr: if raw string contains nonDNA nucleotide
 
         :return transcribed RNA chain
         """
-        invalid = re.search('[^{}]+?'.format(patterns.dna), self.raw)
-        if invalid:
-            raise ProcessingErr(
-                'Error in transcription: unexpected DNA nucleotide - {} '
-                'at position {}'.format(invalid.group(0), invalid.start())
-            )
-        self.dna1 = self.raw
-        rna = list()
-        for n in self.dna1:
-            rna.append(patterns.dna_to_rna[n])
-        self.rna = ''.join(rna)
+        self._use('DNA')
+        for name in ('dna1', 'rna') if self.packed else ('rna', 'dna1'):
+            self.derive(name, 'transcription', collect)
         return self.rna
 
-    def translate(self):
+    @_locked
+    def translate(self, collect=False):
         """RNA -> protein
 
+        :param collect: collect statistics in the same pass
+
         :raise ProcessingErr:
             - RNA's length is not divisible by 3
             - raw string contains nonRNA nucleotide
@@ -73,69 +371,101 @@ class Chain(object):
 
         :return translated protein chain
         """
-        if len(self.raw) % 3:
-            raise ProcessingErr(
-                'Error in translation: RNA\'s length should be divisible by 3,'
-                ' current length - {}'.format(len(self.raw))
-            )
-        invalid = re.search('[^{}]+?'.format(patterns.rna), self.raw)
-        if invalid:
-            raise ProcessingErr(
-                'Error in translation: unexpected RNA nucleotide - {} '
-                'at position {}'.format(invalid.group(0), invalid.start())
-            )
-        check = re.match('{}'.format(patterns.abc_to_rna['M'][0]), self.raw)
-        if not check:
-            raise ProcessingErr(
-                'Error in translation: RNA should start with {}'
-                ''.format(patterns.abc_to_rna['M'][0])
-            )
-        check = re.search(
-            '{}(?:...)*?({}|{}|{})'
-            ''.format(
-                patterns.abc_to_rna['M'][0], patterns.abc_to_rna['*'][0],
-                patterns.abc_to_rna['*'][1], patterns.abc_to_rna['*'][2]),
-            self.raw
-        )
-        if not check:
-            raise ProcessingErr(
-                'Error in translation: RNA should have stop-codon: ' +
-                ' / '.join(patterns.abc_to_rna['*'])
-            )
-        self.rna = self.raw
-        protein = list()
-        for i in range(0, len(self.rna), 3):
-            codon = self.rna[i:i+3]
-            protein.append(patterns.rna_to_abc[codon])
-            if codon in patterns.abc_to_rna['*']:
-                break
-        self.protein = ''.join(protein)
-        return self.protein
-
-    def collect_stats(self):
+        self._use('RNA')
+        protein = self.derive('protein', 'translation', collect)
+        self.derive('rna', 'translation', collect)
+        return protein
+
+    @metrics.timed('processing.collect_stats')
+    @_locked
+    def collect_stats(self, counter=None):
         """Collects statistics about available data
 
-        :return: dict with stats
+        Statistics collected in the same pass as processing (see collect
+        parameter of processing methods) are used if available, otherwise
+        chains are scanned.
+
+        :param counter: stats.Stats object with already collected statistics
+                        of source chain (e. g., in parallel)
+
+        :return: dict with stats, see stats.Stats.result()
+        """
+        source = self._memo.get('dna1') or self._memo.get('rna') or ''
+        counter = counter or self.counter
+        if counter is None or counter.length != len(source):
+            counter = stats.Stats()
+            counter.update(source)
+        protein = self._memo.get('protein')
+        if protein and not counter.amino_acids:
+            counter.update_protein(protein)
+        self._memo['stats'] = counter.result()
+        return self._memo['stats']
+
+    def gc_profile(self, window, step=None):
+        """Compute GC content and GC skew profile in sliding window
+
+        Profile is computed over the first DNA chain, RNA chain or source
+        chain, whichever is available.
+
+        :param window: window size in nucleotides
+        :param step: window step in nucleotides, default is window size
+
+        :raise ProcessingErr: if window or step is not positive
+
+        :return: generator of (start position, GC content in %, GC skew)
+                 tuples, see stats.gc_profile()
+        """
+        if window < 1 or (step is not None and step < 1):
+            raise ProcessingErr(
+                'Error in GC profile: window and step should be positive')
+        source = self._memo.get('dna1') or self._memo.get('rna') or self.raw
+        return stats.gc_profile(source, window, step)
+
+    def count_kmers(self, k, canonical=False, counter=None):
+        """Count k-mers of the first DNA chain, RNA chain or source chain,
+        whichever is available
+
+        K-mers which cover non-nucleotides are not counted, so chain is not
+        validated.
+
+        :param k: k-mer size, 1..kmers.MAX_K
+        :param canonical: count k-mer and its reverse complement together
+        :param counter: kmers.Counter object to add counts to (e. g.,
+                        counts of other chains)
+
+        :raise ProcessingErr: if k is out of range
+
+        :return: kmers.Counter object
         """
-        self.stats = dict()
-        if self.dna1:
-            self.stats.update({'nucleotides': len(self.dna1)})
-            self.stats.update({'codons': len(self.dna1) // 3})
-            gc = self.dna1.count('G') + self.dna1.count('C')
-            gc_percentage = round(gc * 100 / len(self.dna1), 6)
-            self.stats.update({'gc_content': gc_percentage})
-        elif self.rna:
-            self.stats.update({'nucleotides': len(self.rna)})
-            self.stats.update({'codons': len(self.rna) // 3})
-            gc = self.rna.count('G') + self.rna.count('C')
-            gc_percentage = round(gc * 100 / len(self.rna), 6)
-            self.stats.update({'gc_content': gc_percentage})
-        else:
-            pass
-        if self.protein:
-            mass = 0.0
-            for i in self.protein:
-                mass += patterns.abc_mass[i]
-            result = round(mass, ndigits=3)
-            self.stats.update({'mass': result})
-        return self.stats
+        try:
+            counter = counter or kmers.Counter(k, canonical)
+        except ValueError as err:
+            raise ProcessingErr('Error in k-mer counting: {}'.format(err))
+        source = self._memo.get('dna1') or self._memo.get('rna') or self.raw
+        counter.update(source)
+        return counter
+
+    def find_orfs(self, min_length=orf.MIN_LENGTH):
+        """Find open reading frames in all six frames of source chain
+
+        Source chain is cleaned first in tolerant mode (see clean()).
+        Masked nucleotides (N) break frames, soft-masked (lower case) ones
+        are valid.
+
+        :param min_length: minimal length of ORF in codons (without
+                           stop-codon)
+
+        :raise ProcessingErr: if raw string contains other non-nucleotide
+
+        :return: generator of (strand, frame, start, end, protein) tuples,
+                 see orf.find_orfs()
+        """
+        self.clean(self._source())
+        raw = str(self.raw)
+        orfs, invalid = orf.find_orfs(raw, min_length)
+        if invalid != -1:
+            raise ProcessingErr(
+                'Error in ORF search: unexpected nucleotide - {} '
+                'at position {}'.format(raw[invalid], invalid)
+            )
+        return orfs
@@ -0,0 +1,432 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Indexed exact search of patterns in chains
+
+Records are joined (by line breaks, which patterns never contain) into one
+text and its suffix array is built: starts of all suffixes in lexicographic
+order.  Occurrences of pattern are a contiguous range of suffix array,
+which is found by two binary searches comparing only len(pattern) bytes,
+so query costs O(m log n) for pattern of length m regardless of number of
+occurrences; positions are reported for the range only.
+
+Suffix array is built by prefix doubling: suffixes sorted by the first h
+characters give ranks which sort them by the first 2h characters.  With
+numpy the first 8 characters are ranked at once and every doubling is one
+vectorized sort of suffixes which are not told apart yet (Larsson-Sadakane),
+so the whole text is sorted about twice for random chains.
+
+Index is kept in sidecar file (source file name + '.csa') which is
+memory-mapped on open, so repeated searches do not rebuild index nor read
+it whole.  Index is rebuilt if it is missing or older than source file.
+"""
+
+import os
+import io
+import json
+import mmap
+import bisect
+import struct
+import tempfile
+from core import patterns, tools, metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Suffix of index files
+SUFFIX = '.csa'
+# Signature and version of index file format
+MAGIC = b'CSYNSA01'
+# Separator of records in indexed text
+SEPARATOR = b'\n'
+
+_complement = str.maketrans(
+    ''.join(patterns.dna_to_dna) + 'U',
+    ''.join(patterns.dna_to_dna.values()) + 'A')
+
+
+def index_path(source_file):
+    """Get path to index file of source file"""
+    return os.path.normpath(source_file) + SUFFIX
+
+
+def stale(source_file, index_file=None):
+    """Check if index of source file is missing or older than source file
+
+    :param source_file: path to source file
+    :param index_file: path to index file, default is source file + '.csa'
+
+    :raise RoutineErr: if source file is not found
+    """
+    index_file = index_file or index_path(source_file)
+    try:
+        return (not os.path.isfile(index_file) or
+                os.path.getmtime(index_file) < os.path.getmtime(source_file))
+    except OSError:
+        raise tools.RoutineErr('Could not open file: {}'.format(source_file))
+
+
+def build_index(source_file, index_file=None):
+    """Build index of source file in FASTA format and write it to sidecar
+    file
+
+    :param source_file: path to source file (plain, gzip or xz)
+    :param index_file: path to index file, default is source file + '.csa'
+
+    :return: path to index file
+    :raise RoutineErr: on file I/O error
+    """
+    index_file = index_file or index_path(source_file)
+    SuffixIndex.build(tools.read_fasta(source_file)).save(index_file)
+    return index_file
+
+
+def lookup(records, pattern, reverse=False, limit=None):
+    """Build index of records in memory and find occurrences of pattern
+
+    Function is picklable, so it may run in worker process (e. g., of
+    offload.Pool).
+
+    :param records: list of (description, chain) tuples
+    :param pattern: str, case and whitespace are ignored
+    :param reverse: find occurrences of reverse complement of nucleotide
+                    pattern as well
+    :param limit: maximal number of reported occurrences, None means all
+
+    :return: tuple (number of occurrences, list of occurrences), see
+             SuffixIndex.find()
+    """
+    with SuffixIndex.build(records) as index:
+        return (index.count(pattern, reverse),
+                index.find(pattern, reverse, limit))
+
+
+def reverse_complement(pattern):
+    """Get reverse complement of nucleotide pattern"""
+    return pattern.translate(_complement)[::-1]
+
+
+def _suffix_array_numpy(text):
+    data = numpy.frombuffer(text, dtype=numpy.uint8)
+    size = len(data)
+    # Keys by the first 8 characters: big-endian integers of 8 bytes
+    # (suffixes shorter than 8 are padded by zero bytes, which are less
+    # than any character)
+    padded = numpy.concatenate((data, numpy.zeros(8, dtype=numpy.uint8)))
+    keys = numpy.zeros(size, dtype=numpy.uint64)
+    for i in range(8):
+        keys = keys << numpy.uint64(8) | padded[i:i + size]
+    order = numpy.argsort(keys)
+    keys = keys[order]
+    # Slots of order which are sorted at the current step
+    slots = numpy.arange(size)
+    ranks = numpy.empty(size, dtype=numpy.int64)
+    h = 8
+    while True:
+        # Rank of suffix is the first slot of its group of equal keys
+        first = numpy.concatenate(([True], keys[1:] != keys[:-1]))
+        ranks[order[slots]] = numpy.maximum.accumulate(
+            numpy.where(first, slots, 0))
+        # Only groups of more than one suffix are sorted further
+        last = numpy.concatenate((first[1:], [True]))
+        tied = ~(first & last)
+        if not tied.any() or h >= size:
+            return order
+        slots = slots[tied]
+        suffixes = order[slots]
+        # Pairs (rank by the first h characters, rank by the next h ones)
+        # sort suffixes by the first 2h characters; suffixes which end
+        # within them get the least rank of the second part
+        following = suffixes + h
+        inside = following < size
+        second = numpy.zeros(len(suffixes), dtype=numpy.int64)
+        second[inside] = ranks[following[inside]] + 1
+        keys = ranks[suffixes] * (size + 1) + second
+        resorted = numpy.argsort(keys)
+        order[slots] = suffixes[resorted]
+        keys = keys[resorted]
+        h *= 2
+
+
+def _suffix_array_python(text):
+    size = len(text)
+    ranks = list(text)
+    order = list(range(size))
+    h = 1
+    while True:
+        def key(i):
+            return ranks[i], ranks[i + h] if i + h < size else -1
+        order.sort(key=key)
+        new = [0] * size
+        for j in range(1, size):
+            new[order[j]] = new[order[j - 1]] + \
+                (key(order[j]) != key(order[j - 1]))
+        ranks = new
+        if not size or ranks[order[-1]] == size - 1:
+            return order
+        h *= 2
+
+
+@metrics.timed('search.build')
+def suffix_array(text):
+    """Build suffix array of text
+
+    :param text: bytes
+
+    :return: sequence of int: start positions of suffixes in lexicographic
+             order
+    """
+    if numpy is not None and text:
+        return _suffix_array_numpy(text)
+    return _suffix_array_python(text)
+
+
+def _join(records):
+    """Join records into text to index
+
+    :return: tuple (list of names, list of start positions, text bytes)
+    """
+    names, starts = list(), list()
+    text = io.BytesIO()
+    for info, chain in records:
+        if names:
+            text.write(SEPARATOR)
+        names.append(info)
+        starts.append(text.tell())
+        text.write(str(chain).upper().encode('latin-1', 'replace'))
+    return names, starts, text.getvalue()
+
+
+class SuffixIndex(object):
+    """Suffix array index of records
+
+    Index is built in memory by build(), opened from index file by open()
+    or taken for file in FASTA format by for_file().
+    """
+
+    def __init__(self, names, starts, text, positions, source=None):
+        """
+        :param names: list of names of records
+        :param starts: list of positions of records in text
+        :param text: bytes-like object with joined records
+        :param positions: suffix array of text
+        :param source: mmap object which text and positions are views of
+        """
+        self.names = names
+        self.starts = starts
+        self.text = text
+        self.positions = positions
+        self.map = source
+
+    @classmethod
+    def build(cls, records):
+        """Build index of records in memory
+
+        :param records: iterable of (description, chain) tuples
+
+        :return: SuffixIndex object
+        """
+        names, starts, text = _join(records)
+        return cls(names, starts, text, suffix_array(text))
+
+    @classmethod
+    def open(cls, index_file):
+        """Open index file, it is memory-mapped
+
+        :param index_file: path to index file
+
+        :return: SuffixIndex object
+        :raise RoutineErr: on file I/O error or malformed index
+        """
+        try:
+            with open(index_file, 'rb') as f:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            raise tools.RoutineErr('Could not open file: {}'
+                                   ''.format(index_file))
+        text = positions = None
+        try:
+            if source[:len(MAGIC)] != MAGIC:
+                raise ValueError('wrong signature')
+            offset = len(MAGIC) + 8
+            length = struct.unpack('<Q', source[len(MAGIC):offset])[0]
+            header = json.loads(source[offset:offset + length].decode())
+            size, width = header['size'], header['width']
+            offset = _align(offset + length)
+            text = memoryview(source)[offset:offset + size]
+            offset = _align(offset + size)
+            end = offset + size * struct.calcsize(width)
+            if end > len(source):
+                raise ValueError('truncated file')
+            positions = memoryview(source)[offset:end].cast(width)
+        except (ValueError, KeyError, TypeError, struct.error):
+            for view in (text, positions):
+                if view is not None:
+                    view.release()
+            source.close()
+            raise tools.RoutineErr('Malformed index file: {}'
+                                   ''.format(index_file))
+        return cls(header['names'], header['starts'], text, positions,
+                   source)
+
+    @classmethod
+    def for_file(cls, source_file, index_file=None):
+        """Open index of file in FASTA format, index is built and saved if
+        it is missing or older than source file
+
+        :param source_file: path to source file (plain, gzip or xz)
+        :param index_file: path to index file, default is source file +
+                           '.csa'
+
+        :return: SuffixIndex object
+        :raise RoutineErr: on file I/O error
+        """
+        index_file = index_file or index_path(source_file)
+        if stale(source_file, index_file):
+            build_index(source_file, index_file)
+        return cls.open(index_file)
+
+    def save(self, index_file):
+        """Write index to file (atomically)
+
+        :param index_file: path to index file
+
+        :raise RoutineErr: on file I/O error
+        """
+        size = len(self.text)
+        width = 'I' if size < 1 << 32 else 'Q'
+        header = json.dumps({'names': self.names, 'starts': self.starts,
+                             'size': size, 'width': width}).encode()
+        directory, base = os.path.split(index_file)
+        temp_name = None
+        try:
+            fd, temp_name = tempfile.mkstemp(
+                suffix='.tmp', prefix='.{}-'.format(base),
+                dir=directory or '.')
+            with os.fdopen(fd, 'wb') as out:
+                out.write(MAGIC)
+                out.write(struct.pack('<Q', len(header)))
+                out.write(header)
+                out.write(bytes(_align(out.tell()) - out.tell()))
+                out.write(self.text)
+                out.write(bytes(_align(out.tell()) - out.tell()))
+                if numpy is not None:
+                    numpy.asarray(self.positions).astype(
+                        '<u{}'.format(struct.calcsize(width))).tofile(out)
+                else:
+                    out.write(struct.pack('<{}{}'.format(size, width),
+                                          *self.positions))
+            os.replace(temp_name, index_file)
+        except OSError:
+            if temp_name is not None and os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise tools.RoutineErr('Could not write file: {}'
+                                   ''.format(index_file))
+
+    def close(self):
+        """Unmap index file"""
+        if self.map is not None:
+            self.text.release()
+            self.positions.release()
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def _range(self, pattern):
+        """Find range of suffix array with suffixes which start with
+        pattern
+
+        :param pattern: bytes
+
+        :return: tuple (first, last) of indices, last is exclusive
+        """
+        text, positions, m = self.text, self.positions, len(pattern)
+        low, high = 0, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            start = positions[middle]
+            if bytes(text[start:start + m]) < pattern:
+                low = middle + 1
+            else:
+                high = middle
+        first, high = low, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            start = positions[middle]
+            if bytes(text[start:start + m]) <= pattern:
+                low = middle + 1
+            else:
+                high = middle
+        return first, low
+
+    def _patterns(self, pattern, reverse):
+        """Get patterns to look for: (strand, bytes) tuples"""
+        pattern = ''.join(pattern.split()).upper()
+        if not pattern:
+            return []
+        result = [('+', pattern.encode('latin-1', 'replace'))]
+        if reverse:
+            complement = reverse_complement(pattern)
+            if complement != pattern:
+                result.append(('-', complement.encode('latin-1', 'replace')))
+        return result
+
+    @metrics.timed('search.count')
+    def count(self, pattern, reverse=False):
+        """Count occurrences of pattern
+
+        :param pattern: str, case and whitespace are ignored
+        :param reverse: count occurrences of reverse complement of
+                        nucleotide pattern as well
+
+        :return: int
+        """
+        total = 0
+        for _, query in self._patterns(pattern, reverse):
+            first, last = self._range(query)
+            total += last - first
+        return total
+
+    @metrics.timed('search.find')
+    def find(self, pattern, reverse=False, limit=None):
+        """Find occurrences of pattern
+
+        :param pattern: str, case and whitespace are ignored
+        :param reverse: find occurrences of reverse complement of
+                        nucleotide pattern as well
+        :param limit: maximal number of reported occurrences, None means
+                      all
+
+        :return: list of (record name, 0-based position in record, strand
+                 '+' or '-') tuples ordered by record and position; for
+                 strand '-' position is the start of reverse complement
+        """
+        found = list()
+        for strand, query in self._patterns(pattern, reverse):
+            first, last = self._range(query)
+            found.extend((position, strand)
+                         for position in self.positions[first:last])
+        found.sort()
+        result = list()
+        for position, strand in found[:limit]:
+            record = bisect.bisect_right(self.starts, position) - 1
+            result.append((self.names[record],
+                           position - self.starts[record], strand))
+        return result
+
+
+def _align(offset):
+    """Round offset up to multiple of 8"""
+    return (offset + 7) // 8 * 8
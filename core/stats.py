@@ -0,0 +1,212 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains statistics engine
+
+Statistics are accumulated chunk by chunk, so they can be collected in the
+same pass as chain is transformed, or in parallel and merged afterwards.
+"""
+
+import re
+import operator
+import functools
+import itertools
+import collections
+from core import patterns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Nucleotides which are not counted as ambiguous
+BASES = 'ACGTU'
+# Size of blocks (in nucleotides) which chain is accounted by
+BLOCK_SIZE = 1 << 20
+# All codons in RNA alphabet
+CODONS = tuple(a + b + c for a in patterns.rna for b in patterns.rna
+               for c in patterns.rna)
+
+_codon = re.compile('...', re.DOTALL)
+_to_rna = str.maketrans('T', 'U')
+
+
+def _compile_codes():
+    """Compile lookup arrays for vectorized codon counting
+
+    :return: tuple (2-bit codes of nucleotides, validity flags)
+    """
+    codes = numpy.zeros(256, dtype=numpy.uint8)
+    valid = numpy.zeros(256, dtype=bool)
+    for i, n in enumerate(patterns.rna):
+        codes[ord(n)] = i
+        valid[ord(n)] = True
+    codes[ord('T')], valid[ord('T')] = codes[ord('U')], True
+    return codes, valid
+
+
+class Stats(object):
+    """Accumulator of chain's statistics
+
+    Feed nucleotide chain by update() (any number of chunks, codons are
+    counted across chunk borders) and protein chain by update_protein(),
+    then get results by result().
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.bases = collections.Counter()
+        self.codons = collections.Counter()
+        self.amino_acids = collections.Counter()
+        self.mass = 0.0
+        self.tail = ''
+
+    def update(self, chunk):
+        """Account next chunk of nucleotide chain
+
+        :param chunk: str (or object convertible to str) with nucleotides
+        """
+        for i in range(0, len(chunk), BLOCK_SIZE):
+            self._update(str(chunk[i:i+BLOCK_SIZE]))
+
+    def _update(self, chunk):
+        self.length += len(chunk)
+        data = self.tail + chunk if self.tail else chunk
+        end = len(data) - len(data) % 3
+        self.tail = data[end:]
+        if numpy is not None:
+            self._count_numpy(chunk, data, end)
+            return
+        counted = 0
+        for n in BASES + 'N':
+            count = chunk.count(n)
+            if count:
+                self.bases[n] += count
+                counted += count
+        if counted < len(chunk):
+            others = collections.Counter(chunk)
+            for n in BASES + 'N':
+                others.pop(n, None)
+            self.bases.update(others)
+        self.codons.update(_codon.findall(data, 0, end))
+
+    def _count_numpy(self, chunk, data, end):
+        """Count nucleotides and codons by vectorized operations"""
+        try:
+            raw = numpy.frombuffer(chunk.encode('ascii'), dtype=numpy.uint8)
+            counts = numpy.bincount(raw, minlength=256)
+            for i in numpy.flatnonzero(counts):
+                self.bases[chr(i)] += int(counts[i])
+        except UnicodeEncodeError:
+            self.bases.update(chunk)
+        raw = numpy.frombuffer(data[:end].encode('ascii', 'replace'),
+                               dtype=numpy.uint8).reshape(-1, 3)
+        codes = _codes[raw]
+        index = codes[:, 0] << 4 | codes[:, 1] << 2 | codes[:, 2]
+        counts = numpy.bincount(index[_valid[raw].all(axis=1)], minlength=64)
+        for i in numpy.flatnonzero(counts):
+            self.codons[CODONS[i]] += int(counts[i])
+
+    def update_protein(self, protein):
+        """Account protein chain
+
+        :param protein: str with amino acids
+        """
+        self.amino_acids.update(protein)
+        # Masses are added one by one in order of the chain, so rounding
+        # errors (and the rounded mass) are the same as of a plain loop
+        self.mass = functools.reduce(
+            operator.add,
+            map(patterns.abc_mass.get, protein, itertools.repeat(0)),
+            self.mass)
+
+    def merge(self, other):
+        """Add statistics of the next part of chain
+
+        Parts should be split on codon borders.
+
+        :param other: Stats object
+        """
+        self.length += other.length
+        self.bases.update(other.bases)
+        self.codons.update(other.codons)
+        self.amino_acids.update(other.amino_acids)
+        self.mass += other.mass
+        self.tail = other.tail
+
+    def result(self):
+        """Get collected statistics
+
+        Keys 'nucleotides', 'codons', 'gc_content', 'bases', 'ambiguous'
+        and 'codon_usage' are present if nucleotide chain has been
+        accounted, 'amino_acids' and 'mass' - if protein chain has been.
+
+        :return: dict with stats
+        """
+        result = dict()
+        if self.length:
+            gc = self.bases['G'] + self.bases['C']
+            alphabet = (patterns.rna if self.bases['U'] and
+                        not self.bases['T'] else patterns.dna)
+            usage = dict.fromkeys(CODONS, 0)
+            for codon, count in self.codons.items():
+                codon = codon.translate(_to_rna)
+                if codon in usage:
+                    usage[codon] += count
+            result.update({
+                'nucleotides': self.length,
+                'codons': self.length // 3,
+                'gc_content': round(gc * 100 / self.length, 6),
+                'bases': {n: self.bases[n] for n in alphabet},
+                'ambiguous': {n: c for n, c in self.bases.items()
+                              if n not in BASES},
+                'codon_usage': usage
+            })
+        if self.amino_acids:
+            result.update({
+                'amino_acids': dict(self.amino_acids),
+                'mass': round(self.mass, ndigits=3)
+            })
+        return result
+
+
+if numpy is not None:
+    _codes, _valid = _compile_codes()
+
+
+def gc_profile(chain, window, step=None):
+    """Compute GC content and GC skew in sliding window
+
+    Window is moved by rolling counters: nucleotides leaving and entering
+    the window are counted by str.count(), so every nucleotide is counted
+    at most twice regardless of window size.  Only whole windows are
+    reported.
+
+    :param chain: str or packing.PackedSequence with nucleotides
+    :param window: window size in nucleotides
+    :param step: window step in nucleotides, default is window size
+
+    :return: generator of (start position, GC content in %,
+             GC skew (G - C) / (G + C)) tuples
+    """
+    step = step or window
+    if window < 1 or step < 1:
+        raise ValueError('Window and step should be positive')
+    g = c = 0
+    end = 0
+    for start in range(0, len(chain) - window + 1, step):
+        if start >= end:
+            # No overlap with the previous window
+            piece = str(chain[start:start + window])
+            g, c = piece.count('G'), piece.count('C')
+        else:
+            leaving = str(chain[start - step:start])
+            entering = str(chain[end:start + window])
+            g += entering.count('G') - leaving.count('G')
+            c += entering.count('C') - leaving.count('C')
+        end = start + window
+        gc = g + c
+        yield (start, round(gc * 100 / window, 6),
+               round((g - c) / gc, 6) if gc else 0.0)
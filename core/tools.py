@@ -6,8 +6,16 @@
 
 
 import os
-import re
+import gzip
+import lzma
+import zlib
+import codecs
+import functools
+import itertools
+import shutil
 import datetime
+import tempfile
+from core import processing, bgzf, metrics
 
 
 class RoutineErr(Exception):
@@ -15,60 +23,500 @@ class RoutineErr(Exception):
     pass
 
 
-def from_file(source_file):
-    """Read data from source file in FASTA format
+# Size of chunks (in characters) which FASTA files are read by
+CHUNK_SIZE = 1 << 20
+# Width of sequence lines in exported files, 0 means no wrapping
+LINE_WIDTH = 60
+# Size of buffer (in characters) which exported files are written by
+BUFFER_SIZE = 1 << 20
+# Supported compressions and suffixes of compressed files
+COMPRESSIONS = {'gzip': '.gz', 'bgzip': '.gz', 'xz': '.xz'}
+# Derived chain -> suffix of its record's header in exported file
+SUFFIXES = {'dna1': 'DNA1', 'dna2': 'DNA2', 'rna': 'RNA', 'protein': 'protein'}
+
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+# Errors of reading compressed files
+READ_ERRORS = (OSError, EOFError, lzma.LZMAError, zlib.error)
+
+
+def compression(source_file):
+    """Detect compression of file by magic bytes
+
+    :param source_file: path to file
+
+    :return: 'gzip', 'bgzip', 'xz' or None for uncompressed file
+    :raise RoutineErr: if could not open file
+    """
+    try:
+        with open(os.path.normpath(source_file), 'rb') as f:
+            header = f.read(18)
+    except OSError:
+        raise RoutineErr('Could not open file: {}'.format(source_file))
+    if bgzf.is_bgzf(header):
+        return 'bgzip'
+    if header.startswith(_GZIP_MAGIC):
+        return 'gzip'
+    if header.startswith(_XZ_MAGIC):
+        return 'xz'
+    return None
+
+
+def open_source(source_file):
+    """Open file for reading, compressed file is decompressed on the fly
+
+    :param source_file: path to file, compression is detected by
+                        compression()
+
+    :return: binary file object
+    :raise RoutineErr: if could not open file
+    """
+    kind = compression(source_file)
+    source_file = os.path.normpath(source_file)
+    try:
+        if kind in ('gzip', 'bgzip'):
+            return gzip.open(source_file, 'rb')
+        if kind == 'xz':
+            return lzma.open(source_file, 'rb')
+        return open(source_file, 'rb')
+    except OSError:
+        raise RoutineErr('Could not open file: {}'.format(source_file))
+
+
+class FastaParser(object):
+    """Incremental parser of data in FASTA format
+
+    Data is fed by chunks of arbitrary size, so neither a whole file nor a
+    whole line has to be kept in memory; only sequence of the record being
+    parsed is accumulated.  Header of a record is the whole line after '>',
+    sequence lines are stripped of whitespace and converted to upper case.
+    Data before the first header is ignored.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.parts = list()
+        self.pending = None
+        self.line_start = True
+
+    def _flush(self):
+        """Finish current record
+
+        :return: tuple (header, sequence) or None if there is no record
+        """
+        if self.header is None:
+            return None
+        record = (self.header, ''.join(self.parts))
+        self.header, self.parts = None, list()
+        return record
+
+    def feed(self, chunk):
+        """Parse next chunk of data
+
+        :param chunk: str with next part of FASTA data
+
+        :return: list of (header, sequence) tuples completed by the chunk
+        """
+        records = list()
+        lines = chunk.split('\n')
+        last = len(lines) - 1
+        for i, line in enumerate(lines):
+            line_end = i < last
+            if self.pending is not None:
+                self.pending += line
+            elif self.line_start and line.startswith('>'):
+                self.pending = line[1:]
+            elif self.header is not None:
+                line = ''.join(line.split())
+                if line:
+                    self.parts.append(line.upper())
+            if self.pending is not None and line_end:
+                record = self._flush()
+                if record:
+                    records.append(record)
+                self.header, self.pending = self.pending.strip(), None
+            self.line_start = line_end or (self.line_start and not line)
+        return records
+
+    def close(self):
+        """Finish parsing
+
+        :return: list with the last (header, sequence) tuple, if any
+        """
+        if self.pending is not None:
+            record = self._flush()
+            self.header, self.pending = self.pending.strip(), None
+            records = [record] if record else list()
+        else:
+            records = list()
+        record = self._flush()
+        if record:
+            records.append(record)
+        return records
+
+
+def _decompress(chunks, chunk_size):
+    """Decompress stream of chunks if it is compressed by gzip or xz
+
+    Compression is detected by magic bytes of the first chunk; output
+    chunks are at most chunk_size bytes, so memory stays bounded.
+    Concatenated members (e. g., bgzip blocks) are supported.
+
+    :param chunks: iterable of bytes
+    :param chunk_size: maximal size of output chunks
+
+    :return: generator of bytes
+    :raise RoutineErr: if compressed data is malformed or truncated
+    """
+    chunks = iter(chunks)
+    first = b''
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= len(_XZ_MAGIC):
+            break
+    if first.startswith(_GZIP_MAGIC):
+        new = functools.partial(zlib.decompressobj, 16 + zlib.MAX_WBITS)
+    elif first.startswith(_XZ_MAGIC):
+        new = lzma.LZMADecompressor
+    else:
+        if first:
+            yield first
+        for chunk in chunks:
+            yield chunk
+        return
+    decompressor, eof = new(), False
+    try:
+        for chunk in itertools.chain((first,), chunks):
+            while True:
+                if eof:
+                    decompressor, eof = new(), False
+                data = decompressor.decompress(chunk, chunk_size)
+                if data:
+                    yield data
+                if decompressor.eof:
+                    eof, chunk = True, decompressor.unused_data
+                    if not chunk:
+                        break
+                else:
+                    # Input which is left because of output limit: zlib
+                    # returns it, lzma keeps it until it needs input
+                    chunk = getattr(decompressor, 'unconsumed_tail', b'')
+                    if not chunk and getattr(decompressor, 'needs_input',
+                                             True):
+                        break
+    except (zlib.error, lzma.LZMAError):
+        raise RoutineErr('Malformed compressed data')
+    if not eof:
+        raise RoutineErr('Compressed data is truncated')
+
+
+def read_stream(stream, chunk_size=CHUNK_SIZE):
+    """Read records in FASTA format from stream one by one
+
+    Stream is read by chunks as records are taken, so memory usage is
+    bounded by the longest record and data is read no faster than it is
+    consumed.  Compressed data (gzip, bgzip, xz) is decompressed on the
+    fly.  Data is decoded as UTF-8.
+
+    :param stream: binary file object, e. g. uploaded file or request body
+    :param chunk_size: size of chunks to read stream by
+
+    :return: generator of (description, chain) tuples
+    :raise RoutineErr: on I/O error or malformed compressed data
+    """
+    def chunks():
+        while True:
+            try:
+                chunk = stream.read(chunk_size)
+            except OSError:
+                raise RoutineErr('Could not read data')
+            if not chunk:
+                return
+            yield chunk
+
+    def parsed():
+        for chunk in _decompress(chunks(), chunk_size):
+            metrics.count('tools.bytes_read', len(chunk))
+            with metrics.timer('tools.parse'):
+                records = parser.feed(decoder.decode(chunk))
+            yield records
+        yield parser.feed(decoder.decode(b'', final=True)) + parser.close()
+
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    parser = FastaParser()
+    for records in parsed():
+        for record in records:
+            metrics.count('tools.records')
+            metrics.peak('tools.record_length', len(record[1]))
+            yield record
+
+
+def read_fasta(source_file, chunk_size=CHUNK_SIZE):
+    """Read records from source file in FASTA format one by one
+
+    File is read by chunks, so memory usage is bounded by the longest
+    record, not by file size.  Records with duplicate headers are kept.
+    Compressed files (gzip, bgzip, xz) are decompressed on the fly.
 
     :param source_file: path to source file
+    :param chunk_size: size of chunks to read file by
 
-    :return: dict with description(s) and stored chain(s)
+    :return: generator of (description, chain) tuples
     :raise RoutineErr if could not open source file
     """
-    # Try to open file
     try:
-        with open(os.path.normpath(source_file), 'rt') as f:
-            raw = f.read()
-            f.close()
+        f = open(os.path.normpath(source_file), 'rb')
     except OSError:
         raise RoutineErr('Could not open file: {}'.format(source_file))
-    # Parse file
-    data = dict()
-    pat = re.compile('>(\S+)\s([A-Z\s]+)')
-    for it in pat.finditer(raw):
-        data.update({it.group(1): re.sub('\s+', '', it.group(2))})
-    return data
+    with f:
+        try:
+            for record in read_stream(f, chunk_size):
+                yield record
+        except RoutineErr as err:
+            raise RoutineErr('{}: {}'.format(err, source_file))
+
+
+def from_file(source_file):
+    """Read data from source file in FASTA format
+
+    :param source_file: path to source file
+
+    :return: list of (description, chain) tuples in order of appearance
+    :raise RoutineErr if could not open source file
+    """
+    return list(read_fasta(source_file))
+
+
+class FastaWriter(object):
+    """Buffered writer of records in FASTA format
+
+    Records are collected in a buffer which is written into one file by
+    large blocks, so many records make a single sequential write stream.
+    Sequences are wrapped into lines of the given width.  If writing is
+    atomic, data goes into a temporary file in the same directory, which
+    replaces the target file on close(), so readers never see a partial
+    file.  Output may be compressed on the fly.
+    """
+
+    def __init__(self, file_name, width=LINE_WIDTH, append=False,
+                 atomic=True, buffer_size=BUFFER_SIZE, compression=None):
+        """
+        :param file_name: path to output file or binary file object (e. g.
+                          sys.stdout.buffer) which is flushed but not
+                          closed by close(); append and atomic are ignored
+                          for file object
+        :param width: width of sequence lines, 0 means no wrapping
+        :param append: append records to existing file (it is copied into
+                       temporary file first if writing is atomic)
+        :param atomic: write into temporary file and rename it on close()
+        :param buffer_size: size of buffer (in characters)
+        :param compression: compress output: 'gzip', 'bgzip' (blocked gzip
+                            which allows random access, see bgzf) or 'xz';
+                            appended data is a new compressed member
+
+        :raise RoutineErr: if could not open file or compression is unknown
+        """
+        if compression is not None and compression not in COMPRESSIONS:
+            raise RoutineErr('Unknown compression: {}'.format(compression))
+        self.width = width
+        self.buffer_size = buffer_size
+        self.parts = list()
+        self.size = 0
+        self.temp_name = None
+        self.owned = not hasattr(file_name, 'write')
+        if self.owned:
+            self.file_name = os.path.normpath(file_name)
+            self._open(append, atomic)
+        else:
+            self.file_name = getattr(file_name, 'name', '<stream>')
+            self.out = file_name
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.out, mode='wb',
+                                        compresslevel=6)
+        elif compression == 'bgzip':
+            self.stream = bgzf.Writer(self.out)
+        elif compression == 'xz':
+            self.stream = lzma.LZMAFile(self.out, 'wb')
+        else:
+            self.stream = self.out
+
+    def _open(self, append, atomic):
+        """Open output file or temporary one if writing is atomic"""
+        try:
+            if atomic:
+                directory, base = os.path.split(self.file_name)
+                fd, self.temp_name = tempfile.mkstemp(
+                    suffix='.tmp', prefix='.{}-'.format(base),
+                    dir=directory or '.')
+                self.out = os.fdopen(fd, 'wb')
+                # Temporary file is created with 0600 permissions
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(self.temp_name, 0o666 & ~umask)
+                if append and os.path.isfile(self.file_name):
+                    with open(self.file_name, 'rb') as f:
+                        shutil.copyfileobj(f, self.out, self.buffer_size)
+            else:
+                self.out = open(self.file_name, 'ab' if append else 'wb')
+        except OSError:
+            self._discard()
+            raise RoutineErr('Could not open file: {}'.format(self.file_name))
+
+    def _discard(self):
+        """Remove temporary file"""
+        if self.temp_name is not None:
+            try:
+                os.remove(self.temp_name)
+            except OSError:
+                pass
+            self.temp_name = None
+
+    def _append(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
 
+    def write(self, info, chain):
+        """Write record
 
-def to_file(exp_dir, chain):
+        :param info: record's description
+        :param chain: str or packing.PackedSequence with sequence
+
+        :raise RoutineErr: on file I/O error
+        """
+        self._append('>{}\n'.format(info))
+        length = len(chain)
+        if not self.width:
+            self._append('{}\n'.format(chain))
+            return
+        # Sequence is wrapped by blocks of whole lines
+        block = max(self.buffer_size - self.buffer_size % self.width,
+                    self.width)
+        for i in range(0, length, block):
+            piece = str(chain[i:i+block])
+            self._append('\n'.join(
+                piece[j:j+self.width]
+                for j in range(0, len(piece), self.width)) + '\n')
+
+    def comment(self, text):
+        """Write comment line (';'), e. g. error message
+
+        :param text: comment, line breaks are replaced by spaces
+
+        :raise RoutineErr: on file I/O error
+        """
+        self._append('; {}\n'.format(' '.join(str(text).splitlines())))
+
+    def write_chain(self, chain):
+        """Write all derived chains of Chain object which are available
+
+        Records are named by chain's description with suffix, see SUFFIXES.
+
+        :param chain: Chain object
+
+        :raise RoutineErr: on file I/O error
+        """
+        for name in chain.available():
+            self.write('{}-{}'.format(chain.info, SUFFIXES[name]),
+                       getattr(chain, name))
+
+    def flush(self):
+        """Write buffer into file
+
+        :raise RoutineErr: on file I/O error
+        """
+        if not self.parts:
+            return
+        data = ''.join(self.parts).encode('utf-8')
+        try:
+            with metrics.timer('tools.write'):
+                self.stream.write(data)
+        except OSError:
+            raise RoutineErr('Could not write file: {}'.format(self.file_name))
+        metrics.count('tools.bytes_written', len(data))
+        self.parts, self.size = list(), 0
+
+    def close(self):
+        """Write the rest of buffer and close file
+
+        Temporary file replaces target file if writing is atomic.
+
+        :raise RoutineErr: on file I/O error
+        """
+        try:
+            self.flush()
+            if self.stream is not self.out:
+                self.stream.close()
+            if self.owned:
+                self.out.close()
+            else:
+                self.out.flush()
+            if self.temp_name is not None:
+                os.replace(self.temp_name, self.file_name)
+                self.temp_name = None
+        except OSError:
+            raise RoutineErr('Could not write file: {}'.format(self.file_name))
+        finally:
+            self._discard()
+
+    def abort(self):
+        """Close file without writing the rest of buffer
+
+        Temporary file is removed, so target file stays untouched if writing
+        is atomic.
+        """
+        self.parts, self.size = list(), 0
+        if self.stream is not self.out:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+        if self.owned:
+            self.out.close()
+        self._discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def to_file(exp_dir, chains, width=LINE_WIDTH, file_name=None, append=False,
+            compression=None):
     """Write results to file
 
+    All chains are written into one file by FastaWriter.
+
     :param exp_dir: directory to export
-    :param chain: Chain object
+    :param chains: Chain object or iterable of Chain objects or
+                   (description, chain) tuples
+    :param width: width of sequence lines, 0 means no wrapping
+    :param file_name: name of file in exp_dir, default is timestamped
+    :param append: append to existing file
+    :param compression: compress output: 'gzip', 'bgzip' or 'xz'
 
     :raise RoutineErr: on file I/O error
 
-    :return True: on success
+    :return: path to written file
     """
-    now = datetime.datetime.today().strftime('%Y%m%d-%H%M%S-%f')
-    file_name = os.path.join(exp_dir, 'chains-{}.txt'.format(now))
-    try:
-        out = open(file_name, 'wt')
-    except OSError:
-        raise RoutineErr('Could not open file: {}'.format(file_name))
-    if chain.dna1:
-        out.write('>{}-DNA1\n'.format(chain.info))
-        out.write('{}\n'.format(chain.dna1))
-        out.write('\n')
-    if chain.dna2:
-        out.write('>{}-DNA2\n'.format(chain.info))
-        out.write('{}\n'.format(chain.dna2))
-        out.write('\n')
-    if chain.rna:
-        out.write('>{}-RNA\n'.format(chain.info))
-        out.write('{}\n'.format(chain.rna))
-        out.write('\n')
-    if chain.protein:
-        out.write('>{}-protein\n'.format(chain.info))
-        out.write('{}\n'.format(chain.protein))
-        out.write('\n')
-    out.close()
-    return True
+    if file_name is None:
+        now = datetime.datetime.today().strftime('%Y%m%d-%H%M%S-%f')
+        file_name = 'chains-{}.txt{}'.format(
+            now, COMPRESSIONS.get(compression, ''))
+    file_name = os.path.join(exp_dir, file_name)
+    if isinstance(chains, processing.Chain):
+        chains = (chains,)
+    with FastaWriter(file_name, width, append,
+                     compression=compression) as writer:
+        for chain in chains:
+            if isinstance(chain, processing.Chain):
+                writer.write_chain(chain)
+            else:
+                writer.write(*chain)
+    return file_name
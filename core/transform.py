@@ -0,0 +1,240 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module with translation tables compiled from processing patterns"""
+
+import re
+from core import patterns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Byte which marks characters outside of table's alphabet
+INVALID = 0
+# Start-codon (methionine)
+START = patterns.abc_to_rna['M'][0]
+# Size of blocks which chain is translated by if it is observed
+BLOCK_SIZE = 1 << 20
+# Minimal length of chain to be translated with NumPy
+NUMPY_THRESHOLD = 4096
+# Nucleotide which replaces invalid ones in tolerant processing
+MASK = 'N'
+# Amino acid of codons with masked nucleotides
+UNKNOWN = 'X'
+
+
+class Table(object):
+    """Translation table for bulk chain transforms
+
+    Table is compiled once from one of the maps in core.patterns and then
+    applied to a whole chain by bytes.translate(), so no per-nucleotide
+    Python code runs.  Characters absent in the map are translated into
+    INVALID byte, which gives validation in the same pass.
+    """
+
+    def __init__(self, mapping):
+        """
+        :param mapping: dict with single character keys and values
+        """
+        self.mapping = dict(mapping)
+        table = bytearray(256)
+        for k, v in mapping.items():
+            table[ord(k)] = ord(v)
+        self.table = bytes(table)
+        self._masked = None
+
+    def masked(self):
+        """Get the same table which keeps MASK nucleotides
+
+        :return: Table object
+        """
+        if self._masked is None:
+            self._masked = Table(dict(self.mapping, **{MASK: MASK}))
+        return self._masked
+
+    def apply(self, chain, observer=None):
+        """Translate chain
+
+        :param chain: str, bytes or bytearray
+        :param observer: function to be called with every block of chain
+                         (e. g., Stats.update), so chain is not scanned
+                         once more; chain is translated by blocks then
+
+        :return: tuple (translated chain of the same type as input,
+                 position of first invalid character or -1)
+        """
+        if observer is not None:
+            return self._apply_blocks(chain, observer)
+        if isinstance(chain, str):
+            # Non-ASCII characters turn into '?' one by one, so positions
+            # are kept and '?' is translated into INVALID as well
+            result = chain.encode('ascii', 'replace').translate(self.table)
+        else:
+            result = chain.translate(self.table)
+        position = result.find(INVALID)
+        if position != -1:
+            return None, position
+        if isinstance(chain, str):
+            return result.decode('ascii'), -1
+        return result, -1
+
+    def _apply_blocks(self, chain, observer):
+        """Translate chain by blocks of BLOCK_SIZE characters"""
+        results = list()
+        for i in range(0, len(chain), BLOCK_SIZE):
+            block = chain[i:i+BLOCK_SIZE]
+            result, position = self.apply(block)
+            if position != -1:
+                return None, i + position
+            observer(block)
+            results.append(result)
+        return chain[:0].join(results), -1
+
+
+def _compile_codons():
+    """Compile lookup arrays for vectorized translation
+
+    RNA nucleotides are coded by 3 bits (0-3, 4 for any other nucleotide),
+    so codon's index is a number from 0 to 511 which is looked up in arrays
+    of amino acids and stop flags.  Codons with unknown nucleotides are
+    translated into UNKNOWN.
+
+    :return: tuple (amino acids, stop flags)
+    """
+    amino = numpy.full(512, ord(UNKNOWN), dtype=numpy.uint8)
+    stop = numpy.zeros(512, dtype=bool)
+    for codon, a in patterns.rna_to_abc.items():
+        index = (patterns.rna.index(codon[0]) << 6 |
+                 patterns.rna.index(codon[1]) << 3 |
+                 patterns.rna.index(codon[2]))
+        amino[index] = ord(a)
+        stop[index] = codon in patterns.abc_to_rna['*']
+    return amino, stop
+
+
+class Codons(object):
+    """Codon table for translation of chains
+
+    Table is compiled for chains in an alphabet which is mapped to RNA
+    nucleotide by nucleotide, so e. g. protein of DNA chain is got without
+    intermediate RNA chain.
+    """
+
+    def __init__(self, mapping):
+        """
+        :param mapping: dict nucleotide -> RNA nucleotide, e. g.
+                        patterns.dna_to_rna
+        """
+        inverse = {v: k for k, v in mapping.items()}
+
+        def codon(rna):
+            return ''.join(inverse[n] for n in rna)
+
+        self.table = {codon(c): a for c, a in patterns.rna_to_abc.items()}
+        self.start = codon(START)
+        self.stops = tuple(codon(c) for c in patterns.abc_to_rna['*'])
+        # First in-frame stop-codon
+        self._stop_search = re.compile('(?:...)*?(?:{})'.format(
+            '|'.join(self.stops)), re.DOTALL)
+        if numpy is not None:
+            self.codes = numpy.full(256, 4, dtype=numpy.uint16)
+            for n, r in mapping.items():
+                self.codes[ord(n)] = patterns.rna.index(r)
+
+    def _translate_python(self, chain, to_stop):
+        """Translate chain codon by codon"""
+        protein = list()
+        for i in range(0, len(chain) - 2, 3):
+            codon = chain[i:i+3]
+            protein.append(self.table.get(codon, UNKNOWN))
+            if to_stop and codon in self.stops:
+                return ''.join(protein), True
+        return ''.join(protein), False
+
+    def _translate_numpy(self, chain, to_stop):
+        """Translate chain by vectorized operations over codon indices"""
+        index = self._index(chain)
+        if not to_stop:
+            return _amino[index].tobytes().decode('ascii'), False
+        stops = _stop[index]
+        stop = bool(stops.any())
+        if stop:
+            index = index[:int(stops.argmax()) + 1]
+        return _amino[index].tobytes().decode('ascii'), stop
+
+    def _index(self, chain):
+        """Get indices of whole codons of chain in lookup arrays"""
+        data = numpy.frombuffer(chain.encode('ascii', 'replace'),
+                                dtype=numpy.uint8)
+        data = self.codes[data[:len(data) - len(data) % 3]].reshape(-1, 3)
+        return data[:, 0] << 6 | data[:, 1] << 3 | data[:, 2]
+
+    def find_stop(self, chain):
+        """Find the first stop-codon in frame of chain's beginning
+
+        Chain is scanned by blocks, vectorized if NumPy is available.
+
+        :param chain: str with chain
+        :return: position of stop-codon or -1
+        """
+        size = BLOCK_SIZE - BLOCK_SIZE % 3
+        for i in range(0, len(chain), size):
+            block = chain[i:i+size]
+            if numpy is not None and len(block) >= NUMPY_THRESHOLD:
+                stops = _stop[self._index(block)]
+                if stops.any():
+                    return i + int(stops.argmax()) * 3
+            else:
+                match = self._stop_search.match(block)
+                if match is not None:
+                    return i + match.end() - 3
+        return -1
+
+    def translate(self, chain, to_stop=True):
+        """Translate chain into amino acids
+
+        NumPy is used if available and chain is long enough to pay for
+        vectorization, otherwise codons are translated one by one.
+
+        :param chain: str with valid chain
+        :param to_stop: stop at the first stop-codon; otherwise whole chain
+                        is translated and stop-codons are marked by '*'
+
+        :return: tuple (protein chain, True if translation stopped at
+                 stop-codon)
+        """
+        if numpy is not None and len(chain) >= NUMPY_THRESHOLD:
+            return self._translate_numpy(chain, to_stop)
+        return self._translate_python(chain, to_stop)
+
+
+def translate(rna, to_stop=True):
+    """Translate RNA codons into amino acids
+
+    :param rna: str with valid RNA chain
+    :param to_stop: stop at the first stop-codon; otherwise whole chain is
+                    translated and stop-codons are marked by '*'
+
+    :return: tuple (protein chain, True if translation stopped at
+             stop-codon)
+    """
+    return rna_codons.translate(rna, to_stop)
+
+
+if numpy is not None:
+    _amino, _stop = _compile_codons()
+
+dna_to_dna = Table(patterns.dna_to_dna)
+dna_to_rna = Table(patterns.dna_to_rna)
+rna_to_dna = Table(patterns.rna_to_dna)
+rna_check = Table(dict(zip(patterns.rna, patterns.rna)))
+dna_check = Table(dict(zip(patterns.dna, patterns.dna)))
+
+# RNA -> protein
+rna_codons = Codons(dict(zip(patterns.rna, patterns.rna)))
+# DNA -> protein of transcribed RNA
+dna_codons = Codons(patterns.dna_to_rna)
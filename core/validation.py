@@ -0,0 +1,168 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Module contains validation of chains
+
+Validators are compiled once at import.  Chain is checked by blocks in a
+single linear pass: alphabet by bytes.translate() and bytes.count(), stop-
+codon by transform.Codons.find_stop(), so no per-nucleotide Python code
+runs.  Invalid nucleotides may also be skipped or masked (tolerant mode)
+instead of failing.
+"""
+
+import collections
+from core import patterns, transform
+
+# Default maximal number of invalid positions kept in report
+MAX_ERRORS = 100
+# Tolerant modes: remove invalid nucleotides or replace them by MASK
+SKIP = 'skip'
+MASK = 'mask'
+MODES = (SKIP, MASK)
+
+_INVALID = transform.INVALID
+
+
+class Report(object):
+    """Result of validation
+
+    Attributes:
+        - length: length of chain
+        - invalid: number of invalid nucleotides
+        - positions: positions of the first invalid nucleotides (up to
+          max_errors)
+        - counts: collections.Counter of invalid nucleotides
+        - start: True if chain begins with start-codon, None if codons
+          are not checked
+        - stop: position of the first in-frame stop-codon or -1, None if
+          codons are not checked
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.invalid = 0
+        self.positions = list()
+        self.counts = collections.Counter()
+        self.start = None
+        self.stop = None
+
+    @property
+    def valid(self):
+        """True if no check has failed"""
+        if self.invalid:
+            return False
+        if self.start is None:
+            return True
+        return self.start and self.stop != -1 and not self.length % 3
+
+    @classmethod
+    def from_dict(cls, data):
+        """Make report from result of as_dict()"""
+        report = cls(data['length'])
+        report.invalid = data['invalid']
+        report.positions = list(data['positions'])
+        report.counts = collections.Counter(data['counts'])
+        report.start = data['start']
+        report.stop = data['stop']
+        return report
+
+    def as_dict(self):
+        """Get report as dict (e. g., for JSON)"""
+        return {
+            'length': self.length,
+            'valid': self.valid,
+            'invalid': self.invalid,
+            'positions': list(self.positions),
+            'counts': dict(self.counts),
+            'start': self.start,
+            'stop': self.stop
+        }
+
+
+class Validator(object):
+    """Validator of chains in the given alphabet"""
+
+    def __init__(self, alphabet, codons=None):
+        """
+        :param alphabet: str with valid nucleotides
+        :param codons: transform.Codons object to check start- and stop-
+                       codons, codons are not checked if not set
+        """
+        self.alphabet = alphabet
+        self.codons = codons
+        self.check = transform.Table(dict(zip(alphabet, alphabet)))
+        valid = alphabet.encode('ascii')
+        self._drop = bytes(b for b in range(256) if b not in valid)
+        self._valid = {ord(n): None for n in alphabet}
+        self._mask = transform.Table(dict(
+            {chr(b): transform.MASK for b in range(128)},
+            **{n: n for n in alphabet}))
+
+    def _account(self, report, block, offset, max_errors):
+        """Account invalid nucleotides of block"""
+        codes = block.encode('ascii', 'replace').translate(self.check.table)
+        count = codes.count(_INVALID)
+        if not count:
+            return
+        report.invalid += count
+        report.counts.update(block.translate(self._valid))
+        position = codes.find(_INVALID)
+        while position != -1 and len(report.positions) < max_errors:
+            report.positions.append(offset + position)
+            position = codes.find(_INVALID, position + 1)
+
+    def validate(self, chain, max_errors=MAX_ERRORS):
+        """Validate chain
+
+        :param chain: str with chain
+        :param max_errors: maximal number of invalid positions to keep
+
+        :return: Report object
+        """
+        report = Report(len(chain))
+        check_stop = self.codons is not None
+        if check_stop:
+            report.start = chain.startswith(self.codons.start)
+            report.stop = -1
+        size = transform.BLOCK_SIZE - transform.BLOCK_SIZE % 3
+        for i in range(0, len(chain), size):
+            block = chain[i:i+size]
+            self._account(report, block, i, max_errors)
+            if check_stop:
+                stop = self.codons.find_stop(block)
+                if stop != -1:
+                    report.stop = i + stop
+                    check_stop = False
+        return report
+
+    def clean(self, chain, mode, max_errors=MAX_ERRORS):
+        """Skip or mask invalid nucleotides
+
+        :param chain: str with chain
+        :param mode: SKIP - remove invalid nucleotides, MASK - replace them
+                     by transform.MASK
+        :param max_errors: maximal number of invalid positions to keep in
+                           report
+
+        :raise ValueError: if mode is unknown
+
+        :return: tuple (cleaned chain, Report of source chain)
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown tolerant mode - {}'.format(mode))
+        report = Report(len(chain))
+        size = transform.BLOCK_SIZE
+        for i in range(0, len(chain), size):
+            self._account(report, chain[i:i+size], i, max_errors)
+        if not report.invalid:
+            return chain, report
+        if mode == SKIP:
+            data = chain.encode('ascii', 'replace').translate(None, self._drop)
+            return data.decode('ascii'), report
+        return self._mask.apply(chain)[0], report
+
+
+dna = Validator(patterns.dna)
+rna = Validator(patterns.rna, transform.rna_codons)
+validators = {'DNA': dna, 'RNA': rna}
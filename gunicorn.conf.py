@@ -0,0 +1,26 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""Configuration of gunicorn for production serving:
+
+    gunicorn -c gunicorn.conf.py wsgi
+
+Requests are served by threads, CPU-bound processing is handed to shared
+pool of processes (OFFLOAD_* settings in config.py).
+"""
+
+import config
+
+
+bind = '{}:{}'.format(config.WEB_HOST, config.WEB_PORT)
+workers = config.WSGI_WORKERS
+worker_class = 'gthread'
+threads = config.WSGI_THREADS
+# Worker which has not responded for this time (in seconds) is restarted
+timeout = config.REQUEST_TIMEOUT * 2
+graceful_timeout = 30
+keepalive = 5
+# Worker processes of offload pool are started after fork, so the app is
+# not preloaded
+preload_app = False
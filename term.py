@@ -2,15 +2,25 @@
 # This file is the part of chainsyn, released under modified MIT license
 # See the file LICENSE.txt included in this distribution
 
-"""Main module of chainsyn"""
+"""Main module of chainsyn
+
+Run without arguments for interactive (curses) interface, or with
+processing mode (or 'kmers' or 'search' command) and input files for batch
+mode, see cli().
+"""
 
 
 import os
+import sys
+import json
+import argparse
 import datetime
-import curses
+import itertools
 import re
 import config
-from core import processing, tools
+# Modules of processing load NumPy, they are imported by functions which
+# need them, so help and usage errors are shown without delay
+from core import metrics
 
 
 def is_file(raw_path):
@@ -27,6 +37,23 @@ def is_file(raw_path):
         return False
 
 
+def split_region(raw_path):
+    """Split input data into path to file and region of record in it
+
+    :param raw_path: possible path to file with region, e. g.
+                     'genome.fa:chr1' or 'genome.fa:chr1:1000-2000'
+
+    :return: tuple (path, region) if raw_path starts with path to file
+    :return: None if it does not
+    """
+    position = raw_path.find(':')
+    while position != -1:
+        if is_file(raw_path[:position]) and raw_path[position + 1:]:
+            return raw_path[:position], raw_path[position + 1:]
+        position = raw_path.find(':', position + 1)
+    return None
+
+
 def generate_chain_info():
     """Generate info for manually entered chain"""
 
@@ -54,60 +81,700 @@ def input_mode(screen):
     screen.keypad(False)
 
 
+def open_cache(file_name):
+    """Open persistent cache of processing results
+
+    :param file_name: path to cache database or None
+
+    :return: cache.DiskCache object or None if file_name is not set
+    :raise RoutineErr: if cache could not be opened
+    """
+    if not file_name:
+        return None
+    from core import cache
+    return cache.DiskCache(file_name, config.DISK_CACHE_SIZE)
+
+
+# Derived chain -> its name on screen
+chain_labels = {
+    'dna1': 'first DNA chain',
+    'dna2': 'second DNA chain',
+    'rna': 'RNA chain',
+    'protein': 'protein chain'
+}
+
+
+def color_runs(text, colors):
+    """Split text into runs of characters of the same color
+
+    :param text: str
+    :param colors: dict: character -> curses attribute, other characters
+                   get default attribute
+
+    :return: iterator of (run, attribute) tuples
+    """
+    for attr, run in itertools.groupby(text, lambda n: colors.get(n, 0)):
+        yield ''.join(run), attr
+
+
+def view_sequence(screen, title, sequence, colors):
+    """Show sequence in viewport with paging
+
+    Only visible part of sequence is sliced (so packed sequence decodes
+    just this part) and drawn, one call per run of the same color, so time
+    of drawing does not depend on length of sequence.
+
+    Keys: space or PgDn - next page, b or PgUp - previous page, arrows -
+    scroll by line, Home and End - beginning and end of sequence, g - go to
+    position, q or Enter - close.
+
+    :param screen: main window
+    :param title: text on the first line
+    :param sequence: str or packing.PackedSequence
+    :param colors: dict: character -> curses attribute
+    """
+    length = len(sequence)
+    margin = len(str(length)) + 1
+    top = 0
+    while True:
+        height, width = screen.getmaxyx()
+        rows = max(height - 3, 1)
+        cols = max(width - margin - 1, 1)
+        lines = (length + cols - 1) // cols
+        top = min(max(top // cols, 0), max(lines - rows, 0)) * cols
+        # Draw page
+        screen.erase()
+        screen.addstr(0, 0, title[:width - 1])
+        page = str(sequence[top:top + rows * cols])
+        for row in range(rows):
+            line = page[row * cols:(row + 1) * cols]
+            if not line:
+                break
+            screen.addstr(row + 2, 0, '{:>{}} '.format(top + row * cols + 1,
+                                                      margin - 1))
+            for run, attr in color_runs(line, colors):
+                screen.addstr(run, attr)
+        status = '{}-{} of {}  [space/b] page  [g] go to  [q] close'.format(
+            min(top + 1, length), min(top + rows * cols, length), length)
+        screen.addstr(height - 1, 0, status[:width - 1])
+        screen.refresh()
+        # Handle key
+        key = screen.getkey()
+        if key in ('q', '\n', 'KEY_ENTER'):
+            break
+        elif key in (' ', 'KEY_NPAGE'):
+            top += rows * cols
+        elif key in ('b', 'KEY_PPAGE'):
+            top -= rows * cols
+        elif key == 'KEY_DOWN':
+            top += cols
+        elif key == 'KEY_UP':
+            top -= cols
+        elif key == 'KEY_HOME':
+            top = 0
+        elif key == 'KEY_END':
+            top = length
+        elif key == 'g':
+            screen.move(height - 1, 0)
+            screen.clrtoeol()
+            screen.addstr('Go to position: ')
+            input_mode(screen)
+            raw = screen.getstr()
+            selection_mode(screen)
+            try:
+                position = int(raw.decode())
+            except ValueError:
+                continue
+            top = min(max(position, 1), length) - 1
+
+
+def view_lines(screen, title, lines):
+    """Show lines of text (e. g., table) in viewport with paging
+
+    Keys: space or PgDn - next page, b or PgUp - previous page, arrows -
+    scroll by line, Home and End - beginning and end, q or Enter - close.
+
+    :param screen: main window
+    :param title: text on the first line
+    :param lines: list of str
+    """
+    top = 0
+    while True:
+        height, width = screen.getmaxyx()
+        rows = max(height - 3, 1)
+        top = min(max(top, 0), max(len(lines) - rows, 0))
+        # Draw page
+        screen.erase()
+        screen.addstr(0, 0, title[:width - 1])
+        for row, line in enumerate(lines[top:top + rows]):
+            screen.addstr(row + 2, 0, line[:width - 1])
+        status = '{}-{} of {}  [space/b] page  [q] close'.format(
+            min(top + 1, len(lines)), min(top + rows, len(lines)),
+            len(lines))
+        screen.addstr(height - 1, 0, status[:width - 1])
+        screen.refresh()
+        # Handle key
+        key = screen.getkey()
+        if key in ('q', '\n', 'KEY_ENTER'):
+            break
+        elif key in (' ', 'KEY_NPAGE'):
+            top += rows
+        elif key in ('b', 'KEY_PPAGE'):
+            top -= rows
+        elif key == 'KEY_DOWN':
+            top += 1
+        elif key == 'KEY_UP':
+            top -= 1
+        elif key == 'KEY_HOME':
+            top = 0
+        elif key == 'KEY_END':
+            top = len(lines)
+
+
 def print_results(screen, chain):
     """Print results of processing
 
     :param chain: Chain object
     :param screen: main window
     """
-    screen.clear()
     # Print results
-    if chain.dna1:
-        screen.addstr('{} - first DNA chain\n\n'.format(chain.info))
-        for n in chain.dna1:
-            screen.addstr(n, nucleo_color_pattern[n])
-            screen.refresh()
-        screen.getkey()
-        screen.addstr('\n\n\n')
-    if chain.dna2:
-        screen.addstr('{} - second DNA chain\n\n'.format(chain.info))
-        for n in chain.dna2:
-            screen.addstr(n, nucleo_color_pattern[n])
-            screen.refresh()
-        screen.getkey()
-        screen.addstr('\n\n\n')
-    if chain.rna:
-        screen.addstr('{} - RNA chain\n\n'.format(chain.info))
-        for n in chain.rna:
-            screen.addstr(n, nucleo_color_pattern[n])
-            screen.refresh()
-        screen.getkey()
-        screen.addstr('\n\n\n')
-    if chain.protein:
-        screen.addstr('{} - protein chain\n\n'.format(chain.info))
-        for n in chain.protein:
-            screen.addstr(n, abc_color_pattern[n])
-            screen.refresh()
-        screen.getkey()
-        screen.addstr('\n\n\n')
+    for name in chain.available():
+        colors = abc_color_pattern if name == 'protein' else \
+            nucleo_color_pattern
+        view_sequence(screen, '{} - {}'.format(chain.info, chain_labels[name]),
+                      getattr(chain, name), colors)
+    screen.clear()
+    screen.addstr('{} - stats\n\n'.format(chain.info))
     # Print stats
+    if chain.tolerant and chain.report and chain.report.invalid:
+        screen.addstr('Invalid nucleotides ({}): {}\n'.format(
+            chain.tolerant, chain.report.invalid))
     if chain.stats.get('nucleotides'):
         screen.addstr('Number of nucleotides: {}\n'
                       ''.format(chain.stats['nucleotides']))
     if chain.stats.get('codons'):
         screen.addstr('Number of codons: {}\n'.format(chain.stats['codons']))
-    if type(chain.stats.get('gc-content')) == float:
+    if type(chain.stats.get('gc_content')) == float:
         screen.addstr('GC-content: {:f} %\n'.format(chain.stats['gc_content']))
+    if chain.stats.get('ambiguous'):
+        screen.addstr('Ambiguous nucleotides: {}\n'.format(
+            ', '.join('{} - {}'.format(n, c) for n, c in
+                      sorted(chain.stats['ambiguous'].items()))))
     if chain.stats.get('mass'):
         screen.addstr('Protein\'s mass: {}\n'.format(chain.stats['mass']))
+    # Print metrics
+    if metrics.enabled:
+        screen.addstr('\nMetrics\n\n')
+        height, width = screen.getmaxyx()
+        for line in metrics.summary()[:max(height - screen.getyx()[0] - 2,
+                                          0)]:
+            screen.addstr('{}\n'.format(line[:width - 1]))
     screen.getkey()
 
 
+# Exit codes of batch mode
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+# Output formats of batch mode
+FORMATS = ('fasta', 'tsv', 'json')
+# Processing modes of batch mode (keys of batch.MODES)
+MODES = ('replication', 'transcription', 'translation')
+
+
+def parse_args(argv):
+    """Parse command line arguments of batch mode
+
+    :param argv: list of arguments (without program name)
+
+    :return: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog='term.py',
+        description='Process records in FASTA format (plain, gzip or xz) '
+                    'without interactive interface. Run without arguments '
+                    'for interactive mode, run "term.py kmers -h" for k-mer '
+                    'spectrum, "term.py search -h" for motif search.',
+        epilog='Exit codes: {} - success, {} - some records failed, {} - '
+               'wrong arguments, {} - input/output error.'.format(
+                   EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_ERROR))
+    parser.add_argument('mode', choices=MODES,
+                        help='processing mode')
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help='source file in FASTA format, "-" or none '
+                             'means standard input')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='fasta',
+                        help='output format: FASTA, TSV (id, output, '
+                             'error) or JSON lines (id, output, error, '
+                             'stats), default is %(default)s')
+    parser.add_argument('-w', '--width', type=int,
+                        default=config.EXPORT_WIDTH,
+                        help='width of FASTA lines, 0 means no wrapping, '
+                             'default is %(default)s')
+    parser.add_argument('-t', '--tolerant', choices=('skip', 'mask'),
+                        default=config.TOLERANT,
+                        help='skip or mask invalid nucleotides instead of '
+                             'failing')
+    parser.add_argument('-j', '--workers', type=int,
+                        default=config.BATCH_WORKERS,
+                        help='number of worker processes, default is '
+                             'number of CPUs')
+    parser.add_argument('--packed', action='store_true',
+                        default=config.PACKED_CHAINS,
+                        help='store chains by 2 bits per nucleotide')
+    parser.add_argument('--cache', metavar='FILE',
+                        default=config.DISK_CACHE_FILE,
+                        help='persistent cache of results (SQLite '
+                             'database), results of repeated records are '
+                             'taken from it')
+    _add_common_args(parser)
+    # Options may follow file names (Python 3.7+)
+    return getattr(parser, 'parse_intermixed_args', parser.parse_args)(argv)
+
+
+def _add_common_args(parser):
+    """Add options of metrics and profiling to parser of batch mode"""
+    parser.add_argument('--metrics', action='store_true',
+                        default=config.METRICS_ENABLED,
+                        help='print metrics of processing stages to '
+                             'standard error')
+    parser.add_argument('--profile', choices=metrics.PROFILES,
+                        help='print profile of the run to standard error')
+
+
+def parse_kmer_args(argv):
+    """Parse command line arguments of k-mer spectrum in batch mode
+
+    :param argv: list of arguments after 'kmers' command
+
+    :return: argparse.Namespace
+    """
+    from core import kmers
+    parser = argparse.ArgumentParser(
+        prog='term.py kmers',
+        description='Count k-mers of all records in FASTA format (plain, '
+                    'gzip or xz) and print the most frequent ones.',
+        epilog='Exit codes: {} - success, {} - wrong arguments, {} - '
+               'input/output error.'.format(EXIT_OK, EXIT_USAGE,
+                                            EXIT_ERROR))
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help='source file in FASTA format, "-" or none '
+                             'means standard input')
+    parser.add_argument('-k', type=int, default=config.KMER_SIZE,
+                        help='k-mer size, 1..{}, default is %(default)s'
+                             ''.format(kmers.MAX_K))
+    parser.add_argument('-n', '--top', type=int, default=config.KMER_TOP,
+                        help='number of the most frequent k-mers, 0 means '
+                             'all, default is %(default)s')
+    parser.add_argument('-c', '--canonical', action='store_true',
+                        default=config.KMER_CANONICAL,
+                        help='count k-mer and its reverse complement '
+                             'together')
+    parser.add_argument('-s', '--strand', dest='canonical',
+                        action='store_false',
+                        help='count k-mers of given strand only')
+    parser.add_argument('-f', '--format', choices=('tsv', 'json'),
+                        default='tsv',
+                        help='output format: TSV (k-mer, count) or JSON, '
+                             'default is %(default)s')
+    parser.add_argument('-j', '--workers', type=int,
+                        default=config.BATCH_WORKERS,
+                        help='number of worker processes, default is '
+                             'number of CPUs')
+    _add_common_args(parser)
+    args = getattr(parser, 'parse_intermixed_args',
+                   parser.parse_args)(argv)
+    if not 1 <= args.k <= kmers.MAX_K:
+        parser.error('k-mer size should be in range 1..{}'.format(
+            kmers.MAX_K))
+    return args
+
+
+def parse_search_args(argv):
+    """Parse command line arguments of motif search in batch mode
+
+    :param argv: list of arguments after 'search' command
+
+    :return: argparse.Namespace
+    """
+    from core import search
+    parser = argparse.ArgumentParser(
+        prog='term.py search',
+        description='Find exact occurrences of pattern in records of files '
+                    'in FASTA format (plain, gzip or xz). Index of every '
+                    'file is kept in sidecar file (file + "{}") and is '
+                    'built on the first search.'.format(search.SUFFIX),
+        epilog='Output is tab-separated record name, 0-based position and '
+               'strand. Exit codes: {} - pattern is found, {} - pattern is '
+               'not found, {} - wrong arguments, {} - input/output error.'
+               ''.format(EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_ERROR))
+    parser.add_argument('pattern', help='pattern to look for, e. g. GAATTC')
+    parser.add_argument('files', nargs='*', metavar='file',
+                        help='source file in FASTA format, "-" or none '
+                             'means standard input (indexed in memory)')
+    parser.add_argument('-r', '--reverse', action='store_true',
+                        default=config.SEARCH_REVERSE,
+                        help='look for reverse complement of pattern as '
+                             'well')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='maximal number of occurrences per file')
+    parser.add_argument('-c', '--count', action='store_true',
+                        help='print number of occurrences per file only')
+    parser.add_argument('-f', '--format', choices=('tsv', 'json'),
+                        default='tsv',
+                        help='output format: TSV or JSON lines (file, '
+                             'pattern, count, occurrences), default is '
+                             '%(default)s')
+    _add_common_args(parser)
+    return getattr(parser, 'parse_intermixed_args', parser.parse_args)(argv)
+
+
+def read_sources(files):
+    """Read records of all source files one by one
+
+    :param files: list of paths, "-" means standard input
+
+    :return: generator of (description, chain) tuples
+    :raise RoutineErr: on I/O error
+    """
+    from core import tools
+    for source_file in files or ['-']:
+        if source_file == '-':
+            records = tools.read_stream(sys.stdin.buffer)
+        else:
+            records = tools.read_fasta(source_file)
+        for record in records:
+            yield record
+
+
+def cli(argv):
+    """Batch mode: process records and write results to standard output
+
+    Records are read, processed and written one by one (see batch.run()),
+    so files larger than memory are processed too.  Errors of records are
+    reported to standard error and do not stop processing, as well as
+    metrics and profile of the run if requested.
+
+    :param argv: list of arguments (without program name)
+
+    :return: exit code
+    """
+    if argv and argv[0] == 'kmers':
+        args, run = parse_kmer_args(argv[1:]), _run_kmers
+    elif argv and argv[0] == 'search':
+        args, run = parse_search_args(argv[1:]), _run_search
+    else:
+        args, run = parse_args(argv), _run_cli
+    metrics.enable(args.metrics)
+    if args.profile:
+        with metrics.Profiler(args.profile) as profiler:
+            code = run(args)
+        sys.stderr.write(profiler.report)
+    else:
+        code = run(args)
+    if args.metrics:
+        sys.stderr.write(''.join('{}\n'.format(line)
+                                 for line in metrics.summary()))
+    return code
+
+
+def _run_cli(args):
+    """Process records of batch mode, see cli()"""
+    from core import processing, tools, batch
+    failed = False
+    out = sys.stdout.buffer
+    writer = tools.FastaWriter(out, width=args.width) \
+        if args.format == 'fasta' else None
+    try:
+        disk_cache = open_cache(args.cache)
+        records = read_sources(args.files)
+        for chain, error in batch.run(records, args.mode,
+                                      workers=args.workers,
+                                      chunk_size=config.BATCH_CHUNK_SIZE,
+                                      packed=args.packed,
+                                      tolerant=args.tolerant,
+                                      disk_cache=disk_cache):
+            if error:
+                failed = True
+                sys.stderr.write('{}: {}\n'.format(chain.info, error))
+            output = None if error else batch.output(chain, args.mode)
+            if writer is not None:
+                if output is not None:
+                    writer.write(chain.info, output)
+            elif args.format == 'tsv':
+                out.write('{}\t{}\t{}\n'.format(
+                    chain.info, output or '', error or '').encode('utf-8'))
+            else:
+                out.write(json.dumps({
+                    'id': chain.info,
+                    'output': None if output is None else str(output),
+                    'error': error,
+                    'stats': chain.stats
+                }).encode('utf-8') + b'\n')
+        if writer is not None:
+            writer.close()
+        out.flush()
+    except (BrokenPipeError, tools.RoutineErr,
+            processing.ProcessingErr) as err:
+        if writer is not None:
+            writer.abort()
+        if isinstance(err, BrokenPipeError) or \
+                isinstance(err.__context__, BrokenPipeError):
+            # Reader of output has gone (e. g., head), the rest is dropped
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            sys.stderr.write('{}\n'.format(err))
+        return EXIT_ERROR
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def _run_kmers(args):
+    """Count k-mers in batch mode and write the most frequent ones to
+    standard output, see cli()"""
+    from core import processing, tools, batch
+    out = sys.stdout.buffer
+    try:
+        counter = batch.count_kmers(read_sources(args.files), args.k,
+                                    args.canonical, workers=args.workers,
+                                    chunk_size=config.BATCH_CHUNK_SIZE)
+        top = counter.top(args.top or None)
+        if args.format == 'tsv':
+            for kmer, count in top:
+                out.write('{}\t{}\n'.format(kmer, count).encode('ascii'))
+        else:
+            out.write(json.dumps({
+                'k': args.k,
+                'canonical': args.canonical,
+                'total': counter.total,
+                'distinct': counter.distinct,
+                'top': list(top)
+            }).encode('ascii') + b'\n')
+        out.flush()
+    except (BrokenPipeError, tools.RoutineErr,
+            processing.ProcessingErr) as err:
+        if isinstance(err, BrokenPipeError):
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            sys.stderr.write('{}\n'.format(err))
+        return EXIT_ERROR
+    return EXIT_OK
+
+
+def _run_search(args):
+    """Search pattern in batch mode and write occurrences to standard
+    output, see cli()"""
+    from core import tools, search
+    out = sys.stdout.buffer
+    found = False
+    try:
+        for source_file in args.files or ['-']:
+            if source_file == '-':
+                index = search.SuffixIndex.build(
+                    tools.read_stream(sys.stdin.buffer))
+            else:
+                index = search.SuffixIndex.for_file(source_file)
+            with index:
+                count = index.count(args.pattern, args.reverse)
+                found = found or count > 0
+                hits = [] if args.count else index.find(
+                    args.pattern, args.reverse, args.limit)
+            if args.format == 'json':
+                out.write(json.dumps({
+                    'file': source_file,
+                    'pattern': args.pattern,
+                    'count': count,
+                    'occurrences': hits
+                }).encode('utf-8') + b'\n')
+            elif args.count:
+                out.write('{}\t{}\n'.format(source_file, count).encode(
+                    'utf-8'))
+            else:
+                for name, position, strand in hits:
+                    out.write('{}\t{}\t{}\n'.format(
+                        name, position, strand).encode('utf-8'))
+        out.flush()
+    except (BrokenPipeError, tools.RoutineErr) as err:
+        if isinstance(err, BrokenPipeError):
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            sys.stderr.write('{}\n'.format(err))
+        return EXIT_ERROR
+    return EXIT_OK if found else EXIT_FAILED
+
+
 def main(screen):
     """Main function
 
     :param screen: main window
     """
+    from core import processing, tools, faidx, batch, parallel, search
+
+    def read_line(prompt):
+        """Read line entered by user
+
+        :param prompt: text to show before input
+
+        :return: entered str
+        """
+        screen.addstr(prompt)
+        screen.refresh()
+        input_mode(screen)
+        y, x = screen.getyx()
+        input_data = screen.getstr(y, x)
+        selection_mode(screen)
+        screen.addstr('\n')
+        return input_data.decode()
+
+    def read_source(base):
+        """User input of source data
+
+        :param base: type of source chain: DNA or RNA
+
+        :return: list of (description, chain) tuples
+        :return None: if source could not be read
+        """
+        screen.clear()
+        screen.addstr('Enter source {} '
+                      'or path to source file in FASTA format\n'.format(base))
+        screen.addstr('(use path:name or path:name:begin-end '
+                      'to load one record)\n')
+        input_str = re.sub('\s+', '', read_line('> '))
+        source = list()
+        if is_file(input_str):
+            try:
+                source.extend(tools.from_file(input_str))
+            except tools.RoutineErr as err:
+                screen.addstr('{}\n'.format(str(err)))
+                screen.getkey()
+                return None
+        elif split_region(input_str):
+            path, region = split_region(input_str)
+            try:
+                with faidx.FastaIndex(path) as index:
+                    source.append((region, index.fetch_region(region)))
+            except tools.RoutineErr as err:
+                screen.addstr('{}\n'.format(str(err)))
+                screen.getkey()
+                return None
+        else:
+            source.append((generate_chain_info(), input_str.upper()))
+        return source
+
+    def gc_profile():
+        """User input, computing and printing of GC content / GC skew
+        profiles in sliding window
+
+        :return True: on success
+        :return False: if fails
+        """
+        source = read_source('DNA')
+        if source is None:
+            return False
+        try:
+            window = int(read_line('Window size [{}]: '.format(
+                config.GC_WINDOW)) or config.GC_WINDOW)
+            step = int(read_line('Window step [{}]: '.format(
+                config.GC_STEP)) or config.GC_STEP)
+        except ValueError:
+            screen.addstr('Window size and step should be integers\n')
+            screen.getkey()
+            return False
+        for info, raw in source:
+            chain = processing.Chain(info, raw)
+            lines = ['{:>12}  {:>12}  {:>10}'.format(
+                'Position', 'GC-content', 'GC-skew')]
+            try:
+                for start, gc, skew in chain.gc_profile(window, step):
+                    lines.append('{:>12}  {:>10f} %  {:>10f}'.format(
+                        start, gc, skew))
+            except processing.ProcessingErr as err:
+                lines.append(str(err))
+            view_lines(screen, '{} - GC profile'.format(info), lines)
+        return True
+
+    def kmer_spectrum():
+        """User input, counting and printing of the most frequent k-mers of
+        all source records
+
+        :return True: on success
+        :return False: if fails
+        """
+        source = read_source('DNA')
+        if source is None:
+            return False
+        try:
+            k = int(read_line('K-mer size [{}]: '.format(
+                config.KMER_SIZE)) or config.KMER_SIZE)
+            top = int(read_line('Number of k-mers [{}]: '.format(
+                config.KMER_TOP)) or config.KMER_TOP)
+        except ValueError:
+            screen.addstr('K-mer size and number should be integers\n')
+            screen.getkey()
+            return False
+        answer = read_line('Count reverse complements together (y/n) '
+                           '[{}]: '.format('y' if config.KMER_CANONICAL
+                                           else 'n'))
+        canonical = answer.lower().startswith('y') if answer \
+            else config.KMER_CANONICAL
+        workers = config.BATCH_WORKERS if len(source) > 1 else 1
+        try:
+            counter = batch.count_kmers(source, k, canonical,
+                                        workers=workers,
+                                        chunk_size=config.BATCH_CHUNK_SIZE)
+        except processing.ProcessingErr as err:
+            screen.addstr('{}\n'.format(str(err)))
+            screen.getkey()
+            return False
+        lines = ['{:>12}  {}'.format(count, kmer)
+                 for kmer, count in counter.top(top or None)]
+        view_lines(screen, '{}-mer spectrum{}: {} k-mers, {} distinct'.format(
+            k, ' (canonical)' if canonical else '', counter.total,
+            counter.distinct), lines)
+        return True
+
+    def motif_search():
+        """User input of source and patterns, searching and printing of
+        occurrences; index of source file is kept in sidecar file, so it is
+        built once
+
+        :return True: on success
+        :return False: if fails
+        """
+        screen.clear()
+        screen.addstr('Enter source chain or path to source file in FASTA '
+                      'format\n')
+        input_str = re.sub('\s+', '', read_line('> '))
+        try:
+            if is_file(input_str):
+                screen.addstr('Opening index...\n')
+                screen.refresh()
+                index = search.SuffixIndex.for_file(input_str)
+            else:
+                index = search.SuffixIndex.build(
+                    [(generate_chain_info(), input_str.upper())])
+        except tools.RoutineErr as err:
+            screen.addstr('{}\n'.format(str(err)))
+            screen.getkey()
+            return False
+        with index:
+            while True:
+                pattern = re.sub('\s+', '', read_line(
+                    'Pattern (empty to return): ')).upper()
+                if not pattern:
+                    break
+                count = index.count(pattern, config.SEARCH_REVERSE)
+                lines = ['{:>12}  {}  {}'.format(position, strand, name)
+                         for name, position, strand in index.find(
+                             pattern, config.SEARCH_REVERSE,
+                             config.SEARCH_LIMIT)]
+                if count > config.SEARCH_LIMIT:
+                    lines.append('...')
+                view_lines(screen, '{} - {} occurrences{}'.format(
+                    pattern, count, ' (both strands)'
+                    if config.SEARCH_REVERSE else ''), lines)
+                screen.clear()
+        return True
 
     def driver(process):
         """Common function which consists of user input, processing, writing to
@@ -128,52 +795,41 @@ def main(screen):
             base = 'DNA'
         if process == 'translation':
             base = 'RNA'
-        screen.clear()
-        screen.addstr('Enter source {} '
-                      'or path to source file in FASTA format\n'.format(base))
-        screen.addstr('> ')
-        screen.refresh()
-        input_mode(screen)
-        y, x = screen.getyx()
-        input_data = screen.getstr(y, x)
-        selection_mode(screen)
-        screen.addstr('\n')
-        input_str = re.sub('\s+', '', input_data.decode())
-        source = dict()
-        if is_file(input_str):
-            try:
-                source.update(tools.from_file(input_str))
-            except tools.RoutineErr as err:
-                screen.addstr('{}\n'.format(str(err)))
-                screen.getkey()
-                return False
-        else:
-            source.update({generate_chain_info(): input_str.upper()})
+        source = read_source(base)
+        if source is None:
+            return False
         # Process source data
         chains = list()
-        for s in source:
-            chain = processing.Chain(s, source[s])
-            try:
-                if process == 'replication':
-                    chain.replicate()
-                if process == 'transcription':
-                    chain.transcribe()
-                if process == 'translation':
-                    chain.translate()
-            except processing.ProcessingErr as err:
-                screen.addstr('{}\n'.format(str(err)))
+        if len(source) == 1 and len(source[0][1]) > config.SPLIT_CHUNK_SIZE:
+            # Single long chain is split into chunks processed in parallel
+            info, raw = source[0]
+            results = [parallel.process(info, raw, process,
+                                        workers=config.BATCH_WORKERS,
+                                        chunk_size=config.SPLIT_CHUNK_SIZE,
+                                        packed=config.PACKED_CHAINS,
+                                        tolerant=config.TOLERANT,
+                                        disk_cache=disk_cache)]
+        else:
+            workers = config.BATCH_WORKERS if len(source) > 1 else 1
+            results = batch.run(source, process, workers=workers,
+                                chunk_size=config.BATCH_CHUNK_SIZE,
+                                packed=config.PACKED_CHAINS,
+                                tolerant=config.TOLERANT,
+                                disk_cache=disk_cache)
+        for chain, error in results:
+            if error:
+                screen.addstr('{}\n'.format(error))
                 screen.getkey()
-            finally:
-                chain.collect_stats()
-                chains.append(chain)
+            chains.append(chain)
         # Export to text file
         if config.EXPORT_ENABLED:
-            for chain in chains:
-                try:
-                    tools.to_file(config.EXPORT_DIR, chain)
-                except tools.RoutineErr as err:
-                    screen.addstr('{}\n'.format(str(err)))
-                    screen.getkey()
+            try:
+                tools.to_file(config.EXPORT_DIR, chains,
+                              width=config.EXPORT_WIDTH,
+                              compression=config.EXPORT_COMPRESSION)
+            except tools.RoutineErr as err:
+                screen.addstr('{}\n'.format(str(err)))
+                screen.getkey()
         # Print results
         for chain in chains:
             print_results(screen, chain)
@@ -225,6 +881,13 @@ def main(screen):
         'E': curses.color_pair(4),
         'G': curses.color_pair(1)
     })
+    metrics.enable(config.METRICS_ENABLED)
+    try:
+        disk_cache = open_cache(config.DISK_CACHE_FILE)
+    except tools.RoutineErr as err:
+        screen.addstr('{}\n'.format(str(err)))
+        screen.getkey()
+        disk_cache = None
     # Init main window
     screen.scrollok(True)
     selection_mode(screen)
@@ -235,6 +898,9 @@ def main(screen):
         'replication': '1',
         'transcription': '2',
         'translation': '3',
+        'gc_profile': '4',
+        'kmers': '5',
+        'search': '6',
         'exit': '0'
     }
     while True:
@@ -252,6 +918,10 @@ def main(screen):
                       ''.format(menu_items['transcription']))
         screen.addstr('{} - Translation (RNA -> protein)\n'
                       ''.format(menu_items['translation']))
+        screen.addstr('{} - GC-content / GC-skew profile\n'
+                      ''.format(menu_items['gc_profile']))
+        screen.addstr('{} - K-mer spectrum\n'.format(menu_items['kmers']))
+        screen.addstr('{} - Motif search\n'.format(menu_items['search']))
         screen.addstr('{} - Exit\n'.format(menu_items['exit']))
         screen.addstr('\n')
         screen.refresh()
@@ -262,6 +932,12 @@ def main(screen):
             driver('transcription')
         if item == menu_items['translation']:
             driver('translation')
+        if item == menu_items['gc_profile']:
+            gc_profile()
+        if item == menu_items['kmers']:
+            kmer_spectrum()
+        if item == menu_items['search']:
+            motif_search()
         if item == menu_items['exit']:
             break
     input_mode(screen)
@@ -269,5 +945,9 @@ def main(screen):
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(cli(sys.argv[1:]))
+    # Interactive mode
+    import curses
     nucleo_color_pattern, abc_color_pattern = dict(), dict()
     curses.wrapper(main)
@@ -2,11 +2,19 @@
 # This file is the part of chainsyn, released under modified MIT license
 # See the file LICENSE.txt included in this distribution
 
-import os
+"""Development server of web interface
+
+Run with --debug to enable debugger and reloader.  For production use WSGI
+server, e. g.:
+
+    gunicorn -c gunicorn.conf.py wsgi
+"""
+
+import sys
+import config
 import web
-from web import config
 
 
-if not os.path.exists(config.FILE_UPLOAD_DIR):
-    os.mkdir(config.FILE_UPLOAD_DIR)
-web.web_interface.run(port=5555, debug=True)
+if __name__ == '__main__':
+    web.web_interface.run(host=config.WEB_HOST, port=config.WEB_PORT,
+                          debug='--debug' in sys.argv[1:], threaded=True)
@@ -2,4 +2,4 @@ import flask
 
 web_interface = flask.Flask(__name__)
 web_interface.config.from_object('config')
-from web import views
+from web import views, api, monitoring
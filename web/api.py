@@ -0,0 +1,420 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+import os
+import time
+import threading
+import shutil
+import tempfile
+import collections
+from concurrent import futures
+import flask
+from werkzeug import utils
+from . import config
+from web import web_interface
+from core import batch, cache, validation, jobs, tools, offload, processing, \
+    search, kmers
+
+
+# Estimated size (in bytes) of cached result besides its output: stats and
+# bookkeeping
+ENTRY_OVERHEAD = 8 << 10
+
+results = cache.LRUCache(web_interface.config.get('RESULT_CACHE_SIZE',
+                                                  cache.MAX_SIZE))
+disk_cache = cache.DiskCache(
+    web_interface.config['DISK_CACHE_FILE'],
+    web_interface.config.get('DISK_CACHE_SIZE', cache.DISK_MAX_SIZE)) \
+    if web_interface.config.get('DISK_CACHE_FILE') else None
+queue = jobs.JobQueue(
+    threads=web_interface.config.get('JOB_WORKERS', 1),
+    ttl=web_interface.config.get('JOB_TTL', jobs.TTL),
+    directory=web_interface.config.get('JOB_DIR'),
+    workers=web_interface.config.get('BATCH_WORKERS'),
+    disk_cache=disk_cache,
+    chunk_size=web_interface.config.get('BATCH_CHUNK_SIZE', batch.CHUNK_SIZE))
+pool = offload.Pool(
+    workers=web_interface.config.get('OFFLOAD_WORKERS'),
+    max_pending=web_interface.config.get('OFFLOAD_MAX_PENDING'),
+    queue_timeout=web_interface.config.get('OFFLOAD_QUEUE_TIMEOUT',
+                                           offload.QUEUE_TIMEOUT))
+
+# Opened indexes of reference files: path -> (time of index file,
+# search.SuffixIndex object)
+indexes = dict()
+indexes_lock = threading.Lock()
+
+
+def error(message, status=400):
+    """Make JSON response with error message"""
+    response = flask.jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+@web_interface.errorhandler(offload.OverloadErr)
+def overloaded(err):
+    """Offload pool has no free slots"""
+    response = error(str(err), 503)
+    response.headers['Retry-After'] = str(pool.queue_timeout)
+    return response
+
+
+@web_interface.errorhandler(futures.TimeoutError)
+def timed_out(err):
+    """Processing of request took longer than REQUEST_TIMEOUT"""
+    return error('Processing took too long, submit data as job instead', 504)
+
+
+def check_size(items):
+    """Check limits of synchronous request
+
+    :param items: list of (id, sequence, mode, tolerant) tuples
+
+    :return: error message or None if request fits the limits
+    """
+    settings = web_interface.config
+    if len(items) > settings.get('MAX_REQUEST_ITEMS', float('inf')):
+        return 'Too many sequences: {}, limit is {}'.format(
+            len(items), settings['MAX_REQUEST_ITEMS'])
+    length = sum(len(item[1]) for item in items)
+    if length > settings.get('MAX_REQUEST_SEQUENCE', float('inf')):
+        return 'Sequences are too long: {}, limit is {}, submit them as ' \
+               'job instead'.format(length, settings['MAX_REQUEST_SEQUENCE'])
+    return None
+
+
+def parse_items(data):
+    """Parse request of batch processing
+
+    :param data: decoded JSON: {'mode': default mode, 'tolerant': default
+                 tolerant mode, 'sequences': [{'id': ..., 'sequence': ...,
+                 'mode': ..., 'tolerant': ...} or sequence str, ...]}
+
+    :raise ValueError: if request is malformed
+
+    :return: list of (id, sequence, mode, tolerant) tuples
+    """
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('sequences'), list):
+        raise ValueError('Request should be object with list of sequences')
+    items = list()
+    for i, item in enumerate(data['sequences']):
+        if isinstance(item, str):
+            item = {'sequence': item}
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('sequence'), str):
+            raise ValueError('Sequence {} should be string or object with '
+                             'sequence'.format(i))
+        mode = item.get('mode', data.get('mode', 'replication'))
+        tolerant = item.get('tolerant', data.get('tolerant')) or None
+        if mode not in batch.MODES:
+            raise ValueError('Unknown mode of sequence {}: {}'.format(i, mode))
+        if tolerant is not None and tolerant not in validation.MODES:
+            raise ValueError('Unknown tolerant mode of sequence {}: {}'
+                             ''.format(i, tolerant))
+        sequence = ''.join(item['sequence'].split()).upper()
+        items.append((item.get('id', i), sequence, mode, tolerant))
+    return items
+
+
+def process_items(items):
+    """Process items, results of repeated inputs are taken from cache
+
+    Missed items are grouped by mode and processed by batch.run() in
+    offload pool within REQUEST_TIMEOUT (results are looked up in disk
+    cache there if it is enabled); equal items of one request are processed
+    once.
+
+    :param items: list of (id, sequence, mode, tolerant) tuples
+
+    :return: list of dicts with id, mode, output, error, stats and cached
+             flag in order of items
+    """
+    settings = web_interface.config
+    timeout = settings.get('REQUEST_TIMEOUT')
+    deadline = None if timeout is None else time.monotonic() + timeout
+    keys = [cache.make_key(mode, tolerant, sequence)
+            for _, sequence, mode, tolerant in items]
+    found = dict()
+    groups = collections.defaultdict(collections.OrderedDict)
+    for key, (_, sequence, mode, tolerant) in zip(keys, items):
+        if key in found or key in groups[mode, tolerant]:
+            continue
+        entry = results.get(key)
+        if entry is None:
+            groups[mode, tolerant][key] = sequence
+        else:
+            found[key] = entry
+    computed = dict()
+    for (mode, tolerant), records in groups.items():
+        if not records:
+            continue
+        for chain, err in batch.run(
+                records.items(), mode, workers=pool.workers,
+                chunk_size=settings.get('BATCH_CHUNK_SIZE', batch.CHUNK_SIZE),
+                tolerant=tolerant, pool=pool, disk_cache=disk_cache,
+                timeout=None if deadline is None
+                else max(deadline - time.monotonic(), 0)):
+            output = None if err else str(batch.output(chain, mode))
+            entry = {'output': output, 'error': err, 'stats': chain.stats}
+            computed[chain.info] = entry
+            results.put(chain.info, entry,
+                        len(output or err or '') + ENTRY_OVERHEAD)
+    response = list()
+    for key, (item_id, _, mode, _) in zip(keys, items):
+        entry = found.get(key)
+        cached = entry is not None
+        if not cached:
+            entry = computed[key]
+        response.append(dict(entry, id=item_id, mode=mode, cached=cached))
+    return response
+
+
+@web_interface.route('/api/batch', methods=['POST'])
+def api_batch():
+    """Process many sequences, each in its own mode
+
+    Request and response are JSON, see parse_items() and process_items();
+    response contains counters of result cache as well.
+    """
+    data = flask.request.get_json(silent=True)
+    try:
+        items = parse_items(data)
+    except ValueError as e:
+        return error(str(e))
+    message = check_size(items)
+    if message is not None:
+        return error(message, 413)
+    return flask.jsonify({'results': process_items(items),
+                          'cache': results.info()})
+
+
+def count_kmers(records, k, canonical):
+    """Count k-mers of records in offload pool within REQUEST_TIMEOUT
+
+    :param records: iterable of (description, chain) tuples
+
+    :raise ProcessingErr: if k is out of range
+
+    :return: kmers.Counter object
+    """
+    settings = web_interface.config
+    return batch.count_kmers(records, k, canonical, workers=pool.workers,
+                             chunk_size=settings.get('BATCH_CHUNK_SIZE',
+                                                     batch.CHUNK_SIZE),
+                             pool=pool,
+                             timeout=settings.get('REQUEST_TIMEOUT'))
+
+
+@web_interface.route('/api/kmers', methods=['POST'])
+def api_kmers():
+    """Count k-mers of all records and get the most frequent ones
+
+    Data in FASTA format (plain, gzip or xz) is taken from uploaded file
+    'file' or from request body and is counted as it arrives.  Query
+    parameters: k - k-mer size (1..31, default is 21), top - number of
+    k-mers (0 means all, default is 20), canonical - count k-mer and its
+    reverse complement together (1 or 0, default is 1).
+
+    Response is JSON: {'k': ..., 'canonical': ..., 'total': number of
+    counted k-mers, 'distinct': number of distinct k-mers, 'top': [[k-mer,
+    count], ...]}.
+    """
+    args = flask.request.args
+    try:
+        k = int(args.get('k', 21))
+        top = int(args.get('top', 20))
+    except ValueError:
+        return error('K-mer size and number of k-mers should be integers')
+    if not 1 <= k <= kmers.MAX_K:
+        return error('K-mer size should be in range 1..{}'.format(
+            kmers.MAX_K))
+    if top < 0:
+        return error('Number of k-mers should not be negative')
+    canonical = args.get('canonical', '1').lower() not in ('0', 'false',
+                                                           'no')
+    upload = flask.request.files.get('file')
+    records = tools.read_stream(
+        upload.stream if upload else flask.request.stream,
+        web_interface.config.get('STREAM_CHUNK_SIZE', tools.CHUNK_SIZE))
+    try:
+        counter = count_kmers(records, k, canonical)
+    except (processing.ProcessingErr, tools.RoutineErr) as e:
+        return error(str(e))
+    return flask.jsonify({'k': k, 'canonical': canonical,
+                          'total': counter.total,
+                          'distinct': counter.distinct,
+                          'top': list(counter.top(top or None))})
+
+
+def reference_index(file_name):
+    """Get search index of reference file
+
+    Missing or stale index is built in offload pool within REQUEST_TIMEOUT
+    and saved next to reference file; opened indexes are shared by
+    requests.
+
+    :param file_name: name of file in REFERENCE_DIR
+
+    :raise RoutineErr: on file I/O error
+
+    :return: search.SuffixIndex object
+    """
+    path = os.path.join(config.REFERENCE_DIR, utils.secure_filename(file_name))
+    index_file = search.index_path(path)
+    if search.stale(path, index_file):
+        pool.submit(search.build_index, path, index_file).result(
+            web_interface.config.get('REQUEST_TIMEOUT'))
+    try:
+        mtime = os.path.getmtime(index_file)
+    except OSError:
+        raise tools.RoutineErr('Could not open file: {}'.format(index_file))
+    with indexes_lock:
+        entry = indexes.get(path)
+        if entry is None or entry[0] != mtime:
+            # Replaced index is unmapped when requests drop it
+            entry = indexes[path] = (mtime, search.SuffixIndex.open(
+                index_file))
+        return entry[1]
+
+
+@web_interface.route('/api/search', methods=['GET'])
+def api_search():
+    """Find exact occurrences of pattern in reference file
+
+    Query parameters: file - name of file in REFERENCE_DIR, pattern -
+    pattern to look for, reverse - look for reverse complement as well (1
+    or 0, default is 0), limit - maximal number of occurrences (default is
+    SEARCH_LIMIT), count - get number of occurrences only (1 or 0).
+
+    Response is JSON: {'file': ..., 'pattern': ..., 'count': number of
+    occurrences, 'occurrences': [[record name, 0-based position, strand],
+    ...]}.
+    """
+    args = flask.request.args
+    if not args.get('file') or not args.get('pattern'):
+        return error('File and pattern should be given')
+    try:
+        limit = int(args.get('limit',
+                             web_interface.config.get('SEARCH_LIMIT', 100)))
+    except ValueError:
+        return error('Limit should be integer')
+    reverse = args.get('reverse', '0').lower() in ('1', 'true', 'yes')
+    try:
+        index = reference_index(args['file'])
+    except tools.RoutineErr as e:
+        return error(str(e), 404 if 'Could not open' in str(e) else 500)
+    count = index.count(args['pattern'], reverse)
+    hits = [] if args.get('count', '0').lower() in ('1', 'true', 'yes') \
+        else index.find(args['pattern'], reverse, limit)
+    return flask.jsonify({'file': args['file'], 'pattern': args['pattern'],
+                          'count': count, 'occurrences': hits})
+
+
+@web_interface.route('/api/cache', methods=['GET'])
+def api_cache():
+    """Get counters of result cache, counters of disk cache (if enabled) are
+    under 'disk' key"""
+    info = results.info()
+    if disk_cache is not None:
+        try:
+            info['disk'] = disk_cache.info()
+        except tools.RoutineErr as e:
+            info['disk'] = {'error': str(e)}
+    return flask.jsonify(info)
+
+
+def spool(stream):
+    """Copy request data into temporary file for background job
+
+    :param stream: binary file object
+
+    :return: path to file
+    """
+    fd, file_name = tempfile.mkstemp(
+        suffix='.fa', prefix='input-',
+        dir=web_interface.config.get('JOB_DIR'))
+    with os.fdopen(fd, 'wb') as out:
+        shutil.copyfileobj(stream, out,
+                           web_interface.config.get('STREAM_CHUNK_SIZE',
+                                                    tools.CHUNK_SIZE))
+    return file_name
+
+
+def spool_records(records):
+    """Write records into temporary file in FASTA format for background
+    job
+
+    :param records: iterable of (description, chain) tuples
+
+    :return: path to file
+    :raise RoutineErr: on I/O error
+    """
+    fd, file_name = tempfile.mkstemp(
+        suffix='.fa', prefix='input-',
+        dir=web_interface.config.get('JOB_DIR'))
+    os.close(fd)
+    try:
+        with tools.FastaWriter(file_name, width=0, atomic=False) as writer:
+            for info, chain in records:
+                writer.write(info, chain)
+    except tools.RoutineErr:
+        os.remove(file_name)
+        raise
+    return file_name
+
+
+@web_interface.route('/api/jobs', methods=['POST'])
+def api_jobs():
+    """Submit background job
+
+    Data in FASTA format (plain, gzip or xz) is taken from uploaded file
+    'file' or from request body.  Query parameters: mode - processing mode
+    (default is replication), tolerant - skip or mask invalid nucleotides.
+
+    Response is job's info with status 202, see jobs.Job.info().
+    """
+    mode = flask.request.args.get('mode', 'replication')
+    tolerant = flask.request.args.get('tolerant') or None
+    if mode not in batch.MODES:
+        return error('Unknown mode: {}'.format(mode))
+    if tolerant is not None and tolerant not in validation.MODES:
+        return error('Unknown tolerant mode: {}'.format(tolerant))
+    upload = flask.request.files.get('file')
+    input_file = spool(upload.stream if upload else flask.request.stream)
+    job = queue.submit(mode, input_file=input_file, tolerant=tolerant)
+    response = flask.jsonify(job.info())
+    response.status_code = 202
+    response.headers['Location'] = flask.url_for('api_job', job_id=job.id)
+    return response
+
+
+@web_interface.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job(job_id):
+    """Get state and progress of job (GET) or cancel it (DELETE)"""
+    if flask.request.method == 'DELETE':
+        if not queue.cancel(job_id):
+            return error('Job not found: {}'.format(job_id), 404)
+        return flask.jsonify({'id': job_id, 'cancelled': True})
+    job = queue.get(job_id)
+    if job is None:
+        return error('Job not found: {}'.format(job_id), 404)
+    return flask.jsonify(job.info())
+
+
+@web_interface.route('/api/jobs/<job_id>/result', methods=['GET'])
+def api_job_result(job_id):
+    """Get result of finished job in FASTA format"""
+    job = queue.get(job_id)
+    if job is None:
+        return error('Job not found: {}'.format(job_id), 404)
+    if job.state != jobs.DONE:
+        return error('Job is {}'.format(job.state), 409)
+    # Name of attachment is set by header: argument of send_file() for it
+    # differs between versions of Flask
+    response = flask.send_file(job.result_file, mimetype='text/plain')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename={}.fa'.format(job.id)
+    return response
@@ -1,2 +1,3 @@
-# Place to keep uploaded files
-FILE_UPLOAD_DIR = r'd:\tmp'
+# Place to keep reference files in FASTA format, records of which can be
+# loaded by region (file:name or file:name:begin-end)
+REFERENCE_DIR = r'd:\reference'
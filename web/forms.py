@@ -12,8 +12,35 @@ class EditorForm(flask_wtf.FlaskForm):
         'modes',
         choices=[('replication', 'Replication'),
                  ('transcription', 'Transcription'),
-                 ('translation', 'Translation')]
+                 ('translation', 'Translation'),
+                 ('gc_profile', 'GC profile'),
+                 ('kmers', 'K-mer spectrum'),
+                 ('search', 'Motif search')]
     )
+    window = wtforms.IntegerField(
+        'Window', default=100,
+        validators=[wtforms.validators.Optional(),
+                    wtforms.validators.NumberRange(min=1)])
+    step = wtforms.IntegerField(
+        'Step', default=50,
+        validators=[wtforms.validators.Optional(),
+                    wtforms.validators.NumberRange(min=1)])
+    k = wtforms.IntegerField(
+        'K-mer size', default=21,
+        validators=[wtforms.validators.Optional(),
+                    wtforms.validators.NumberRange(min=1, max=31)])
+    top = wtforms.IntegerField(
+        'Top k-mers', default=20,
+        validators=[wtforms.validators.Optional(),
+                    wtforms.validators.NumberRange(min=0)])
+    canonical = wtforms.BooleanField('Canonical k-mers', default=True)
+    pattern = wtforms.StringField('Pattern')
+    reverse = wtforms.BooleanField('Both strands', default=False)
+    tolerant = wtforms.SelectField(
+        'Invalid nucleotides',
+        choices=[('', 'Fail'), ('skip', 'Skip'), ('mask', 'Mask by N')],
+        default='')
     file_upload = file.FileField('Upload file')
+    region = wtforms.StringField('Reference region')
     input_area = wtforms.TextAreaField()
     run = wtforms.SubmitField('Run')
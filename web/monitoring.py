@@ -0,0 +1,78 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+import time
+import uuid
+import collections
+import flask
+from web import web_interface, api
+from core import metrics
+
+
+# Number of kept reports of profiled requests
+PROFILE_KEEP = 16
+
+metrics.enable(web_interface.config.get('METRICS_ENABLED', False))
+profiles = collections.OrderedDict()
+
+
+@web_interface.before_request
+def start_request():
+    """Start timer of request and its profile if requested by 'profile'
+    query parameter (cprofile or tracemalloc)"""
+    flask.g.request_start = time.perf_counter()
+    kind = flask.request.args.get('profile')
+    if kind in metrics.PROFILES and \
+            web_interface.config.get('PROFILING_ENABLED', False):
+        flask.g.profiler = metrics.Profiler(kind)
+        flask.g.profiler.__enter__()
+
+
+@web_interface.after_request
+def finish_request(response):
+    """Account time of request and keep its profile
+
+    Profile of streamed response covers the view only, not generation of
+    the body.
+    """
+    profiler = flask.g.pop('profiler', None)
+    if profiler is not None:
+        profiler.__exit__(None, None, None)
+        if profiler.report is not None:
+            profile_id = uuid.uuid4().hex
+            profiles[profile_id] = '{} {} ({})\n\n{}'.format(
+                flask.request.method, flask.request.path, profiler.kind,
+                profiler.report)
+            while len(profiles) > web_interface.config.get('PROFILE_KEEP',
+                                                           PROFILE_KEEP):
+                profiles.popitem(last=False)
+            response.headers['X-Profile'] = flask.url_for(
+                'metrics_profile', profile_id=profile_id)
+    start = flask.g.pop('request_start', None)
+    if start is not None and flask.request.endpoint:
+        metrics.observe('web.{}'.format(flask.request.endpoint),
+                        time.perf_counter() - start)
+        metrics.count('web.requests')
+    return response
+
+
+@web_interface.route('/metrics', methods=['GET'])
+def metrics_exposition():
+    """Metrics in Prometheus text exposition format"""
+    cache = api.results.info()
+    gauges = {'cache.{}'.format(key): value for key, value in cache.items()}
+    gauges['jobs'] = len(api.queue.jobs)
+    gauges.update(('offload.{}'.format(key), value)
+                  for key, value in api.pool.info().items())
+    return flask.Response(metrics.exposition(gauges=gauges),
+                          mimetype='text/plain; version=0.0.4')
+
+
+@web_interface.route('/metrics/profiles/<profile_id>', methods=['GET'])
+def metrics_profile(profile_id):
+    """Report of profiled request"""
+    report = profiles.get(profile_id)
+    if report is None:
+        return api.error('Profile not found: {}'.format(profile_id), 404)
+    return flask.Response(report, mimetype='text/plain')
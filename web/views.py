@@ -4,11 +4,200 @@
 
 import os
 import re
+import itertools
 import flask
-from werkzeug import utils
+from werkzeug import utils, exceptions
 from . import config
-from web import web_interface, forms
-from core import processing, tools
+from web import web_interface, forms, api
+from core import processing, tools, faidx, batch, validation, offload, \
+    search
+
+
+def run_batch(records, mode, tolerant=None):
+    """Process records and prepare results for the template
+
+    :param records: list of (description, chain) tuples
+    :param mode: processing mode
+    :param tolerant: validation.SKIP or validation.MASK to skip or mask
+                     invalid nucleotides instead of failing
+
+    :return: tuple (output, stats); stats are shown for single record only
+    """
+    settings = web_interface.config
+    results = batch.run(records, mode, workers=api.pool.workers,
+                        chunk_size=settings.get('BATCH_CHUNK_SIZE',
+                                                batch.CHUNK_SIZE),
+                        tolerant=tolerant, pool=api.pool,
+                        timeout=settings.get('REQUEST_TIMEOUT'),
+                        disk_cache=api.disk_cache)
+    if len(records) == 1:
+        chain, error = next(results)
+        if error:
+            return error, None
+        output = batch.output(chain, mode)
+        return output, chain.stats if output else None
+    output = list()
+    for chain, error in results:
+        output.append('>{}\n{}'.format(chain.info,
+                                        error or batch.output(chain, mode)))
+    return '\n'.join(output), None
+
+
+def submitted(job):
+    """Prepare message about submitted job for the template"""
+    return 'Submitted as job {0}\nProgress: {1}\nResult: {1}/result'.format(
+        job.id, flask.url_for('api_job', job_id=job.id))
+
+
+def read_upload(stream, mode, tolerant=None):
+    """Read records of uploaded file
+
+    Upload is parsed as it is read while total length of records fits the
+    limit of processing in the request (JOB_THRESHOLD in processing modes,
+    MAX_REQUEST_SEQUENCE in others).  Larger upload in processing mode is
+    submitted as job: records which have been read and the rest of upload
+    are written into input file of job; in other modes it is rejected.
+
+    :param stream: binary file object
+    :param mode: processing mode
+    :param tolerant: validation.SKIP or validation.MASK to skip or mask
+                     invalid nucleotides instead of failing
+
+    :return: tuple (list of (description, chain) tuples or None if upload
+             is not processed in the request, message for the template)
+    :raise RoutineErr: on I/O error
+    """
+    settings = web_interface.config
+    limit = settings.get('MAX_REQUEST_SEQUENCE', float('inf'))
+    if mode in batch.MODES:
+        limit = min(limit, settings.get('JOB_THRESHOLD', float('inf')))
+    source = tools.read_stream(
+        stream, settings.get('STREAM_CHUNK_SIZE', tools.CHUNK_SIZE))
+    records, length = list(), 0
+    for record in source:
+        records.append(record)
+        length += len(record[1])
+        if length > limit:
+            break
+    else:
+        return records, ''
+    if mode not in batch.MODES:
+        return None, 'Uploaded file is too large, limit is {} ' \
+                     'nucleotides'.format(limit)
+    input_file = api.spool_records(itertools.chain(records, source))
+    job = api.queue.submit(mode, input_file=input_file, tolerant=tolerant)
+    return None, submitted(job)
+
+
+def run_profile(records, window, step):
+    """Compute GC profiles of records and prepare them for the template
+
+    :param records: list of (description, chain) tuples
+    :param window: window size in nucleotides
+    :param step: window step in nucleotides
+
+    :return: str with tab-separated profiles
+    """
+    settings = web_interface.config
+    output = list()
+    for info, columns, error in batch.gc_profiles(
+            records, window, step, workers=api.pool.workers,
+            chunk_size=settings.get('BATCH_CHUNK_SIZE', batch.CHUNK_SIZE),
+            pool=api.pool, timeout=settings.get('REQUEST_TIMEOUT')):
+        if len(records) > 1:
+            output.append('>{}'.format(info))
+        output.append('position\tgc_content\tgc_skew')
+        output.extend('{}\t{}\t{}'.format(*row) for row in zip(*columns))
+        if error:
+            output.append(error)
+    return '\n'.join(output)
+
+
+def run_kmers(records, k, canonical, top):
+    """Count k-mers of all records and prepare the most frequent ones for
+    the template
+
+    :param records: list of (description, chain) tuples
+    :param k: k-mer size
+    :param canonical: count k-mer and its reverse complement together
+    :param top: number of k-mers, 0 means all
+
+    :return: str with tab-separated k-mers and counts
+    """
+    try:
+        counter = api.count_kmers(records, k, canonical)
+    except processing.ProcessingErr as e:
+        return str(e)
+    output = ['kmer\tcount']
+    output.extend('{}\t{}'.format(kmer, count)
+                  for kmer, count in counter.top(top or None))
+    return '\n'.join(output)
+
+
+def run_search(records, pattern, reverse):
+    """Find occurrences of pattern in records and prepare them for the
+    template
+
+    :param records: list of (description, chain) tuples
+    :param pattern: pattern to look for
+    :param reverse: look for reverse complement of pattern as well
+
+    :return: str with count and tab-separated occurrences
+    """
+    settings = web_interface.config
+    limit = settings.get('SEARCH_LIMIT')
+    # Index is built in offload pool, not on the request's thread
+    count, hits = api.pool.submit(
+        search.lookup, records, pattern, reverse, limit).result(
+            settings.get('REQUEST_TIMEOUT'))
+    output = ['occurrences: {}'.format(count), 'name\tposition\tstrand']
+    output.extend('{}\t{}\t{}'.format(*hit) for hit in hits)
+    if limit is not None and count > limit:
+        output.append('...')
+    return '\n'.join(output)
+
+
+@web_interface.route('/stream', methods=['POST'])
+def stream():
+    """Process data in FASTA format from request body as it arrives
+
+    Body may be compressed by gzip or xz.  Records are parsed and processed
+    one by one and results are sent back in FASTA format as chunked
+    response, so neither request nor response is kept in memory; body is
+    read no faster than results are sent.  Errors of single records are
+    written instead of their results, errors which break the stream are
+    written as comment lines (';').
+
+    Query parameters: mode - processing mode (default is replication),
+    tolerant - skip or mask invalid nucleotides.
+    """
+    mode = flask.request.args.get('mode', 'replication')
+    tolerant = flask.request.args.get('tolerant') or None
+    if mode not in batch.MODES:
+        flask.abort(400, 'Unknown mode: {}'.format(mode))
+    if tolerant is not None and tolerant not in validation.MODES:
+        flask.abort(400, 'Unknown tolerant mode: {}'.format(tolerant))
+    settings = web_interface.config
+    records = tools.read_stream(
+        flask.request.stream,
+        settings.get('STREAM_CHUNK_SIZE', tools.CHUNK_SIZE))
+
+    def generate():
+        try:
+            for chain, error in batch.run(
+                    records, mode, workers=api.pool.workers,
+                    chunk_size=settings.get('BATCH_CHUNK_SIZE',
+                                          batch.CHUNK_SIZE),
+                    tolerant=tolerant, pool=api.pool,
+                    disk_cache=api.disk_cache):
+                yield '>{}\n{}\n'.format(
+                    chain.info, error or batch.output(chain, mode))
+        except (tools.RoutineErr, offload.OverloadErr,
+                exceptions.HTTPException) as err:
+            yield '; {}\n'.format(err)
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype='text/plain')
 
 
 @web_interface.route('/', methods=['GET', 'POST'])
@@ -20,40 +209,71 @@ def main():
         output = ''
     else:
         if editor_form.validate_on_submit():
-            if editor_form.file_upload.data:
+            records = list()
+            if editor_form.region.data:
+                # Region is not copied into the editor, it may be large
+                editor_form.input_area.data = ''
+                file_name, _, region = editor_form.region.data.partition(':')
+                file_name = os.path.join(config.REFERENCE_DIR,
+                                         utils.secure_filename(file_name))
+                try:
+                    with faidx.FastaIndex(file_name) as index:
+                        records.append((region, index.fetch_region(region)))
+                except tools.RoutineErr as e:
+                    output = str(e)
+                    return flask.render_template('main.html',
+                                                 editor_form=editor_form,
+                                                 output=output, stats=None)
+            elif editor_form.file_upload.data:
+                # Upload is not copied into the editor, it may be large
                 editor_form.input_area.data = ''
-                f = editor_form.file_upload.data
-                file_name = os.path.join(config.FILE_UPLOAD_DIR,
-                                         utils.secure_filename(f.filename))
-                f.save(file_name)
                 try:
-                    data = tools.from_file(file_name)
-                    editor_form.input_area.data = list(data.values())[0]
+                    records, output = read_upload(
+                        editor_form.file_upload.data.stream,
+                        editor_form.mode.data,
+                        editor_form.tolerant.data or None)
                 except tools.RoutineErr as e:
                     output = str(e)
+                if output:
                     return flask.render_template('main.html',
                                                  editor_form=editor_form,
                                                  output=output, stats=None)
             else:
                 editor_form.input_area.data = \
                     re.sub('\s+', '', editor_form.input_area.data)
-            chain = processing.Chain('', editor_form.input_area.data)
-            try:
-                if editor_form.mode.data == 'replication':
-                    output = chain.replicate()
-                elif editor_form.mode.data == 'transcription':
-                    output = chain.transcribe()
-                elif editor_form.mode.data == 'translation':
-                    output = chain.translate()
-                else:
-                    output = ''
-                if output:
-                    stats = chain.collect_stats()
-                else:
-                    stats = None
-            except processing.ProcessingErr as e:
-                output = str(e)
+                records.append(('', editor_form.input_area.data))
+            # Limits of processing in the request
+            limited = api.check_size(records) if records else None
+            if records and editor_form.mode.data in batch.MODES and \
+                    sum(len(r[1]) for r in records) > \
+                    web_interface.config.get('JOB_THRESHOLD', float('inf')):
+                # Large submission is processed in background
+                job = api.queue.submit(editor_form.mode.data, records,
+                                       tolerant=editor_form.tolerant.data or
+                                       None)
+                output = submitted(job)
                 stats = None
+            elif limited:
+                output = limited
+                stats = None
+            elif records and editor_form.mode.data == 'gc_profile':
+                output = run_profile(records, editor_form.window.data or 100,
+                                     editor_form.step.data)
+                stats = None
+            elif records and editor_form.mode.data == 'search':
+                output = run_search(records, editor_form.pattern.data or '',
+                                    editor_form.reverse.data)
+                stats = None
+            elif records and editor_form.mode.data == 'kmers':
+                output = run_kmers(records, editor_form.k.data or 21,
+                                   editor_form.canonical.data,
+                                   editor_form.top.data)
+                stats = None
+            elif records:
+                output, stats = run_batch(records, editor_form.mode.data,
+                                          editor_form.tolerant.data or None)
+            else:
+                output, stats = '', None
         else:
             output = ''
             stats = None
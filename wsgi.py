@@ -0,0 +1,7 @@
+# Copyright (c) 2016-2023 Kirill 'Kolyat' Kiselnikov
+# This file is the part of chainsyn, released under modified MIT license
+# See the file LICENSE.txt included in this distribution
+
+"""WSGI entry point of web interface, e. g. for gunicorn or uWSGI"""
+
+from web import web_interface as application